@@ -1,24 +1,61 @@
-from flask import Flask, request, jsonify, send_from_directory, render_template
+from flask import Flask, Response, request, jsonify, send_file, send_from_directory, render_template
 from flask_cors import CORS
-import boto3
-from botocore.exceptions import ClientError, NoCredentialsError
-import h5py
-import io
+from botocore.exceptions import ClientError
 import os
 import json
-import humanize
+import base64
+import binascii
+import secrets
+import importlib
+import time
+from urllib.parse import quote
 from datetime import datetime
 import tempfile
+from werkzeug.exceptions import HTTPException
 from werkzeug.utils import secure_filename
 from pathlib import Path
 
 #local
-from utils.helpers import upload_with_progress, generate_content_hash
+from utils.helpers import TqdmUploadCallback
+from utils.catalog import CatalogGeneration, S3Catalog
+from utils.fetch import fetch_batch
+from utils.lazy import lazy_import
+from utils.s3 import S3ClientProxy, pool_stats
+from utils.presign import PresignCache, PRESIGN_BATCH_LIMIT, PRESIGN_EXPIRY
+from utils.bundle import iter_tar, tar_size, BUNDLE_MAX_FILES
+from utils.hash_index import HashIndex
+from utils.ingest import (CountingReader, IngestStats, MultipartFileReader, stream_to_s3, hash_s3_object,
+                          staging_key, promote_staged_object, STAGING_PREFIX, INGEST_PART_SIZE)
+from utils.admission import AdmissionController, UPLOAD_RETRY_AFTER
+from utils.multipart import (UploadSessions, choose_part_size, list_uploaded_parts, presign_part_urls,
+                             PART_URL_BATCH_LIMIT, PART_URL_EXPIRY)
+from utils.s3file import S3RangeFile, BlockCache
+from utils.hashing import Crc32, new_hasher, hash_id, CONTENT_HASH_ALGORITHM
+from utils.jobs import JobQueue, new_job_id
+from utils.manifest import ManifestCache, build_manifest, MANIFEST_BLOCK_SIZE
+from utils.slicing import parse_selection, selection_nbytes, iter_npy, arrow_bytes, SLICE_MAX_BYTES
+from utils.preflight import (UploadTokens, HeaderFile, find_hdf5_signature, parse_crc32,
+                             PREFLIGHT_HEADER_BYTES, UPLOAD_TOKEN_MAX_AGE)
+from utils.metrics import metrics, init_app as init_metrics, prometheus_text
+from utils.snapshot import (write_snapshot, load_snapshot, current_snapshot, snapshot_filename,
+                            SNAPSHOT_DIR, SNAPSHOT_INTERVAL, ENCODINGS)
+from utils.repack import repack_hdf5, REPACK_ON_INGEST
+from utils.summary import summarize_hdf5, put_summary, get_summary
+from utils.aggregate import (AggregateCache, aggregate, group_members, parse_reduction, result_summary,
+                             cache_key as aggregate_cache_key, AGGREGATE_MAX_FILES)
+
+# Only some routes need these, warm_up_worker() loads them before a worker takes requests
+WARM_UP_MODULES = ('boto3', 'h5py', 'numpy', 'humanize')
+h5py = lazy_import('h5py')
+np = lazy_import('numpy')
+humanize = lazy_import('humanize')
 
 app = Flask(__name__,
             template_folder='templates',
             static_folder='static')
 CORS(app)  # Enable CORS for frontend
+# Route, template, JSON and S3 call timings for /metrics (utils/metrics.py)
+init_metrics(app)
 
 # Configuration
 S3_BUCKET = os.environ.get('S3_BUCKET', 'your-s3-bucket-name')
@@ -26,16 +63,21 @@ AWS_REGION = os.environ.get('AWS_REGION', 'us-east-1')
 UPLOAD_FOLDER = 'uploads'
 ALLOWED_EXTENSIONS = {'hdf5', 'h5'}
 UPLOAD_SIZE_LIMIT=30 #GB
+FILES_PAGE_LIMIT = int(os.environ.get('FILES_PAGE_LIMIT', 1000))  # default page size of /api/s3/files
+FILES_PAGE_LIMIT_MAX = int(os.environ.get('FILES_PAGE_LIMIT_MAX', 5000))
+# Public download origin for the bucket, download manifests fall back to presigned URLs when empty
+CLOUDFRONT_URL = os.environ.get('CLOUDFRONT_URL', 'https://d3ctas52djku5l.cloudfront.net')
+# Most seconds a new worker's warm-up waits for the catalog refresh, gunicorn kills workers silent for `timeout`
+WARM_UP_TIMEOUT = float(os.environ.get('WARM_UP_TIMEOUT', 10))
+# Signs upload tokens. Set it in production, a random key only holds until the app restarts
+app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY') or secrets.token_hex(32)
 
 # Ensure upload folder exists
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
-# Initialize S3 client
-try:
-    s3_client = boto3.client('s3', region_name=AWS_REGION)
-except NoCredentialsError:
-    print("AWS credentials not found. Please configure your credentials.")
-    s3_client = None
+# S3 client, created per worker process after fork and shared by its threads
+# (pool size, keep-alive and retries are configured in utils/s3.py)
+s3_client = S3ClientProxy()
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
@@ -68,27 +110,70 @@ def extract_hdf5_metadata(file_path):
     
     return metadata
 
+def head_object_metadata(key):
+    """Get metadata from S3 object attributes, raising on failure"""
+    response = s3_client.head_object(Bucket=S3_BUCKET, Key=key)
+    
+    # Get custom metadata from object metadata
+    metadata = response.get('Metadata', {})
+    
+    # Ensure all required fields exist
+    required_fields = ['dataset_name', 'subjectID', 'preprocessing_pipeline', 'owner_name', 
+                      'owner_email', 'beta_pipeline', 'github_url', 'publication_url']
+    for field in required_fields:
+        if field not in metadata:
+            metadata[field] = ""
+    
+    return metadata
+
 def get_s3_object_metadata(key):
     """Get metadata from S3 object tags and attributes"""
     try:
-        # Get object metadata
-        response = s3_client.head_object(Bucket=S3_BUCKET, Key=key)
-        
-        # Get custom metadata from object metadata
-        metadata = response.get('Metadata', {})
-        
-        # Ensure all required fields exist
-        required_fields = ['dataset_name', 'subjectID', 'preprocessing_pipeline', 'owner_name', 
-                          'owner_email', 'beta_pipeline', 'github_url', 'publication_url']
-        for field in required_fields:
-            if field not in metadata:
-                metadata[field] = ""
-        
-        return metadata
+        return head_object_metadata(key)
     except Exception as e:
         print(f"Error getting metadata for {key}: {e}")
         return {}
 
+def get_s3_objects_metadata(keys):
+    """Get metadata for many objects, HEADing them concurrently"""
+    return fetch_batch(head_object_metadata, keys)
+
+# Bumped by whichever process changes the bucket, so the catalogs of all workers refresh
+catalog_generation = CatalogGeneration()
+# In-memory index of the bucket, refreshed incrementally from the listing
+# (only refreshed by requests that passed the `if not s3_client:` check)
+catalog = S3Catalog(s3_client, S3_BUCKET, get_s3_objects_metadata, exclude_prefixes=[STAGING_PREFIX],
+                    generation=catalog_generation)
+# Start from the last snapshot, so the first requests do not wait on a full listing
+snapshot = load_snapshot()
+if snapshot:
+    catalog.seed(snapshot[0])
+
+def warm_up_worker():
+    """Get a new worker ready for its first request, from gunicorn's post_worker_init hook
+
+    Workers forked from a preloaded master inherit its catalog, seeded from
+    whatever snapshot was current when the master started. This loads the
+    lazily imported dependencies, builds the worker's S3 client, re-seeds the
+    catalog from the newest snapshot and refreshes it, so only keys changed
+    since that snapshot are HEADed, all before the worker accepts requests.
+    A refresh slower than WARM_UP_TIMEOUT carries on in the background.
+    """
+    start = time.perf_counter()
+    for name in WARM_UP_MODULES:
+        importlib.import_module(name)
+    if s3_client:
+        latest = load_snapshot()
+        if latest and latest[1] != catalog.version:
+            catalog.seed(latest[0], replace=True)
+        try:
+            if not catalog.refresh_within(WARM_UP_TIMEOUT):
+                print(f"Catalog refresh still running after {WARM_UP_TIMEOUT} s of warm-up")
+        except Exception as e:
+            # The first request retries it
+            print(f"Catalog refresh failed during warm-up: {e}")
+    print(f"Worker {os.getpid()} warmed up in {time.perf_counter() - start:.2f} s")
+
 def list_s3_crc32():
     """
     Get the crc32 hashes for each object in the s3 bucket and return as dict,
@@ -99,23 +184,14 @@ def list_s3_crc32():
         return {'error': 'S3 client not configured'}
     
     try:
-        # List objects in bucket
-        response = s3_client.list_objects_v2(Bucket=S3_BUCKET)
-        
-        if 'Contents' not in response:
-            return {}
-        
+        # Dedup must see uploads from other workers, so always refresh.
+        # The refresh only HEADs keys that are new since the last listing.
+        catalog.refresh()
+
         files_data = {}
-        for obj in response['Contents']:
-            key = obj['Key']
-            
-            # Only process HDF5 files
-            if not (key.endswith('.hdf5') or key.endswith('.h5')):
-                continue
-            
-            # Get metadata for this file
-            metadata = get_s3_object_metadata(key)
-            files_data.update({key: metadata.get("crc32_hash", "")})
+        for entry in catalog.entries():
+            # Repacked objects are deduplicated by the CRC32 of the file as uploaded
+            files_data.update({entry['key']: entry['metadata'].get("original_crc32") or entry['metadata'].get("crc32_hash", "")})
         
         return files_data
     
@@ -128,6 +204,54 @@ def list_s3_crc32():
     except Exception as e:
         return {'error': str(e)}
 
+# Persistent content hash -> key index shared by all workers for upload dedup
+hash_index = HashIndex()
+# Resumable browser uploads in progress
+upload_sessions = UploadSessions()
+job_queue = JobQueue()
+# HDF5 structure manifests per (key, ETag)
+manifest_cache = ManifestCache()
+# Cross-file aggregation results by the ETags of their inputs (utils/aggregate.py)
+aggregate_cache = AggregateCache()
+# Download URLs, re-signed at most once per key and expiry window
+presign_cache = PresignCache(s3_client, S3_BUCKET)
+# Blocks of remote HDF5 objects shared by all slice requests of this worker
+slice_block_cache = BlockCache()
+# Tokens handed out by /api/s3/upload/preflight
+upload_tokens = UploadTokens(app.config['SECRET_KEY'])
+# Uploads streaming through /api/s3/upload on this host, capped in number and bytes
+upload_admission = AdmissionController()
+
+def cache_counters():
+    """Hit and miss counts the caches of this process keep themselves, for /metrics"""
+    counters = [
+        ('presign', 'hit', presign_cache.hits), ('presign', 'miss', presign_cache.misses),
+        ('slice_blocks', 'hit', slice_block_cache.hits), ('slice_blocks', 'miss', slice_block_cache.misses),
+        ('catalog', 'hit', catalog.stats['hits']), ('catalog', 'stale', catalog.stats['stale_hits']),
+        ('catalog', 'miss', catalog.stats['refreshes']),
+    ]
+    return [('mosaic_cache_requests_total', {'cache': cache, 'result': result}, value)
+            for cache, result, value in counters]
+
+metrics.register_collector(cache_counters)
+
+def ensure_hash_index():
+    """Build the hash index from bucket metadata if it does not exist yet
+
+    Returns:
+        None on success, otherwise an error dict
+    """
+    if hash_index.is_built():
+        return None
+    existing_objects = list_s3_crc32()
+    if 'error' in existing_objects:
+        return existing_objects
+    hashes = [(hash_id('crc32', crc32_hash), key) for key, crc32_hash in existing_objects.items() if crc32_hash]
+    hashes += [(entry['metadata']['content_hash'], entry['key']) for entry in catalog.entries()
+               if entry['metadata'].get('content_hash')]
+    hash_index.rebuild(hashes)
+    return None
+
 @app.route('/')
 def index():
     """Home page"""
@@ -148,48 +272,58 @@ def faq():
     """faq page"""
     return render_template('faq.html')
 
+def catalog_entry_to_json(entry):
+    """Shape a catalog entry the way the download page expects it"""
+    metadata = entry['metadata']
+    return {
+        'fileId': entry['key'],
+        'datasetName': metadata.get('dataset_name', ''),
+        'subjectName': metadata.get('subjectID', ''),
+        'preprocessingPipeline': metadata.get('preprocessing_pipeline', ''),
+        'ownerName': metadata.get('owner_name', ''),
+        'ownerEmail': metadata.get('owner_email', ''),
+        'betaPipeline': metadata.get('beta_pipeline', ''),
+        'githubUrl': metadata.get('github_url', ''),
+        'publicationUrl': metadata.get('publication_url', ''),
+        'lastModified': entry['last_modified'].isoformat(),
+        'size': humanize.naturalsize(entry['size'], binary=True)
+    }
+
 @app.route('/api/s3/files', methods=['GET'])
 def list_s3_files():
-    """List all HDF5 files in S3 bucket with metadata"""
+    """List HDF5 files in S3 bucket with metadata
+
+    Query parameters q, dataset, pipeline and owner filter the catalog, sort
+    orders it (prefix '-' for descending) and limit/cursor page through it.
+    The total match count and the cursor of the next page are returned in the
+    X-Total-Count and X-Next-Cursor headers.
+    """
     if not s3_client:
         return jsonify({'error': 'S3 client not configured'}), 500
     
     try:
-        # List objects in bucket
-        response = s3_client.list_objects_v2(Bucket=S3_BUCKET)
-        
-        if 'Contents' not in response:
-            return jsonify([])
-        
-        files_data = []
-        for obj in response['Contents']:
-            key = obj['Key']
-            
-            # Only process HDF5 files
-            if not (key.endswith('.hdf5') or key.endswith('.h5')):
-                continue
-            
-            # Get metadata for this file
-            metadata = get_s3_object_metadata(key)
-            
-            file_data = {
-                'fileId': key,
-                'datasetName': metadata.get('dataset_name', ''),
-                'subjectName': metadata.get('subjectID', ''),
-                'preprocessingPipeline': metadata.get('preprocessing_pipeline', ''),
-                'ownerName': metadata.get('owner_name', ''),
-                'ownerEmail': metadata.get('owner_email', ''),
-                'betaPipeline': metadata.get('beta_pipeline', ''),
-                'githubUrl': metadata.get('github_url', ''),
-                'publicationUrl': metadata.get('publication_url', ''),
-                'lastModified': obj['LastModified'].isoformat(),
-                'size': humanize.naturalsize(obj['Size'], binary=True)
-            }
-            
-            files_data.append(file_data)
+        limit = min(request.args.get('limit', FILES_PAGE_LIMIT, type=int), FILES_PAGE_LIMIT_MAX)
+        if limit < 1:
+            return jsonify({'error': 'limit must be positive'}), 400
+        entries, next_cursor, total = catalog.query(
+            q=request.args.get('q', ''),
+            dataset=request.args.get('dataset', ''),
+            pipeline=request.args.get('pipeline', ''),
+            owner=request.args.get('owner', ''),
+            sort=request.args.get('sort', 'fileId'),
+            limit=limit,
+            cursor=request.args.get('cursor')
+        )
+        files_data = [catalog_entry_to_json(entry) for entry in entries]
         
-        return jsonify(files_data)
+        response = jsonify(files_data)
+        response.headers['X-Total-Count'] = str(total)
+        if next_cursor:
+            response.headers['X-Next-Cursor'] = next_cursor
+        return response
     
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except ClientError as e:
         error_code = e.response['Error']['Code']
         if error_code == 'NoSuchBucket':
@@ -199,67 +333,892 @@ def list_s3_files():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def finalize_streamed_upload(payload, callback=None):
+    """Read the metadata of an upload streamed to its staging key by /api/s3/upload, then dedup and move it
+
+    The hashes were computed while the body streamed in. Only the HDF5
+    header blocks and the attributes the summary needs are fetched back, with
+    range requests. With REPACK_ON_INGEST the staged object is also read
+    once more to repack it.
+
+    Args:
+        payload: Job payload of the upload, see upload_to_s3()
+        callback: Called with the byte count of each part uploaded by a repack
+
+    Returns:
+        (response dict, HTTP status code)
+    """
+    error = ensure_hash_index()
+    if error:
+        return error, 500
+
+    staged_key = payload['stagedKey']
+    file_size = payload['size']
+    stored_crc32 = repack = None
+    with S3RangeFile(s3_client, S3_BUCKET, staged_key) as f:
+        metadata = extract_hdf5_metadata(f)
+        summary = summarize_upload(f)
+        if REPACK_ON_INGEST:
+            provenance = {'crc32': payload['crc32'], 'contentHash': payload['contentHash'], 'size': file_size}
+            stored_crc32, repack = stage_repacked(f, file_size, staged_key, provenance, callback=callback)
+    metadata.update({"file_size": humanize.naturalsize(file_size)})
+    if repack:
+        metadata.update({"layout": repack['layout'], "original_size": str(file_size)})
+    result, status = finalize_staged_upload(staged_key, payload['filename'], payload['crc32'], payload['contentHash'],
+                                            file_size, metadata, payload.get('expectedCrc32'), stored_crc32=stored_crc32,
+                                            summary=summary)
+    if status == 200:
+        result['ingest'] = payload['ingest']
+        if repack:
+            result['repack'] = repack
+        print(f"Ingested {result['filename']}: {result['ingest']['bytes_read']} bytes read, {result['ingest']['throughput_mb_s']} MB/s")
+    return result, status
+
+def summarize_upload(fileobj):
+    """Summary sidecar of an upload (utils/summary.py), or None if the file cannot be summarized"""
+    try:
+        fileobj.seek(0)
+        return summarize_hdf5(fileobj)
+    except Exception as e:
+        print(f"Error summarizing HDF5 file: {e}")
+        return None
+
+def stage_repacked(reader, file_size, staged_key, provenance, callback=None):
+    """Replace a staged upload with a repacked copy of it (utils/repack.py)
+
+    Dedup and the object name use the hashes of the original bytes, so they
+    do not depend on the repack settings. Those hashes are also written into
+    the repacked file's consolidated metadata as its provenance.
+
+    Args:
+        reader: Seekable file object of the staged upload, e.g. an S3RangeFile
+        file_size: Size of the upload
+        staged_key: Key the upload was staged under, overwritten by the repacked copy
+        provenance: Original crc32, contentHash and size
+        callback: Called with the byte count of each uploaded part
+
+    Returns:
+        (CRC32 of the staged bytes, repack report), or (None, None) if the
+        file could not be repacked and stays staged as uploaded
+    """
+    fd, repacked_path = tempfile.mkstemp(dir=UPLOAD_FOLDER, prefix='repack-', suffix='.hdf5')
+    os.close(fd)
+    try:
+        reader.seek(0)
+        try:
+            report = repack_hdf5(reader, repacked_path, provenance=provenance)
+        except Exception as e:
+            print(f"Could not repack {staged_key}, storing it as uploaded: {e}")
+            return None, None
+        repacked_size = os.path.getsize(repacked_path)
+        stored = Crc32()
+        with open(repacked_path, 'rb') as f:
+            # Progress is reported against the size of the upload
+            stream_to_s3(f, s3_client, S3_BUCKET, staged_key, hashers=[stored],
+                         callback=callback and (lambda n: callback(n * file_size / max(repacked_size, 1))))
+    finally:
+        os.remove(repacked_path)
+    report.update({'originalSize': file_size, 'repackedSize': repacked_size,
+                   'sizeReduction': round(1 - repacked_size / file_size, 3) if file_size else None})
+    print(f"Repacked {staged_key}: {file_size} -> {repacked_size} bytes in {report['seconds']} s")
+    return stored.hexdigest(), report
+
+def finalize_staged_upload(staged_key, filename, crc32_hash, content_hash, file_size, metadata, expected_crc32=None,
+                           stored_crc32=None, summary=None):
+    """Dedup a fully staged upload by its hash and move it to its final key
+
+    Args:
+        staged_key: Key the upload was staged under
+        filename: Secured name of the uploaded file
+        crc32_hash: Hex CRC32 of the uploaded file
+        content_hash: Content hash ID of the uploaded file (utils.hashing.hash_id)
+        file_size: Size of the uploaded file in bytes
+        metadata: Object metadata read from the file
+        expected_crc32: CRC32 the client reported at preflight, if any
+        stored_crc32: CRC32 of the staged bytes if they differ from the
+            uploaded file, i.e. it was repacked
+        summary: Summary stored as the file's sidecar, if any
+
+    Returns:
+        (response dict, HTTP status code)
+    """
+    if expected_crc32 and crc32_hash != expected_crc32:
+        # The preflight vouched for other content than what arrived
+        s3_client.delete_object(Bucket=S3_BUCKET, Key=staged_key)
+        return {'error': f'Uploaded file has CRC32 {crc32_hash}, but {expected_crc32} was checked before the upload. Was the file changed?'}, 422
+    name, ext = os.path.splitext(filename)
+    unique_filename = f"{name}_crc32-{crc32_hash}{ext}"
+
+    #claim the hash in the persistent index, one lookup no matter the bucket size
+    duplicate = hash_index.claim(content_hash, unique_filename)
+    try:
+        if duplicate and uploaded_size(duplicate) is None and hash_index.forget(duplicate):
+            #the indexed object was deleted from the bucket since, claim again over its stale rows
+            duplicate = hash_index.claim(content_hash, unique_filename)
+        if not duplicate:
+            #objects uploaded before content hashes existed are indexed by crc32 only
+            duplicate = find_legacy_duplicate(crc32_hash, file_size, content_hash)
+            if duplicate:
+                #the legacy object is found by its content hash from now on
+                hash_index.release(content_hash, unique_filename)
+                hash_index.add(content_hash, duplicate)
+        if duplicate:
+            s3_client.delete_object(Bucket=S3_BUCKET, Key=staged_key)
+            return {'error': 'This file has already been uploaded.'}, 409
+
+        metadata.update({"crc32_hash": crc32_hash, "content_hash": content_hash})
+        if stored_crc32:
+            # Downloads are checked against the stored bytes, the original CRC32 stays for provenance
+            metadata.update({"crc32_hash": stored_crc32, "original_crc32": crc32_hash})
+        promote_staged_object(s3_client, S3_BUCKET, staged_key, unique_filename, metadata)
+    except Exception:
+        # Only drops a claim this upload holds, a retry can claim again
+        hash_index.release(content_hash, unique_filename)
+        raise
+    hash_index.commit(content_hash, unique_filename)
+    hash_index.add(hash_id('crc32', crc32_hash), unique_filename)
+    if summary is not None:
+        try:
+            put_summary(s3_client, S3_BUCKET, metadata['crc32_hash'], summary)
+        except ClientError as e:
+            # The upload stands, the backfill command can write the summary later
+            print(f"Error storing summary of {unique_filename}: {e}")
+    # Runs in a job worker, the web workers serving the catalog are other processes
+    catalog_generation.bump()
+    job_queue.enqueue_unique('snapshot', {})
+
+    return {
+        'message': 'File uploaded successfully',
+        'filename': unique_filename,
+        'metadata': metadata
+    }, 200
+
+def send_snapshot(pointer, cache_control):
+    """Send a snapshot file, precompressed if the client accepts it
+
+    Each encoding is its own representation with its own ETag, and
+    If-None-Match is answered with a 304.
+    """
+    filename = snapshot_filename(pointer['version'])
+    encoding = request.accept_encodings.best_match([encoding for encoding in ENCODINGS
+                                                    if encoding in pointer.get('encodings', [])])
+    if encoding:
+        filename += ENCODINGS[encoding]
+    path = os.path.join(SNAPSHOT_DIR, filename)
+    if not os.path.exists(path):
+        # Pruned between reading the pointer and here
+        return jsonify({'error': 'Catalog snapshot not found'}), 404
+    response = send_file(os.path.abspath(path), mimetype='application/json',
+                         download_name=snapshot_filename(pointer['version']),
+                         etag=pointer['version'] + (f'-{encoding}' if encoding else ''))
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Cache-Control'] = cache_control
+    response.vary.add('Accept-Encoding')
+    return response
+
+@app.route('/api/s3/catalog', methods=['GET'])
+def get_catalog_snapshot():
+    """Current catalog snapshot: every file with its metadata and size in bytes
+
+    Rebuilt by the job workers after uploads and on a schedule. Browsers
+    revalidate on every visit and get a 304 while the catalog is unchanged.
+    X-Catalog-Version names the immutable copy under /api/s3/catalog/<version>.
+    """
+    pointer = current_snapshot()
+    if pointer is None:
+        return jsonify({'error': 'No catalog snapshot yet, use /api/s3/files'}), 404
+    response = send_snapshot(pointer, 'public, no-cache')
+    response.headers['X-Catalog-Version'] = pointer['version']
+    return response
+
+@app.route('/api/s3/catalog/<version>', methods=['GET'])
+def get_catalog_snapshot_version(version):
+    """One snapshot version, its content never changes so it is cached for a year"""
+    version = secure_filename(version)
+    pointer = current_snapshot()
+    if pointer is None or pointer['version'] != version:
+        path = os.path.join(SNAPSHOT_DIR, snapshot_filename(version))
+        if not os.path.exists(path):
+            return jsonify({'error': 'Catalog snapshot not found'}), 404
+        pointer = {'version': version,
+                   'encodings': [encoding for encoding, suffix in ENCODINGS.items() if os.path.exists(path + suffix)]}
+    return send_snapshot(pointer, 'public, max-age=31536000, immutable')
+
+def uploaded_size(key):
+    """Size of the file that was uploaded as an object in the bucket, or None if it is gone"""
+    try:
+        response = s3_client.head_object(Bucket=S3_BUCKET, Key=key)
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('404', 'NoSuchKey'):
+            return None
+        raise
+    # Repacked objects are stored at another size than the file that was uploaded
+    return int(response.get('Metadata', {}).get('original_size', response['ContentLength']))
+
+def find_legacy_duplicate(crc32_hash, size, content_hash):
+    """Key of an object from before content hashes with the same content as an upload, or None
+
+    Such objects are indexed by their CRC32 only, which is too weak to reject
+    an upload on. A match that is gone from the bucket is dropped from the
+    index. One of the same size is read back and hashed, and its content hash
+    is indexed, so it is compared by content hash from then on.
+    """
+    key = hash_index.lookup_legacy(hash_id('crc32', crc32_hash))
+    if key is None:
+        return None
+    existing_size = uploaded_size(key)
+    if existing_size is None:
+        hash_index.forget(key)
+        return None
+    if existing_size != size:
+        return None
+    hasher = new_hasher(CONTENT_HASH_ALGORITHM)
+    hash_s3_object(s3_client, S3_BUCKET, key, [hasher])
+    existing_hash = hash_id(CONTENT_HASH_ALGORITHM, hasher.hexdigest())
+    if existing_hash == content_hash:
+        return key
+    # Same CRC32, other content
+    hash_index.add(existing_hash, key)
+    return None
+
+def find_duplicate(crc32_hash, size):
+    """Key of an object in the bucket with this CRC32 and size, a probable duplicate, or None
+
+    The object is HEADed rather than looked up in the catalog, which may
+    still hold objects deleted since its last refresh.
+    """
+    key = hash_index.lookup(hash_id('crc32', crc32_hash))
+    if key is None:
+        return None
+    return key if uploaded_size(key) == size else None
+
+@app.route('/api/s3/upload/preflight', methods=['POST'])
+def preflight_upload():
+    """Check an upload before any of its bytes are sent
+
+    Body: {"filename", "size", "crc32" (hex CRC32 of the whole file) and
+    "header" (base64 of the first PREFLIGHT_HEADER_BYTES of the file)}.
+    Answers with "decision": "accept" and an uploadToken for
+    /api/s3/multipart or /api/s3/upload, or "reject" with the reason. When
+    the bucket already has a file with the same CRC32 and size, the decision
+    is "duplicate" with its "existingKey", still with a token: CRC32 and size
+    only make it probable, the page asks the user, and finalizing the upload
+    compares the content hash. The token binds the CRC32 to the upload, and
+    finalizing it fails if the received file hashes differently.
+    """
+    if not s3_client:
+        return jsonify({'error': 'S3 client not configured'}), 500
+
+    body = request.get_json(silent=True) or {}
+    filename = secure_filename(body.get('filename', ''))
+    size = body.get('size')
+    if not filename or not allowed_file(filename):
+        return jsonify({'decision': 'reject', 'error': 'Only HDF5 files (.hdf5, .h5) are allowed'}), 400
+    if not isinstance(size, int) or size <= 0:
+        return jsonify({'decision': 'reject', 'error': 'File size is required'}), 400
+    if size > UPLOAD_SIZE_LIMIT * 1024**3:
+        return jsonify({'decision': 'reject', 'error': f"Desired file upload size was {humanize.naturalsize(size, binary=True)} and the max is {UPLOAD_SIZE_LIMIT} GiB. Contact us if you truly have a file this large to upload."}), 413
+    try:
+        crc32_hash = parse_crc32(body.get('crc32'))
+        header = base64.b64decode(body.get('header') or '', validate=True)
+    except (ValueError, binascii.Error) as e:
+        return jsonify({'decision': 'reject', 'error': f'Invalid crc32 or header: {e}'}), 400
+    if len(header) != min(size, PREFLIGHT_HEADER_BYTES):
+        return jsonify({'decision': 'reject', 'error': f'header must be the first {PREFLIGHT_HEADER_BYTES} bytes of the file'}), 400
+    if find_hdf5_signature(header) is None:
+        return jsonify({'decision': 'reject', 'error': 'This is not an HDF5 file'}), 422
+
+    try:
+        error = ensure_hash_index()
+        if error:
+            return jsonify(error), 500
+        duplicate = find_duplicate(crc32_hash, size)
+    except ClientError as e:
+        return jsonify({'error': f'S3 error: {e.response["Error"]["Code"]}'}), 500
+    return jsonify({
+        'decision': 'duplicate' if duplicate else 'accept',
+        'existingKey': duplicate,
+        'uploadToken': upload_tokens.issue(filename, size, crc32_hash),
+        'expiresIn': UPLOAD_TOKEN_MAX_AGE,
+        # Root attributes as far as the header holds them, the upload is read again when finalized
+        'metadata': extract_hdf5_metadata(HeaderFile(header, size))
+    })
+
 @app.route('/api/s3/upload', methods=['POST'])
 def upload_to_s3():
-    """Upload HDF5 file to S3 with metadata"""
+    """Stream an uploaded HDF5 file to S3 as it arrives, then finalize it in a job
+
+    Takes multipart/form-data with a 'file' field and an optional
+    'uploadToken', or the raw file as the body with its name in ?filename=
+    (or an X-Filename header) and the token in an X-Upload-Token header.
+    Either way the body is never written to disk or held whole in memory: it
+    is multipart-uploaded to a staging key and hashed part by part, with a
+    few parts in memory at a time. Uploads are admitted by Content-Length
+    while the host has capacity, others get a 503 with Retry-After.
+    """
     if not s3_client:
         return jsonify({'error': 'S3 client not configured'}), 500
-    
-    if 'file' not in request.files:
-        return jsonify({'error': 'No file provided'}), 400
-    
-    file = request.files['file']
-    if file.filename == '':
-        return jsonify({'error': 'No file selected'}), 400
-    
-    if not allowed_file(file.filename):
-        return jsonify({'error': 'Only HDF5 files (.hdf5, .h5) are allowed'}), 400
-    
+
+    file_size = request.content_length
+    if file_size is None:
+        return jsonify({'error': 'Content-Length is required'}), 411
+    if file_size > UPLOAD_SIZE_LIMIT * 1024**3:
+        size_human_readable = humanize.naturalsize(file_size, binary=True)
+        return jsonify({'error': f"Desired file upload size was {size_human_readable} and the max is {UPLOAD_SIZE_LIMIT} GiB. Contact us if you truly have a file this large to upload."}), 413
+
+    slot = upload_admission.acquire(file_size)
+    if slot is None:
+        metrics.inc('mosaic_uploads_rejected_total')
+        return jsonify({'error': 'Too many uploads in progress, try again later'}), 503, {'Retry-After': str(UPLOAD_RETRY_AFTER)}
+    staged_key = None
     try:
-        size_human_readable = humanize.naturalsize(os.path.getsize(file))
-        if size_human_readable > UPLOAD_SIZE_LIMIT:
-            return jsonify({'error': f"Desired file upload size was {size_human_readable} and the max is {UPLOAD_SIZE_LIMIT}. Contact us if you truly have a file this large to upload."})
-        metadata = extract_hdf5_metadata(file)
-        
+        if request.mimetype == 'multipart/form-data':
+            boundary = request.mimetype_params.get('boundary')
+            if not boundary:
+                return jsonify({'error': 'Missing multipart boundary'}), 400
+            body = MultipartFileReader(request.stream, boundary.encode('latin-1'))
+            body.start()
+            raw_filename = body.filename
+            # Only set here if the form puts it before the file
+            token = body.fields.get('uploadToken')
+        else:
+            body = request.stream
+            raw_filename = request.args.get('filename') or request.headers.get('X-Filename', '')
+            token = request.headers.get('X-Upload-Token')
+        if raw_filename == '':
+            return jsonify({'error': 'No file selected'}), 400
+        if not allowed_file(raw_filename):
+            return jsonify({'error': 'Only HDF5 files (.hdf5, .h5) are allowed'}), 400
+
         # Secure filename
-        filename = secure_filename(file.filename)
-        metadata.update({"file_size": size_human_readable})
-        
-        #use crc32 to hash hdf5 file. any change in file creates new hash
-        #hash just intended to ensure files are same or different
-        crc32_hash = generate_content_hash(file)
-
-        #get other s3 object crc32 hash
-        existing_objects = list_s3_crc32()
-        existing_hashes = set(existing_objects.values())
-        if crc32_hash in existing_hashes:
-            return jsonify({'error': 'This file has already been uploaded.'})
-
-        filename = Path(file).name
-        name, ext = os.path.splitext(filename)
-        unique_filename = f"{name}_crc32-{crc32_hash}{ext}"
-
-        metadata.update({"crc32_hash": crc32_hash})
-
-        upload_with_progress(
-            file_path=file,
-            s3_client=s3_client,
-            bucket=S3_BUCKET,
-            key=unique_filename,
-            metadata=metadata
-        )
-        
-        return jsonify({
-            'message': 'File uploaded successfully',
-            'filename': unique_filename,
-            'metadata': metadata
-        })
-    
+        filename = secure_filename(raw_filename)
+        token_claims = None
+        if token:
+            # A bad or expired token is turned away before the body is streamed
+            try:
+                token_claims = upload_tokens.read(token, filename)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 403
+        reader = CountingReader(body)
+        stats = IngestStats(reader)
+        staged_key = staging_key(filename)
+        #crc32 names the object, the stronger content hash decides whether it is a duplicate
+        hashers = [Crc32(), new_hasher(CONTENT_HASH_ALGORITHM)]
+        file_size = stream_to_s3(reader, s3_client, S3_BUCKET, staged_key, hashers=hashers)
+        if isinstance(body, MultipartFileReader):
+            body.finish()
+            if not token and body.fields.get('uploadToken'):
+                try:
+                    token_claims = upload_tokens.read(body.fields['uploadToken'], filename)
+                except ValueError as e:
+                    return jsonify({'error': str(e)}), 403
+        expected_crc32 = None
+        if token_claims:
+            # Only the size is left to check now that the whole body is in
+            try:
+                expected_crc32 = upload_tokens.expected_crc32(token_claims, file_size)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 403
+
+        # Metadata, dedup and the move to the final key run in a job worker, not in this web worker
+        job_id = job_queue.enqueue('ingest_stream', {
+            'stagedKey': staged_key,
+            'filename': filename,
+            'size': file_size,
+            'crc32': hashers[0].hexdigest(),
+            'contentHash': hash_id(CONTENT_HASH_ALGORITHM, hashers[1].hexdigest()),
+            'expectedCrc32': expected_crc32,
+            'ingest': stats.report(file_size),
+        }, total_bytes=file_size)
+        staged_key = None
+        return jsonify({'message': 'Upload accepted', 'jobId': job_id, 'statusUrl': f'/api/jobs/{job_id}'}), 202
+    except ValueError as e:
+        # Malformed form data
+        return jsonify({'error': str(e)}), 400
+    except HTTPException as e:
+        # e.g. the client disconnected mid-upload
+        return jsonify({'error': e.description}), e.code
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    finally:
+        upload_admission.release(slot)
+        # Uploads that were not handed to a job are removed right away
+        if staged_key:
+            try:
+                s3_client.delete_object(Bucket=S3_BUCKET, Key=staged_key)
+            except ClientError as e:
+                print(f"Error removing staged upload {staged_key}: {e}")
+
+def finalize_multipart_upload(session, callback=None):
+    """Read metadata and hashes of a completed browser upload, then dedup and move it
+
+    Only the HDF5 header blocks are fetched for the metadata. The hashes need
+    one streaming read of the staged object, S3 to this host, never to disk.
+    callback is called with the byte count of each hashed chunk.
+    """
+    error = ensure_hash_index()
+    if error:
+        return error, 500
+
+    with S3RangeFile(s3_client, S3_BUCKET, session['key']) as f:
+        metadata = extract_hdf5_metadata(f)
+        summary = summarize_upload(f)
+    hashers = [Crc32(), new_hasher(CONTENT_HASH_ALGORITHM)]
+    file_size = hash_s3_object(s3_client, S3_BUCKET, session['key'], hashers, callback=callback)
+    metadata.update({"file_size": humanize.naturalsize(file_size)})
+    return finalize_staged_upload(session['key'], session['filename'], hashers[0].hexdigest(),
+                                  hash_id(CONTENT_HASH_ALGORITHM, hashers[1].hexdigest()), file_size, metadata,
+                                  session['expected_crc32'], summary=summary)
+
+def get_active_session(upload_id):
+    """Return (session, None) for an active upload, else (None, error response)"""
+    session = upload_sessions.get(upload_id)
+    if session is None:
+        return None, (jsonify({'error': 'Upload not found'}), 404)
+    if session['status'] != 'active':
+        return None, (jsonify({'error': f"Upload is {session['status']}"}), 409)
+    return session, None
+
+def session_to_json(session, parts=None):
+    result = {
+        'uploadId': session['upload_id'],
+        'filename': session['filename'],
+        'size': session['size'],
+        'partSize': session['part_size'],
+        'partCount': session['part_count'],
+        'status': session['status'],
+        'jobId': session['job_id']
+    }
+    if parts is not None:
+        result['uploadedParts'] = [part['PartNumber'] for part in parts]
+    return result
+
+@app.route('/api/s3/multipart', methods=['POST'])
+def initiate_multipart_upload():
+    """Start a resumable browser upload that sends parts straight to S3"""
+    if not s3_client:
+        return jsonify({'error': 'S3 client not configured'}), 500
+
+    body = request.get_json(silent=True) or {}
+    filename = secure_filename(body.get('filename', ''))
+    size = body.get('size')
+    if not filename or not allowed_file(filename):
+        return jsonify({'error': 'Only HDF5 files (.hdf5, .h5) are allowed'}), 400
+    if not isinstance(size, int) or size < 0:
+        return jsonify({'error': 'File size is required'}), 400
+    if size > UPLOAD_SIZE_LIMIT * 1024**3:
+        return jsonify({'error': f"Desired file upload size was {humanize.naturalsize(size, binary=True)} and the max is {UPLOAD_SIZE_LIMIT} GiB. Contact us if you truly have a file this large to upload."}), 413
+    expected_crc32 = None
+    if body.get('uploadToken'):
+        try:
+            expected_crc32 = upload_tokens.verify(body['uploadToken'], filename, size)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 403
+
+    try:
+        key = staging_key(filename)
+        upload_id = s3_client.create_multipart_upload(
+            Bucket=S3_BUCKET, Key=key, ContentType='application/x-hdf')['UploadId']
+        session = upload_sessions.create(upload_id, key, filename, size,
+                                         choose_part_size(size, INGEST_PART_SIZE), expected_crc32)
+        return jsonify(session_to_json(session, parts=[]))
+    except ClientError as e:
+        return jsonify({'error': f'S3 error: {e.response["Error"]["Code"]}'}), 500
+
+@app.route('/api/s3/multipart/<upload_id>', methods=['GET'])
+def get_multipart_upload(upload_id):
+    """Report which parts of an upload S3 already has, so the client can resume"""
+    session = upload_sessions.get(upload_id)
+    if session is None:
+        return jsonify({'error': 'Upload not found'}), 404
+    try:
+        parts = list_uploaded_parts(s3_client, S3_BUCKET, session) if session['status'] == 'active' else None
+        return jsonify(session_to_json(session, parts))
+    except ClientError as e:
+        return jsonify({'error': f'S3 error: {e.response["Error"]["Code"]}'}), 500
+
+@app.route('/api/s3/multipart/<upload_id>/urls', methods=['POST'])
+def presign_multipart_parts(upload_id):
+    """Presign PUT URLs for a batch of parts"""
+    session, error = get_active_session(upload_id)
+    if error:
+        return error
+
+    part_numbers = (request.get_json(silent=True) or {}).get('partNumbers', [])
+    if not part_numbers or len(part_numbers) > PART_URL_BATCH_LIMIT:
+        return jsonify({'error': f'Request between 1 and {PART_URL_BATCH_LIMIT} parts at a time'}), 400
+    if not all(isinstance(n, int) and 1 <= n <= session['part_count'] for n in part_numbers):
+        return jsonify({'error': f"Part numbers must be between 1 and {session['part_count']}"}), 400
+
+    urls = presign_part_urls(s3_client, S3_BUCKET, session, part_numbers)
+    return jsonify({'urls': {str(n): url for n, url in urls.items()}, 'expiresIn': PART_URL_EXPIRY})
+
+@app.route('/api/s3/multipart/<upload_id>/complete', methods=['POST'])
+def complete_multipart(upload_id):
+    """Assemble the uploaded parts, then queue the usual metadata and dedup logic"""
+    session = upload_sessions.get(upload_id)
+    if session and session['status'] == 'finalizing':
+        # The job worker died mid-finalize, let the client retry
+        job = job_queue.get(session['job_id'])
+        if job and job['status'] == 'failed' and upload_sessions.transition(upload_id, 'finalizing', 'assembled'):
+            session['status'] = 'assembled'
+    # 'assembled' means S3 already joined the parts but finalizing has not started or failed
+    if session is None or session['status'] != 'assembled':
+        session, error = get_active_session(upload_id)
+        if error:
+            return error
+
+    try:
+        if session['status'] == 'active':
+            parts = list_uploaded_parts(s3_client, S3_BUCKET, session)
+            received = {part['PartNumber'] for part in parts}
+            missing = [n for n in range(1, session['part_count'] + 1) if n not in received]
+            if missing:
+                return jsonify({'error': 'Upload is missing parts', 'missingParts': missing}), 400
+
+            s3_client.complete_multipart_upload(
+                Bucket=S3_BUCKET, Key=session['key'], UploadId=upload_id,
+                MultipartUpload={'Parts': [{'PartNumber': part['PartNumber'], 'ETag': part['ETag']}
+                                           for part in sorted(parts, key=lambda part: part['PartNumber'])]})
+            upload_sessions.set_status(upload_id, 'assembled')
+
+        # Only one request moves the session on, a concurrent retry gets a 409
+        job_id = new_job_id()
+        if not upload_sessions.transition(upload_id, 'assembled', 'finalizing', job_id=job_id):
+            return jsonify({'error': 'Upload is already being finalized'}), 409
+        job_queue.enqueue('finalize_multipart', {'uploadId': upload_id}, total_bytes=session['size'], job_id=job_id)
+        return jsonify({'message': 'Upload accepted', 'jobId': job_id, 'statusUrl': f'/api/jobs/{job_id}'}), 202
     except ClientError as e:
         return jsonify({'error': f'S3 upload error: {e.response["Error"]["Code"]}'}), 500
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/s3/multipart/<upload_id>', methods=['DELETE'])
+def abort_multipart(upload_id):
+    """Abandon an upload and let S3 discard its parts"""
+    session, error = get_active_session(upload_id)
+    if error:
+        return error
+    try:
+        s3_client.abort_multipart_upload(Bucket=S3_BUCKET, Key=session['key'], UploadId=upload_id)
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'NoSuchUpload':
+            return jsonify({'error': f'S3 error: {e.response["Error"]["Code"]}'}), 500
+    upload_sessions.set_status(upload_id, 'aborted')
+    return jsonify({'message': 'Upload aborted'})
+
+def run_stream_ingest_job(job, progress):
+    """Job handler for a file streamed to its staging key by /api/s3/upload"""
+    payload = job['payload']
+    callback = TqdmUploadCallback(payload['filename'], size=payload['size'], on_progress=progress)
+    try:
+        return finalize_streamed_upload(payload, callback=callback)
+    finally:
+        callback.close()
+
+def run_finalize_job(job, progress):
+    """Job handler for a browser upload assembled by /api/s3/multipart/<id>/complete"""
+    upload_id = job['payload']['uploadId']
+    session = upload_sessions.get(upload_id)
+    callback = TqdmUploadCallback(session['filename'], size=session['size'], on_progress=progress)
+    status = 500
+    try:
+        result, status = finalize_multipart_upload(session, callback=callback)
+        return result, status
+    finally:
+        callback.close()
+        # A failed finalize can be retried by completing the upload again
+        upload_sessions.set_status(upload_id, 'completed' if status != 500 else 'assembled')
+
+def run_aggregate_job(job, progress):
+    """Job handler for /api/s3/aggregate, reading the member files on a process pool"""
+    payload = job['payload']
+    cached = aggregate_cache.get(payload['cacheKey'])
+    if cached:
+        return cached[0], 200
+    try:
+        result, stats = aggregate(S3_BUCKET, payload['members'], payload['dataset'], payload['reduction'],
+                                  payload['q'], progress=progress)
+    except ValueError as e:
+        # Missing datasets or shapes that differ between files
+        return {'error': str(e)}, 422
+    description = {
+        'cacheKey': payload['cacheKey'],
+        'dataset': payload['dataset'],
+        'reduction': payload['reduction'],
+        'q': payload['q'],
+        'files': len(payload['members']),
+        'shape': list(result.shape),
+        'dtype': str(result.dtype),
+        'summary': result_summary(result),
+        'stats': stats,
+        'resultUrl': f"/api/s3/aggregate/{payload['cacheKey']}",
+    }
+    aggregate_cache.put(payload['cacheKey'], result, description)
+    return description, 200
+
+def run_snapshot_job(job, progress):
+    """Job handler rebuilding the catalog snapshot, after uploads and every SNAPSHOT_INTERVAL"""
+    if not s3_client:
+        return {'error': 'S3 client not configured'}, 500
+    catalog.refresh()
+    pointer, written = write_snapshot(catalog.entries(), catalog.version)
+    return {'version': pointer['version'], 'files': pointer['files'], 'written': written}, 200
+
+# Job kind -> handler run by the job workers (utils/jobs.py)
+JOB_HANDLERS = {
+    'ingest_stream': run_stream_ingest_job,
+    'finalize_multipart': run_finalize_job,
+    'snapshot': run_snapshot_job,
+    'aggregate': run_aggregate_job,
+}
+# Job kind -> seconds between scheduled runs
+JOB_SCHEDULE = {
+    'snapshot': SNAPSHOT_INTERVAL,
+}
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Status and byte progress of a background upload job"""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    total = job['total_bytes']
+    return jsonify({
+        'jobId': job['id'],
+        'kind': job['kind'],
+        'status': job['status'],
+        'progress': {
+            'bytes': job['progress_bytes'],
+            'total': total,
+            'percent': round(100 * job['progress_bytes'] / total, 1) if total else None
+        },
+        'result': job['result'],
+        'error': job['error'],
+        'httpStatus': job['http_status']
+    })
+
+@app.route('/api/s3/inspect/<path:key>', methods=['GET'])
+def inspect_s3_file(key):
+    """Describe the groups, datasets and attributes inside an HDF5 object
+
+    h5py reads the file through range requests and only touches the metadata
+    blocks, never the dataset values. Manifests are cached per ETag, and the
+    response reports how many bytes building the manifest fetched.
+    """
+    if not s3_client:
+        return jsonify({'error': 'S3 client not configured'}), 500
+    if not allowed_file(key):
+        return jsonify({'error': 'Only HDF5 files (.hdf5, .h5) can be inspected'}), 400
+
+    try:
+        head = s3_client.head_object(Bucket=S3_BUCKET, Key=key)
+        size, etag = head['ContentLength'], head['ETag']
+        cached = manifest_cache.get(key, etag)
+        if cached is None:
+            with S3RangeFile(s3_client, S3_BUCKET, key, block_size=MANIFEST_BLOCK_SIZE, size=size, etag=etag) as f:
+                manifest = build_manifest(f)
+            cached = {'manifest': manifest, 'bytes_fetched': f.bytes_fetched, 'requests': f.requests}
+            manifest_cache.put(key, etag, manifest, f.bytes_fetched, f.requests)
+            from_cache = False
+        else:
+            from_cache = True
+        metrics.inc('mosaic_cache_requests_total', cache='manifest', result='hit' if from_cache else 'miss')
+
+        return jsonify({
+            'key': key,
+            'etag': etag,
+            'objectSize': size,
+            'bytesFetched': cached['bytes_fetched'],
+            'rangeRequests': cached['requests'],
+            'cached': from_cache,
+            'root': cached['manifest']
+        })
+    except ClientError as e:
+        error_code = e.response['Error']['Code']
+        if error_code in ('404', 'NoSuchKey'):
+            return jsonify({'error': 'File not found'}), 404
+        return jsonify({'error': f'S3 error: {error_code}'}), 500
+    except OSError as e:
+        # h5py raises OSError for objects that are not valid HDF5
+        return jsonify({'error': f'Could not read HDF5 structure: {e}'}), 422
+
+@app.route('/api/s3/summary/<path:key>', methods=['GET'])
+def get_file_summary(key):
+    """Precomputed summary of a file: betas per phase and repetition, NaN
+    coverage and noise-ceiling statistics
+
+    Summaries are written at upload, `python -m utils.summary` backfills
+    older files.
+    """
+    if not s3_client:
+        return jsonify({'error': 'S3 client not configured'}), 500
+    if not allowed_file(key):
+        return jsonify({'error': 'Only HDF5 files (.hdf5, .h5) have summaries'}), 400
+
+    try:
+        entry = catalog.lookup([key]).get(key)
+        metadata = entry['metadata'] if entry else head_object_metadata(key)
+        crc32_hash = metadata.get('crc32_hash')
+        summary = get_summary(s3_client, S3_BUCKET, crc32_hash) if crc32_hash else None
+        if summary is None:
+            return jsonify({'error': 'No summary for this file yet'}), 404
+        response = jsonify({'key': key, 'crc32_hash': crc32_hash, 'summary': summary})
+        # Sidecars are keyed by content, a key only changes summary if the object is replaced
+        response.headers['Cache-Control'] = 'public, max-age=3600'
+        return response
+    except ClientError as e:
+        error_code = e.response['Error']['Code']
+        if error_code in ('404', 'NoSuchKey'):
+            return jsonify({'error': 'File not found'}), 404
+        return jsonify({'error': f'S3 error: {error_code}'}), 500
+
+@app.route('/api/s3/aggregate', methods=['POST'])
+def start_aggregate():
+    """Reduce one dataset elementwise across the files of a dataset group
+
+    Body: {"group": {datasetName, preprocessingPipeline, betaPipeline,
+    publicationUrl} as grouped on the download page, or "keys": [...],
+    "dataset" (path inside the files), "reduction" ('mean', 'count' of
+    non-NaN values or 'percentile') and "q" (percentile, 50 by default)}.
+    A result cached for the same input ETags is answered right away,
+    otherwise a job computes it and the response points at the job.
+    """
+    if not s3_client:
+        return jsonify({'error': 'S3 client not configured'}), 500
+    body = request.get_json(silent=True) or {}
+    dataset_path = body.get('dataset')
+    reduction = body.get('reduction', 'mean')
+    if not isinstance(dataset_path, str) or not dataset_path.strip('/'):
+        return jsonify({'error': 'dataset is required'}), 400
+
+    try:
+        q = parse_reduction(reduction, body.get('q'))
+        if isinstance(body.get('group'), dict):
+            members = group_members(catalog.entries(), body['group'])
+        elif isinstance(body.get('keys'), list) and all(isinstance(key, str) for key in body['keys']):
+            found = catalog.lookup(body['keys'])
+            missing = [key for key in body['keys'] if key not in found]
+            if missing:
+                return jsonify({'error': 'Files not found', 'missing': missing[:100]}), 404
+            members = list(found.values())
+        else:
+            return jsonify({'error': 'group or keys is required'}), 400
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except ClientError as e:
+        return jsonify({'error': f'S3 error: {e.response["Error"]["Code"]}'}), 500
+    if not members:
+        return jsonify({'error': 'No files in this group'}), 404
+    if len(members) > AGGREGATE_MAX_FILES:
+        return jsonify({'error': f'At most {AGGREGATE_MAX_FILES} files can be aggregated at once'}), 413
+
+    key = aggregate_cache_key(members, dataset_path, reduction, q)
+    cached = aggregate_cache.get(key)
+    metrics.inc('mosaic_cache_requests_total', cache='aggregate', result='hit' if cached else 'miss')
+    if cached:
+        return jsonify({**cached[0], 'cached': True})
+    payload = {
+        'cacheKey': key,
+        'dataset': dataset_path,
+        'reduction': reduction,
+        'q': q,
+        'members': [{'key': m['key'], 'etag': m['etag'], 'size': m['size']} for m in sorted(members, key=lambda m: m['key'])],
+    }
+    # The same aggregation requested again while it runs joins the running job
+    job_id = job_queue.enqueue_unique('aggregate', payload, same_payload=True)
+    return jsonify({
+        'message': 'Aggregation started',
+        'jobId': job_id,
+        'statusUrl': f'/api/jobs/{job_id}',
+        'cacheKey': key,
+        'resultUrl': f'/api/s3/aggregate/{key}',
+        'files': len(members)
+    }), 202
+
+@app.route('/api/s3/aggregate/<cache_key>', methods=['GET'])
+def get_aggregate(cache_key):
+    """Result of an aggregation, as JSON (default) or format=npy"""
+    output_format = request.args.get('format', 'json')
+    if output_format not in ('json', 'npy'):
+        return jsonify({'error': "format must be 'json' or 'npy'"}), 400
+    cached = aggregate_cache.get(secure_filename(cache_key))
+    if cached is None:
+        return jsonify({'error': 'No result for this aggregation, it may still be running'}), 404
+    description, path = cached
+    if output_format == 'npy':
+        response = send_file(os.path.abspath(path), mimetype='application/octet-stream',
+                             download_name=f"aggregate-{description['cacheKey']}.npy", etag=description['cacheKey'])
+    else:
+        result = np.load(path)
+        values = np.where(np.isnan(result), None, result) if result.dtype.kind == 'f' else result
+        response = jsonify({**description, 'values': values.tolist()})
+    # Results are addressed by their inputs' ETags and never change
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
+@app.route('/api/s3/slice/<path:key>', methods=['GET'])
+def slice_s3_file(key):
+    """Read one hyperslab of a dataset inside an HDF5 object
+
+    Query parameters: dataset (path inside the file), sel (numpy-style
+    selection like '0:100' or '...,5', the whole dataset by default) and
+    format ('npy' or 'arrow'). Only the blocks holding the file metadata and
+    the selected values are fetched, and they stay in a block cache shared by
+    later requests. X-Bytes-Transferred and X-Object-Size report how much of
+    the object this request fetched from S3.
+    """
+    if not s3_client:
+        return jsonify({'error': 'S3 client not configured'}), 500
+    if not allowed_file(key):
+        return jsonify({'error': 'Only HDF5 files (.hdf5, .h5) can be sliced'}), 400
+    dataset_path = request.args.get('dataset', '')
+    output_format = request.args.get('format', 'npy')
+    if not dataset_path:
+        return jsonify({'error': 'dataset is required'}), 400
+    if output_format not in ('npy', 'arrow'):
+        return jsonify({'error': "format must be 'npy' or 'arrow'"}), 400
+
+    try:
+        head = s3_client.head_object(Bucket=S3_BUCKET, Key=key)
+        with S3RangeFile(s3_client, S3_BUCKET, key, cache=slice_block_cache,
+                         size=head['ContentLength'], etag=head['ETag']) as f:
+            with h5py.File(f, 'r') as h5:
+                dataset = h5.get(dataset_path)
+                if not isinstance(dataset, h5py.Dataset):
+                    return jsonify({'error': f'No dataset {dataset_path} in {key}'}), 404
+                if dataset.dtype.kind == 'O':
+                    return jsonify({'error': 'Variable-length datasets cannot be sliced'}), 400
+                index = parse_selection(request.args.get('sel', ''), dataset.ndim)
+                nbytes = selection_nbytes(dataset, index)
+                if nbytes > SLICE_MAX_BYTES:
+                    return jsonify({'error': f"Selection is {humanize.naturalsize(nbytes, binary=True)}, the max is {humanize.naturalsize(SLICE_MAX_BYTES, binary=True)}. Select less or download the file."}), 413
+                array = dataset[index]
+
+        name = f"{Path(key).stem}-{dataset_path.strip('/').replace('/', '_')}"
+        if output_format == 'arrow':
+            response = Response(arrow_bytes(array, dataset_path), mimetype='application/vnd.apache.arrow.stream')
+            response.headers['Content-Disposition'] = f'attachment; filename="{name}.arrow"'
+        else:
+            response = Response(iter_npy(array), mimetype='application/octet-stream')
+            response.headers['Content-Disposition'] = f'attachment; filename="{name}.npy"'
+        response.headers['X-Bytes-Transferred'] = str(f.bytes_fetched)
+        response.headers['X-Object-Size'] = str(head['ContentLength'])
+        response.headers['X-Array-Shape'] = ','.join(str(n) for n in array.shape)
+        response.headers['X-Array-Dtype'] = str(array.dtype)
+        return response
+    except ValueError as e:
+        # Bad selections from parse_selection or h5py, or arrow without pyarrow
+        return jsonify({'error': str(e)}), 400
+    except ClientError as e:
+        error_code = e.response['Error']['Code']
+        if error_code in ('404', 'NoSuchKey'):
+            return jsonify({'error': 'File not found'}), 404
+        return jsonify({'error': f'S3 error: {error_code}'}), 500
+    except OSError as e:
+        return jsonify({'error': f'Could not read HDF5 data: {e}'}), 422
+
 @app.route('/api/s3/download/<path:filename>', methods=['GET'])
 def download_from_s3(filename):
     """Generate presigned URL for downloading file from S3"""
@@ -267,16 +1226,126 @@ def download_from_s3(filename):
         return jsonify({'error': 'S3 client not configured'}), 500
     
     try:
-        # Generate presigned URL (valid for 1 hour)
-        url = s3_client.generate_presigned_url(
-            'get_object',
-            Params={'Bucket': S3_BUCKET, 'Key': filename},
-            ExpiresIn=3600
-        )
+        # Presigned URL valid for at least PRESIGN_EXPIRY (1 hour)
+        url = presign_cache.url(filename)
         return jsonify({'download_url': url})
     except ClientError as e:
         return jsonify({'error': f'S3 error: {e.response["Error"]["Code"]}'}), 500
 
+@app.route('/api/s3/download/batch', methods=['POST'])
+def download_batch_from_s3():
+    """Generate presigned download URLs for a list of keys in one response
+
+    Body: {"keys": [...]}. Returns {"urls": {key: url}, "expiresIn": seconds},
+    every URL stays valid for at least expiresIn seconds.
+    """
+    if not s3_client:
+        return jsonify({'error': 'S3 client not configured'}), 500
+
+    keys = (request.get_json(silent=True) or {}).get('keys')
+    if not isinstance(keys, list) or not keys or not all(isinstance(key, str) and key for key in keys):
+        return jsonify({'error': 'keys must be a non-empty list of object keys'}), 400
+    if len(keys) > PRESIGN_BATCH_LIMIT:
+        return jsonify({'error': f'Request at most {PRESIGN_BATCH_LIMIT} keys at a time'}), 400
+
+    try:
+        return jsonify({'urls': presign_cache.urls(keys), 'expiresIn': PRESIGN_EXPIRY})
+    except ClientError as e:
+        return jsonify({'error': f'S3 error: {e.response["Error"]["Code"]}'}), 500
+
+@app.route('/api/s3/pool/stats', methods=['GET'])
+def get_s3_pool_stats():
+    """S3 connection pool counters of the worker process serving this request"""
+    return jsonify(pool_stats.snapshot())
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Prometheus metrics of every web and job worker on this host"""
+    return Response(prometheus_text(metrics.collect()), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/s3/manifest', methods=['POST'])
+def download_manifest():
+    """Manifest of files to download: key, size, crc32_hash and URL of each
+
+    Body: {"keys": [...]}. Keys that are not in the bucket are listed under
+    "missing". static/mosaic_download.py downloads a manifest in parallel,
+    resuming partial files and checking each against its crc32_hash.
+    """
+    if not s3_client:
+        return jsonify({'error': 'S3 client not configured'}), 500
+
+    keys = (request.get_json(silent=True) or {}).get('keys')
+    if not isinstance(keys, list) or not keys or not all(isinstance(key, str) and key for key in keys):
+        return jsonify({'error': 'keys must be a non-empty list of object keys'}), 400
+    if len(keys) > PRESIGN_BATCH_LIMIT:
+        return jsonify({'error': f'Request at most {PRESIGN_BATCH_LIMIT} keys at a time'}), 400
+
+    try:
+        keys = list(dict.fromkeys(keys))
+        entries = catalog.lookup(keys)
+        if CLOUDFRONT_URL:
+            urls = {key: f"{CLOUDFRONT_URL.rstrip('/')}/{quote(key)}" for key in entries}
+        else:
+            urls = presign_cache.urls(list(entries))
+        return jsonify({
+            'files': [{
+                'key': key,
+                'size': entries[key]['size'],
+                'crc32_hash': entries[key]['metadata'].get('crc32_hash', ''),
+                'url': urls[key]
+            } for key in keys if key in entries],
+            'missing': [key for key in keys if key not in entries],
+            'expiresIn': None if CLOUDFRONT_URL else PRESIGN_EXPIRY
+        })
+    except ClientError as e:
+        return jsonify({'error': f'S3 error: {e.response["Error"]["Code"]}'}), 500
+
+@app.route('/api/s3/bundle', methods=['GET', 'POST'])
+def bundle_s3_files():
+    """Stream a tar archive of several files straight from S3
+
+    The selection is either keys (JSON body, form fields or repeated query
+    parameters) or dataset/pipeline/owner filters over the catalog. The
+    archive is built on the fly from the object bodies, so it starts
+    arriving at once and the server holds one chunk in memory at a time.
+    Content-Length is exact, so browsers show real progress.
+    """
+    if not s3_client:
+        return jsonify({'error': 'S3 client not configured'}), 500
+
+    body = request.get_json(silent=True) or {}
+    keys = body.get('keys') or request.values.getlist('keys')
+    dataset = body.get('dataset') or request.values.get('dataset', '')
+    pipeline = body.get('pipeline') or request.values.get('pipeline', '')
+    owner = body.get('owner') or request.values.get('owner', '')
+
+    try:
+        if keys:
+            if not isinstance(keys, list) or not all(isinstance(key, str) and key for key in keys):
+                return jsonify({'error': 'keys must be a list of object keys'}), 400
+            keys = list(dict.fromkeys(keys))
+            found = catalog.lookup(keys)
+            missing = [key for key in keys if key not in found]
+            if missing:
+                return jsonify({'error': 'Some files were not found', 'missing': missing}), 404
+            entries = [found[key] for key in keys]
+        elif dataset or pipeline or owner:
+            entries, _, _ = catalog.query(dataset=dataset, pipeline=pipeline, owner=owner)
+        else:
+            return jsonify({'error': 'Select files with keys or a dataset, pipeline or owner'}), 400
+        if not entries:
+            return jsonify({'error': 'No files match the selection'}), 404
+        if len(entries) > BUNDLE_MAX_FILES:
+            return jsonify({'error': f'Bundles hold at most {BUNDLE_MAX_FILES} files, select fewer'}), 400
+    except ClientError as e:
+        return jsonify({'error': f'S3 error: {e.response["Error"]["Code"]}'}), 500
+
+    name = secure_filename(dataset) if dataset and not keys else 'selection'
+    response = Response(iter_tar(s3_client, S3_BUCKET, entries), mimetype='application/x-tar', direct_passthrough=True)
+    response.headers['Content-Length'] = str(tar_size(entries))
+    response.headers['Content-Disposition'] = f'attachment; filename="mosaic-{name or "selection"}.tar"'
+    return response
+
 @app.route('/api/s3/bucket/info', methods=['GET'])
 def get_bucket_info():
     """Get S3 bucket information"""
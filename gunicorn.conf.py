@@ -1,9 +1,53 @@
 # gunicorn.conf.py
-bind = "127.0.0.1:5000"
-workers = 4
-worker_class = "sync"
+import os
+import subprocess
+import sys
+
+bind = os.environ.get('GUNICORN_BIND', "127.0.0.1:5000")
+workers = int(os.environ.get('GUNICORN_WORKERS', 4))
+# "gthread" serves several requests per worker on threads, which suits the
+# app since nearly all request time is spent waiting on S3. "sync" serves one
+# request per worker at a time.
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', "gthread")
+# gunicorn silently turns sync into gthread when threads > 1, so sync keeps one
+threads = int(os.environ.get('GUNICORN_THREADS', 8)) if worker_class == "gthread" else 1
 timeout = 30
 keepalive = 2
 max_requests = 1000
 max_requests_jitter = 100
 preload_app = True
+
+# Metrics files of a previous run would be merged into /metrics
+def on_starting(server):
+    from utils.metrics import clear_metrics
+    clear_metrics()
+
+# Upload jobs (hashing, dedup, S3 transfer) run in separate processes so the
+# web workers stay free for page renders. They run under their own supervisor
+# (utils/jobs.py), a fresh interpreter rather than a fork of this master, which
+# restarts workers that die and exits with the master.
+def when_ready(server):
+    from utils.jobs import JOB_WORKERS
+    if JOB_WORKERS > 0:
+        server.log.info(f"Starting {JOB_WORKERS} upload job workers")
+        server.job_supervisor = subprocess.Popen([sys.executable, '-m', 'utils.jobs', '--workers', str(JOB_WORKERS),
+                                                  '--parent_pid', str(os.getpid())])
+
+def on_exit(server):
+    supervisor = getattr(server, 'job_supervisor', None)
+    if supervisor is not None:
+        supervisor.terminate()
+        supervisor.wait()
+
+# New workers, including the ones replacing workers recycled at max_requests,
+# load the heavy dependencies, the S3 client and a fresh catalog before they
+# accept their first request. WORKER_WARM_UP=0 leaves that to the first requests.
+def post_worker_init(worker):
+    if os.environ.get('WORKER_WARM_UP', '1') == '1':
+        from app import warm_up_worker
+        warm_up_worker()
+
+# Write the last requests' metrics before a worker exits, e.g. at max_requests
+def worker_exit(server, worker):
+    from utils.metrics import metrics
+    metrics.flush()
@@ -1,6 +1,11 @@
 
 let selectedFiles = new Set();
 let allData = [];
+let totalFiles = 0;
+let nextCursor = null;
+let searchTimer = null;
+// Aborts the load in flight when a newer one starts, so a slow response for an old filter never overwrites the table
+let loadController = null;
 
 // Initialize page
 document.addEventListener('DOMContentLoaded', function() {
@@ -11,21 +16,97 @@ document.addEventListener('DOMContentLoaded', function() {
 function setupEventListeners() {
     document.getElementById('searchInput').addEventListener('input', filterData);
     document.getElementById('copyButton').addEventListener('click', copyScript);
+    document.getElementById('loadMoreButton').addEventListener('click', () => loadData(true));
 }
 
 
-// Load data from Flask API
-async function loadData() {
+// Same format as humanize.naturalsize(binary=True) on the server
+function formatSize(bytes) {
+    if (bytes === 1) {
+        return '1 Byte';
+    }
+    if (bytes < 1024) {
+        return `${bytes} Bytes`;
+    }
+    const units = ['KiB', 'MiB', 'GiB', 'TiB', 'PiB'];
+    let value = bytes / 1024;
+    let unit = 0;
+    while (value >= 1024 && unit < units.length - 1) {
+        value /= 1024;
+        unit++;
+    }
+    return `${value.toFixed(1)} ${units[unit]}`;
+}
+
+// Snapshot entries carry the raw object metadata, shape them like /api/s3/files rows
+function snapshotFileToItem(file) {
+    const metadata = file.metadata;
+    return {
+        fileId: file.key,
+        datasetName: metadata.dataset_name || '',
+        subjectName: metadata.subjectID || '',
+        preprocessingPipeline: metadata.preprocessing_pipeline || '',
+        ownerName: metadata.owner_name || '',
+        ownerEmail: metadata.owner_email || '',
+        betaPipeline: metadata.beta_pipeline || '',
+        githubUrl: metadata.github_url || '',
+        publicationUrl: metadata.publication_url || '',
+        lastModified: file.lastModified,
+        size: formatSize(file.size)
+    };
+}
+
+// The unfiltered list comes from the precompressed catalog snapshot, which the
+// browser revalidates with its ETag. Returns false if there is no snapshot yet.
+async function loadSnapshot(signal) {
+    const response = await fetch('api/s3/catalog', {cache: 'no-cache', signal});
+    if (!response.ok) {
+        return false;
+    }
+    const snapshot = await response.json();
+    allData = snapshot.files.map(snapshotFileToItem);
+    totalFiles = allData.length;
+    nextCursor = null;
+    document.getElementById('loadMoreButton').style.display = 'none';
+    displayData(allData);
+    updateStats();
+    return true;
+}
+
+// Load data from Flask API, filtered server-side. With append, fetch the next page.
+async function loadData(append = false) {
+    if (loadController) {
+        loadController.abort();
+    }
+    const controller = loadController = new AbortController();
     try {
-        const response = await fetch(`api/s3/files`);
+        const params = new URLSearchParams();
+        const searchTerm = document.getElementById('searchInput').value.trim();
+        if (searchTerm) {
+            params.set('q', searchTerm);
+        }
+        if (append && nextCursor) {
+            params.set('cursor', nextCursor);
+        }
+        if (!searchTerm && !append && await loadSnapshot(controller.signal)) {
+            return;
+        }
+        const response = await fetch(`api/s3/files?${params}`, {signal: controller.signal});
         if (!response.ok) {
             throw new Error(`HTTP error! status: ${response.status}`);
         }
         const data = await response.json();
-        allData = data;
+        allData = append ? allData.concat(data) : data;
+        totalFiles = parseInt(response.headers.get('X-Total-Count') || allData.length, 10);
+        nextCursor = response.headers.get('X-Next-Cursor');
+        document.getElementById('loadMoreButton').style.display = nextCursor ? 'inline-block' : 'none';
         displayData(allData);
         updateStats();
     } catch (error) {
+        if (error.name === 'AbortError') {
+            // A newer load replaced this one
+            return;
+        }
         console.error('Error loading data:', error);
         // Show error message to user
         const container = document.getElementById('datasetGroups');
@@ -85,6 +166,7 @@ function createGroupElement(group) {
     groupDiv.innerHTML = `
         <div class="group-header">
             <div class="group-title">${group.metadata.datasetName}</div>
+            <button class="bundle-button" type="button">Download ${group.files.length} files as .tar</button>
             <div class="group-metadata">
                 <div class="metadata-item">
                     <span class="metadata-label">Preprocessing Pipeline</span>
@@ -111,14 +193,35 @@ function createGroupElement(group) {
             ${group.files.map(file => createFileElement(file)).join('')}
         </div>
     `;
+    groupDiv.querySelector('.bundle-button').addEventListener('click',
+        () => downloadBundle(group.files.map(file => file.fileId)));
     
     return groupDiv;
 }
 
+// The server streams one tar archive of the files straight from S3. A form
+// POST lets the browser save the response as a download while it streams.
+function downloadBundle(fileIds) {
+    const form = document.createElement('form');
+    form.method = 'POST';
+    form.action = 'api/s3/bundle';
+    fileIds.forEach(fileId => {
+        const input = document.createElement('input');
+        input.type = 'hidden';
+        input.name = 'keys';
+        input.value = fileId;
+        form.appendChild(input);
+    });
+    document.body.appendChild(form);
+    form.submit();
+    form.remove();
+}
+
 function createFileElement(file) {
     return `
         <div class="object-item" style="display: grid; grid-template-columns: 40px 2fr 100px 200px 1fr; gap: 1rem; align-items: center; padding: 0.5rem;">
             <input type="checkbox" class="object-checkbox" data-file-id="${file.fileId}" 
+                   ${selectedFiles.has(file.fileId) ? 'checked' : ''}
                    onchange="toggleFileSelection('${file.fileId}')">
             <span style="word-break: break-all;">${file.fileId}</span>
             <span>${file.size}</span>
@@ -150,60 +253,37 @@ echo "Please select files to download"`;
     }
     
     const fileList = Array.from(selectedFiles);
+    const manifestUrl = new URL('api/s3/manifest', window.location.href);
+    const downloaderUrl = new URL('static/mosaic_download.py', window.location.href);
     const script = `#!/bin/bash
 # Download script for selected files into your current directory
 # Total files: ${fileList.length}
+# Files download in parallel and are checked against their CRC32 hash.
+# If the download is interrupted, run the script again to resume it.
 
-CLOUDFRONT_URL="https://d3ctas52djku5l.cloudfront.net"
-FILES=(
-${fileList.map(file => `    "${file}"`).join('\n')}
-)
-
-echo "Downloading ${fileList.length} files..."
-
-for file in "\${FILES[@]}"; do
-    echo "Downloading \$file..."
-    curl -L -o "./\$file" "\$CLOUDFRONT_URL/\$file"
-    if [ $? -eq 0 ]; then
-        echo "✓ Successfully downloaded \$file"
-    else
-        echo "✗ Failed to download \$file"
-    fi
-done
+cat > mosaic_keys.json <<'EOF'
+${JSON.stringify({keys: fileList}, null, 2)}
+EOF
 
-echo "Download complete!"`;
+curl -sfL -o mosaic_download.py "${downloaderUrl}"
+curl -sfL -o mosaic_manifest.json -H "Content-Type: application/json" -d @mosaic_keys.json "${manifestUrl}"
+python3 mosaic_download.py mosaic_manifest.json --out . --parallel 4`;
     
     scriptElement.textContent = script;
 }
 
 function filterData() {
-    const searchTerm = document.getElementById('searchInput').value.toLowerCase();
-    
-    if (!searchTerm) {
-        displayData(allData);
-        return;
-    }
-    
-    const filteredData = allData.filter(item => 
-        item.datasetName.toLowerCase().includes(searchTerm) ||
-        item.preprocessingPipeline.toLowerCase().includes(searchTerm) ||
-        item.betaPipeline.toLowerCase().includes(searchTerm) ||
-        item.githubUrl.toLowerCase().includes(searchTerm) ||
-        item.ownerName.toLowerCase().includes(searchTerm) ||
-        item.fileId.toLowerCase().includes(searchTerm)
-    );
-    
-    displayData(filteredData);
-    updateStats();
+    // Debounce keystrokes, the server does the filtering
+    clearTimeout(searchTimer);
+    searchTimer = setTimeout(() => loadData(), 250);
 }
 
 function updateStats() {
     const groups = groupData(allData);
-    const totalFiles = allData.length;
     const selectedCount = selectedFiles.size;
     
     document.getElementById('statsDisplay').textContent = 
-        `${groups.length} datasets, ${totalFiles} files (${selectedCount} selected)`;
+        `${groups.length} datasets, ${allData.length} of ${totalFiles} files shown (${selectedCount} selected)`;
 }
 
 function copyScript() {
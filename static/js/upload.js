@@ -0,0 +1,243 @@
+// Resumable multipart upload: the file goes from the browser straight to S3 in
+// parts, the Flask app only hands out presigned part URLs and assembles them.
+const PARALLEL_PARTS = 4;
+const URL_BATCH_SIZE = 50;
+const PART_RETRIES = 3;
+const JOB_POLL_MS = 1000;
+// Bytes read per step while hashing, and leading bytes sent with the preflight
+const HASH_CHUNK_SIZE = 8 * 1024 * 1024;
+const PREFLIGHT_HEADER_BYTES = 64 * 1024;
+
+document.addEventListener('DOMContentLoaded', function() {
+    document.getElementById('uploadForm').addEventListener('submit', handleSubmit);
+});
+
+async function apiJson(url, options = {}) {
+    const response = await fetch(url, options);
+    const body = await response.json();
+    if (!response.ok) {
+        throw new Error(body.error || `HTTP error! status: ${response.status}`);
+    }
+    return body;
+}
+
+function postJson(url, data) {
+    return apiJson(url, {
+        method: 'POST',
+        headers: {'Content-Type': 'application/json'},
+        body: JSON.stringify(data)
+    });
+}
+
+const CRC32_TABLE = (() => {
+    const table = new Uint32Array(256);
+    for (let n = 0; n < 256; n++) {
+        let c = n;
+        for (let k = 0; k < 8; k++) {
+            c = c & 1 ? 0xEDB88320 ^ (c >>> 1) : c >>> 1;
+        }
+        table[n] = c >>> 0;
+    }
+    return table;
+})();
+
+// Same CRC32 as zlib.crc32 on the server, read from disk in chunks
+async function fileCrc32(file, onProgress) {
+    let crc = 0xFFFFFFFF;
+    for (let offset = 0; offset < file.size; offset += HASH_CHUNK_SIZE) {
+        const bytes = new Uint8Array(await file.slice(offset, offset + HASH_CHUNK_SIZE).arrayBuffer());
+        for (let i = 0; i < bytes.length; i++) {
+            crc = CRC32_TABLE[(crc ^ bytes[i]) & 0xFF] ^ (crc >>> 8);
+        }
+        onProgress(Math.min(offset + HASH_CHUNK_SIZE, file.size), file.size);
+    }
+    return ((crc ^ 0xFFFFFFFF) >>> 0).toString(16).padStart(8, '0');
+}
+
+async function fileHeaderBase64(file) {
+    const bytes = new Uint8Array(await file.slice(0, PREFLIGHT_HEADER_BYTES).arrayBuffer());
+    let binary = '';
+    for (let i = 0; i < bytes.length; i++) {
+        binary += String.fromCharCode(bytes[i]);
+    }
+    return btoa(binary);
+}
+
+// Ask the server whether the file would be accepted before sending it. Invalid
+// files fail here with the server's reason, no bytes uploaded. A file matching
+// one in the bucket by CRC32 and size is probably a duplicate, the user decides
+// whether to send it anyway and the server compares the content afterwards.
+async function preflight(file, onChecking) {
+    const [crc32, header] = await Promise.all([fileCrc32(file, onChecking), fileHeaderBase64(file)]);
+    const result = await postJson('api/s3/upload/preflight', {filename: file.name, size: file.size, crc32, header});
+    if (result.decision === 'duplicate' &&
+        !window.confirm(`This file looks like ${result.existingKey}, which is already uploaded. Upload it anyway?`)) {
+        throw new Error(`Not uploaded, the file is probably already uploaded as ${result.existingKey}.`);
+    }
+    return result.uploadToken;
+}
+
+// Uploads are remembered per file so a reload or dropped connection resumes
+function resumeKey(file) {
+    return `mosaic-upload:${file.name}:${file.size}:${file.lastModified}`;
+}
+
+async function startOrResume(file, onChecking) {
+    const savedId = localStorage.getItem(resumeKey(file));
+    if (savedId) {
+        try {
+            const session = await apiJson(`api/s3/multipart/${encodeURIComponent(savedId)}`);
+            // Finalizing uploads are picked up again by polling their job
+            if (['active', 'assembled', 'finalizing'].includes(session.status)) {
+                return session;
+            }
+        } catch (error) {
+            console.warn('Could not resume upload, starting over:', error);
+        }
+        localStorage.removeItem(resumeKey(file));
+    }
+    const uploadToken = await preflight(file, onChecking);
+    const session = await postJson('api/s3/multipart', {filename: file.name, size: file.size, uploadToken});
+    localStorage.setItem(resumeKey(file), session.uploadId);
+    return session;
+}
+
+function partBlob(file, session, partNumber) {
+    const start = (partNumber - 1) * session.partSize;
+    return file.slice(start, Math.min(start + session.partSize, file.size));
+}
+
+// Hashing and dedup run in a background job on the server, poll it until it ends
+async function waitForJob(jobId, onProgress) {
+    while (true) {
+        const job = await apiJson(`api/jobs/${encodeURIComponent(jobId)}`);
+        onProgress(job.progress.bytes, job.progress.total);
+        if (job.status === 'succeeded') {
+            return job.result;
+        }
+        if (job.status === 'failed') {
+            throw new Error(job.error || 'Processing the upload failed');
+        }
+        await new Promise(resolve => setTimeout(resolve, JOB_POLL_MS));
+    }
+}
+
+async function uploadFile(file, onProgress, onProcessing, onChecking) {
+    const session = await startOrResume(file, onChecking);
+    const uploadUrl = `api/s3/multipart/${encodeURIComponent(session.uploadId)}`;
+    if (session.status === 'finalizing') {
+        onProcessing();
+        const result = await waitForJob(session.jobId, onProgress);
+        localStorage.removeItem(resumeKey(file));
+        return result;
+    }
+    const done = new Set(session.uploadedParts || []);
+    const pending = [];
+    let uploadedBytes = 0;
+    for (let n = 1; n <= session.partCount; n++) {
+        if (done.has(n) || session.status === 'assembled') {
+            uploadedBytes += partBlob(file, session, n).size;
+        } else {
+            pending.push(n);
+        }
+    }
+    onProgress(uploadedBytes, file.size);
+
+    // Presigned URLs are requested in batches, shared by all part workers
+    const urlBatches = new Map();
+    function urlFor(index) {
+        const batch = Math.floor(index / URL_BATCH_SIZE);
+        if (!urlBatches.has(batch)) {
+            const partNumbers = pending.slice(batch * URL_BATCH_SIZE, (batch + 1) * URL_BATCH_SIZE);
+            urlBatches.set(batch, postJson(`${uploadUrl}/urls`, {partNumbers}));
+        }
+        return urlBatches.get(batch).then(result => result.urls[pending[index]]);
+    }
+
+    async function putPart(index) {
+        const blob = partBlob(file, session, pending[index]);
+        for (let attempt = 0; ; attempt++) {
+            try {
+                const response = await fetch(await urlFor(index), {method: 'PUT', body: blob});
+                if (!response.ok) {
+                    throw new Error(`part ${pending[index]} failed with status ${response.status}`);
+                }
+                return blob.size;
+            } catch (error) {
+                if (attempt >= PART_RETRIES) {
+                    throw error;
+                }
+                // The URL may have expired, fetch a fresh batch on retry
+                urlBatches.delete(Math.floor(index / URL_BATCH_SIZE));
+            }
+        }
+    }
+
+    let next = 0;
+    async function worker() {
+        while (next < pending.length) {
+            const index = next++;
+            uploadedBytes += await putPart(index);
+            onProgress(uploadedBytes, file.size);
+        }
+    }
+    await Promise.all(Array.from({length: PARALLEL_PARTS}, worker));
+
+    const job = await postJson(`${uploadUrl}/complete`, {});
+    onProcessing();
+    const result = await waitForJob(job.jobId, onProgress);
+    localStorage.removeItem(resumeKey(file));
+    return result;
+}
+
+function showProgress(loaded, total) {
+    const percentComplete = total ? (loaded / total) * 100 : 100;
+    document.getElementById('progressContainer').style.display = 'block';
+    document.getElementById('progressBar').style.width = percentComplete + '%';
+    document.getElementById('progressText').textContent =
+        `${Math.round(percentComplete)}% (${(loaded / 1024 / 1024).toFixed(1)} MB / ${(total / 1024 / 1024).toFixed(1)} MB)`;
+}
+
+async function handleSubmit(e) {
+    e.preventDefault();
+
+    const statusDiv = document.getElementById('uploadStatus');
+    const submitButton = e.target.querySelector('button[type="submit"]');
+    const file = document.getElementById('file').files[0];
+
+    // Show loading state
+    statusDiv.style.display = 'block';
+    statusDiv.style.background = '#fff3cd';
+    statusDiv.style.color = '#856404';
+    statusDiv.textContent = 'Uploading file to S3...';
+    submitButton.disabled = true;
+    submitButton.textContent = 'Uploading...';
+
+    let phase = 'uploading';
+    try {
+        const result = await uploadFile(file, (loaded, total) => {
+            if (phase === 'uploading') {
+                statusDiv.textContent = 'Uploading file to S3...';
+            }
+            showProgress(loaded, total);
+        }, () => {
+            phase = 'processing';
+            statusDiv.textContent = 'Checking and processing the uploaded file...';
+        }, (hashed, total) => {
+            statusDiv.textContent = 'Checking the file before uploading...';
+            showProgress(hashed, total);
+        });
+        statusDiv.style.background = '#d4edda';
+        statusDiv.style.color = '#155724';
+        statusDiv.textContent = `File uploaded successfully! Filename: ${result.filename}`;
+        document.getElementById('uploadForm').reset();
+    } catch (error) {
+        statusDiv.style.background = '#f8d7da';
+        statusDiv.style.color = '#721c24';
+        statusDiv.textContent = `Upload failed: ${error.message}`;
+    } finally {
+        document.getElementById('progressContainer').style.display = 'none';
+        submitButton.disabled = false;
+        submitButton.textContent = 'Upload to S3';
+    }
+}
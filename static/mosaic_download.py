@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+Download MOSAIC files listed in a manifest from the website's /api/s3/manifest.
+
+Several files download in parallel. An interrupted download leaves a
+<file>.part behind, and the next run resumes it with an HTTP Range request.
+Every file is checked against the CRC32 in the manifest while it streams in,
+so verifying costs no second pass over the data.
+
+Usage:
+    python3 mosaic_download.py mosaic_manifest.json --out . --parallel 4
+
+Only needs the Python standard library.
+"""
+import argparse
+import http.client
+import json
+import os
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+import zlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class HashMismatch(Exception):
+    pass
+
+
+class Progress:
+    """Bytes done across all downloads, printed about once a second"""
+
+    def __init__(self, files, total_bytes):
+        self.files = files
+        self.total_bytes = total_bytes
+        self.done_files = 0
+        self._bytes = {}
+        self._lock = threading.Lock()
+        self._start = time.monotonic()
+        self._printed = 0
+
+    def update(self, key, bytes_done):
+        with self._lock:
+            self._bytes[key] = bytes_done
+            now = time.monotonic()
+            if now - self._printed >= 1:
+                self._printed = now
+                self._print(now)
+
+    def file_done(self):
+        with self._lock:
+            self.done_files += 1
+
+    def _print(self, now):
+        done = sum(self._bytes.values())
+        rate = done / max(now - self._start, 1e-9)
+        total = f"/{self.total_bytes / 1e9:.2f}" if self.total_bytes else ""
+        print(f"  {done / 1e9:.2f}{total} GB  {rate / 1e6:.1f} MB/s  {self.done_files}/{self.files} files",
+              file=sys.stderr, flush=True)
+
+
+def load_manifest(source):
+    if source.startswith(('http://', 'https://')):
+        with urllib.request.urlopen(source, timeout=60) as response:
+            return json.load(response)
+    with open(source) as f:
+        return json.load(f)
+
+
+def target_path(out_dir, key):
+    parts = key.split('/')
+    if key.startswith('/') or '..' in parts:
+        raise ValueError(f"Refusing to write outside {out_dir}: {key}")
+    return os.path.join(out_dir, *parts)
+
+
+def crc32_of_file(path, chunk_size=CHUNK_SIZE):
+    crc = 0
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                return crc
+            crc = zlib.crc32(chunk, crc)
+
+
+def fetch(entry, part_path, chunk_size, progress):
+    """Download into part_path, resuming from its current length
+
+    Returns:
+        CRC32 of the whole file
+    """
+    size = entry.get('size')
+    offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    if size is not None and offset > size:
+        offset = 0
+    # Resuming continues the CRC from the bytes already on disk
+    crc = crc32_of_file(part_path, chunk_size) if offset else 0
+    progress.update(entry['key'], offset)
+    if size is not None and offset == size:
+        return crc
+
+    headers = {'Range': f'bytes={offset}-'} if offset else {}
+    with urllib.request.urlopen(urllib.request.Request(entry['url'], headers=headers), timeout=60) as response:
+        if offset and response.status != 206:
+            # The server ignored the Range header and sends the whole file
+            offset, crc = 0, 0
+        with open(part_path, 'ab' if offset else 'wb') as f:
+            while True:
+                chunk = response.read(chunk_size)
+                if not chunk:
+                    break
+                f.write(chunk)
+                crc = zlib.crc32(chunk, crc)
+                offset += len(chunk)
+                progress.update(entry['key'], offset)
+
+    if size is not None and offset != size:
+        raise ConnectionError(f"connection closed after {offset} of {size} bytes")
+    return crc
+
+
+def download(entry, out_dir, chunk_size, retries, progress):
+    """Download one manifest entry unless it is already complete
+
+    Returns:
+        'downloaded' or 'skipped'
+    """
+    path = target_path(out_dir, entry['key'])
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    size = entry.get('size')
+    if os.path.exists(path) and (size is None or os.path.getsize(path) == size):
+        progress.update(entry['key'], size or 0)
+        return 'skipped'
+
+    part_path = path + '.part'
+    expected = entry.get('crc32_hash') or None
+    for attempt in range(retries + 1):
+        try:
+            crc = fetch(entry, part_path, chunk_size, progress)
+            if expected and f"{crc & 0xffffffff:08x}" != expected.lower():
+                os.remove(part_path)
+                raise HashMismatch(f"CRC32 is {crc & 0xffffffff:08x}, expected {expected}")
+            os.replace(part_path, path)
+            return 'downloaded'
+        except (HashMismatch, ConnectionError, urllib.error.URLError, http.client.HTTPException, OSError) as e:
+            if attempt == retries:
+                raise
+            print(f"Retrying {entry['key']} ({e})", file=sys.stderr)
+            time.sleep(min(2 ** attempt, 30))
+
+
+def main(args):
+    manifest = load_manifest(args.manifest)
+    files = manifest['files']
+    for key in manifest.get('missing', []):
+        print(f"Not available: {key}", file=sys.stderr)
+    total_bytes = sum(entry.get('size') or 0 for entry in files)
+    print(f"Downloading {len(files)} files ({total_bytes / 1e9:.2f} GB) to {args.out}", file=sys.stderr)
+
+    progress = Progress(len(files), total_bytes)
+    failed = []
+    with ThreadPoolExecutor(max_workers=args.parallel) as executor:
+        futures = {executor.submit(download, entry, args.out, args.chunk_size, args.retries, progress): entry
+                   for entry in files}
+        for future in as_completed(futures):
+            key = futures[future]['key']
+            progress.file_done()
+            try:
+                status = future.result()
+                print(f"✓ {key} ({status})", file=sys.stderr)
+            except Exception as e:
+                failed.append(key)
+                print(f"✗ {key}: {e}", file=sys.stderr)
+
+    if failed:
+        print(f"{len(failed)} files failed, run the same command again to resume them", file=sys.stderr)
+        return 1
+    print("Download complete!", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Download MOSAIC files from a manifest, in parallel and resumable.")
+    parser.add_argument("manifest", help="Manifest JSON file or URL from /api/s3/manifest.")
+    parser.add_argument("--out", default=".", help="Directory to download into.")
+    parser.add_argument("--parallel", type=int, default=4, help="Files downloaded at the same time.")
+    parser.add_argument("--retries", type=int, default=3, help="Retries per file, each resuming where the last stopped.")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="Bytes read per chunk.")
+    sys.exit(main(parser.parse_args()))
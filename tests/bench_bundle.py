@@ -0,0 +1,70 @@
+from dotenv import load_dotenv
+load_dotenv()
+import os
+import sys
+import argparse
+import multiprocessing
+import resource
+import time
+from datetime import datetime, timezone
+
+import boto3
+from botocore.config import Config
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from s3_standin import BENCH_BUCKET, free_port, run_synthetic_s3
+from utils.bundle import iter_tar, tar_size
+
+"""
+Stream a large tar bundle (50 GiB by default) through utils.bundle.iter_tar,
+the generator behind /api/s3/bundle, and report throughput, time to first
+byte and peak RSS.
+
+Objects come from a synthetic S3 stand-in in a separate process that
+generates object bodies on the fly, so bundle size is not limited by memory
+or disk. Peak RSS should stay flat as --total_gb grows.
+"""
+
+def main(args):
+    object_size = int(args.object_gb * 1024**3)
+    count = max(1, int(args.total_gb / args.object_gb))
+    port = free_port()
+    standin = multiprocessing.Process(target=run_synthetic_s3, args=(object_size, port), daemon=True)
+    standin.start()
+    time.sleep(1)
+
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+    s3_client = boto3.client("s3", region_name="us-east-1", endpoint_url=f"http://127.0.0.1:{port}",
+                             config=Config(s3={"addressing_style": "path"}))
+    now = datetime.now(timezone.utc)
+    entries = [{"key": f"sub-{i:05d}_bench.hdf5", "size": object_size, "etag": '"synthetic"', "last_modified": now}
+               for i in range(count)]
+    expected = tar_size(entries)
+
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    first_byte = None
+    total = 0
+    for chunk in iter_tar(s3_client, BENCH_BUCKET, entries, chunk_size=args.chunk_mb * 1024 * 1024):
+        if first_byte is None:
+            first_byte = time.perf_counter() - start
+        total += len(chunk)
+    seconds = time.perf_counter() - start
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    standin.terminate()
+
+    print(f"{count} objects x {args.object_gb} GiB, {total / 1024**3:.2f} GiB archive ({'matches' if total == expected else 'DIFFERS FROM'} Content-Length)")
+    print(f"time to first byte {first_byte * 1000:.1f} ms, {seconds:.1f} s, {total / 1e6 / seconds:.0f} MB/s")
+    print(f"peak RSS {rss_before / 1024:.0f} MiB before, {rss_after / 1024:.0f} MiB after")
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--total_gb", type=float, default=50, help="Approximate bundle size in GiB.")
+    parser.add_argument("--object_gb", type=float, default=2, help="Size of each object in GiB.")
+    parser.add_argument("--chunk_mb", type=int, default=1, help="Chunk size read from S3 in MiB.")
+
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,54 @@
+import os
+import sys
+import argparse
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from s3_standin import BENCH_BUCKET, mock_s3, inject_latency, seed_bucket
+
+"""
+Measure cold and warm latency of /api/s3/files against a moto S3 stand-in.
+
+A cold request lists the bucket and HEADs every object, a warm request is
+served from the in-memory catalog, and a refresh after one new upload should
+only HEAD the new key.
+"""
+
+def timed_get(client, url):
+    start = time.perf_counter()
+    response = client.get(url)
+    elapsed = time.perf_counter() - start
+    assert response.status_code == 200, response.get_json()
+    return elapsed, response
+
+def main(args):
+    os.environ["S3_BUCKET"] = BENCH_BUCKET
+    with mock_s3():
+        import app as webapp
+
+        seed_bucket(webapp.s3_client, BENCH_BUCKET, args.objects)
+        inject_latency(webapp.s3_client, args.latency_ms / 1000)
+        client = webapp.app.test_client()
+
+        cold, response = timed_get(client, "/api/s3/files")
+        print(f"cold:    {cold * 1000:9.1f} ms  ({len(response.get_json())} files, {webapp.catalog.stats['heads']} HEADs)")
+
+        warm_times = [timed_get(client, "/api/s3/files")[0] for _ in range(args.repeats)]
+        print(f"warm:    {min(warm_times) * 1000:9.1f} ms  (best of {args.repeats})")
+
+        # Simulate a successful upload: one new object, then invalidate
+        webapp.s3_client.put_object(Bucket=BENCH_BUCKET, Key="sub-new_dataset00.hdf5", Body=b"", Metadata={})
+        heads_before = webapp.catalog.stats["heads"]
+        webapp.catalog.invalidate()
+        refresh, _ = timed_get(client, "/api/s3/files")
+        print(f"refresh: {refresh * 1000:9.1f} ms  ({webapp.catalog.stats['heads'] - heads_before} HEADs)")
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--objects", type=int, default=500, help="Number of HDF5 objects to seed the bucket with.")
+    parser.add_argument("--latency_ms", type=float, default=5, help="Simulated S3 round trip latency per request.")
+    parser.add_argument("--repeats", type=int, default=5, help="Number of warm requests to time.")
+
+    args = parser.parse_args()
+
+    main(args)
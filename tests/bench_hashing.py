@@ -0,0 +1,78 @@
+from dotenv import load_dotenv
+load_dotenv()
+import os
+import sys
+import argparse
+import tempfile
+import time
+import zlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.hashing import available_algorithms, hash_file, tree_hash
+
+"""
+Compare hashing throughput (MB/s) across algorithms, buffer sizes, mmap and
+tree mode on a synthetic file. The old generate_content_hash() loop (8 KiB
+f.read() chunks into zlib.crc32) is timed as the baseline.
+
+Run it twice or use a file smaller than RAM if you want to compare warm page
+cache numbers, the first pass over a fresh file also measures the disk.
+"""
+
+def make_synthetic_file(path, size_gb):
+    block = os.urandom(64 * 1024 * 1024)
+    remaining = int(size_gb * 1024**3)
+    with open(path, 'wb') as f:
+        while remaining > 0:
+            f.write(block[:remaining])
+            remaining -= len(block)
+
+def legacy_crc32(path):
+    with open(path, 'rb') as f:
+        crc = 0
+        while True:
+            chunk = f.read(8192)
+            if not chunk:
+                break
+            crc = zlib.crc32(chunk, crc)
+    return f"{crc & 0xffffffff:08x}"
+
+def timed(label, size, fn):
+    start = time.perf_counter()
+    fn()
+    seconds = time.perf_counter() - start
+    print(f"{label:<40} {size / 1e6 / seconds:>9.0f} MB/s")
+
+def main(args):
+    path = args.file
+    if path is None:
+        path = os.path.join(tempfile.gettempdir(), "mosaic_hash_bench.bin")
+        if not os.path.exists(path) or os.path.getsize(path) != int(args.size_gb * 1024**3):
+            print(f"writing {args.size_gb} GiB synthetic file to {path}...")
+            make_synthetic_file(path, args.size_gb)
+    size = os.path.getsize(path)
+
+    # Warm the page cache so every run measures hashing, not the disk
+    hash_file(path, 'crc32', chunk_size=64 * 1024 * 1024)
+
+    timed("crc32 8KiB f.read() (legacy)", size, lambda: legacy_crc32(path))
+    for algorithm in args.algorithms or available_algorithms():
+        for chunk_mb in args.chunk_mb:
+            chunk_size = int(chunk_mb * 1024 * 1024)
+            timed(f"{algorithm} readinto {chunk_mb} MiB", size, lambda: hash_file(path, algorithm, chunk_size=chunk_size))
+        timed(f"{algorithm} mmap", size, lambda: hash_file(path, algorithm, use_mmap=True))
+        timed(f"{algorithm} tree {args.leaf_mb} MiB leaves, {args.workers or os.cpu_count()} threads", size,
+              lambda: tree_hash(path, algorithm, leaf_size=args.leaf_mb * 1024 * 1024, workers=args.workers))
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--file", type=str, default=None, help="Existing file to hash instead of a synthetic one.")
+    parser.add_argument("--size_gb", type=float, default=2, help="Size of the synthetic file in GiB.")
+    parser.add_argument("--algorithms", type=str, nargs="+", default=None, help="Algorithms to compare, all installed ones by default.")
+    parser.add_argument("--chunk_mb", type=float, nargs="+", default=[0.0625, 1, 8, 64], help="Read buffer sizes in MiB.")
+    parser.add_argument("--leaf_mb", type=int, default=64, help="Leaf size of tree mode in MiB.")
+    parser.add_argument("--workers", type=int, default=None, help="Threads used by tree mode.")
+
+    args = parser.parse_args()
+
+    main(args)
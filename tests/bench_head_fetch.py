@@ -0,0 +1,56 @@
+import os
+import sys
+import argparse
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.fetch import fetch_batch
+
+"""
+Compare a sequential HEAD loop against the concurrent fetch_batch() engine
+for a cold catalog build. S3 is replaced by a stub whose head_object sleeps
+for a fixed round trip latency, so the numbers isolate the fan-out strategy.
+"""
+
+class LatencyStubClient:
+    """Stands in for a boto3 client: head_object only waits, then returns metadata"""
+    def __init__(self, latency):
+        self.latency = latency
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def head_object(self, Bucket, Key):
+        time.sleep(self.latency)
+        with self._lock:
+            self.calls += 1
+        return {'Metadata': {'crc32_hash': f"{hash(Key) & 0xffffffff:08x}"}}
+
+def main(args):
+    print(f"latency {args.latency_ms} ms per HEAD, {args.workers} workers")
+    print(f"{'objects':>8} {'sequential s':>13} {'concurrent s':>13} {'speedup':>8}")
+    for n in args.objects:
+        keys = [f"sub-{i:05d}_bench.hdf5" for i in range(n)]
+        client = LatencyStubClient(args.latency_ms / 1000)
+        fetch = lambda key: client.head_object(Bucket="bench", Key=key)['Metadata']
+
+        start = time.perf_counter()
+        fetch_batch(fetch, keys, max_workers=1)
+        sequential = time.perf_counter() - start
+
+        start = time.perf_counter()
+        result = fetch_batch(fetch, keys, max_workers=args.workers)
+        concurrent = time.perf_counter() - start
+        assert len(result) == n
+
+        print(f"{n:>8} {sequential:>13.2f} {concurrent:>13.2f} {sequential / concurrent:>7.1f}x")
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--objects", type=int, nargs="+", default=[100, 1000, 10000], help="Bucket sizes to benchmark.")
+    parser.add_argument("--latency_ms", type=float, default=2, help="Simulated round trip latency of one HEAD.")
+    parser.add_argument("--workers", type=int, default=16, help="Parallelism cap of the concurrent engine.")
+
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,53 @@
+from dotenv import load_dotenv
+load_dotenv()
+import os
+import sys
+import argparse
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from s3_standin import BENCH_BUCKET, mock_s3
+
+"""
+Time POST /api/s3/download/batch for growing selections, cold (every key
+signed) and warm (every key served from the signature cache), against the
+old one-request-per-file /api/s3/download/<key> route.
+
+Signing is local CPU work, so no S3 stand-in latency is needed.
+"""
+
+def main(args):
+    os.environ["S3_BUCKET"] = BENCH_BUCKET
+    with mock_s3():
+        import app as webapp
+        client = webapp.app.test_client()
+
+        print(f"{'keys':>6}{'per-file ms':>14}{'batch cold ms':>15}{'batch warm ms':>15}{'warm us/key':>13}")
+        for n in args.keys:
+            keys = [f"bench-{n}/sub-{i:05d}_crc32-{i:08x}.hdf5" for i in range(n)]
+
+            start = time.perf_counter()
+            for key in keys[:args.per_file_sample]:
+                client.get(f"/api/s3/download/{key}")
+            per_file = (time.perf_counter() - start) * n / min(n, args.per_file_sample)
+
+            webapp.presign_cache._urls.clear()
+            start = time.perf_counter()
+            client.post("/api/s3/download/batch", json={"keys": keys})
+            cold = time.perf_counter() - start
+
+            start = time.perf_counter()
+            client.post("/api/s3/download/batch", json={"keys": keys})
+            warm = time.perf_counter() - start
+
+            print(f"{n:>6}{per_file * 1000:>14.1f}{cold * 1000:>15.1f}{warm * 1000:>15.1f}{warm / n * 1e6:>13.1f}")
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--keys", type=int, nargs="+", default=[10, 100, 1000, 5000], help="Selection sizes.")
+    parser.add_argument("--per_file_sample", type=int, default=200, help="Per-file requests timed, extrapolated to the selection size.")
+
+    args = parser.parse_args()
+
+    main(args)
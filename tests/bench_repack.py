@@ -0,0 +1,141 @@
+import os
+import sys
+import argparse
+import tempfile
+import time
+
+import boto3
+import h5py
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from create_hdf5 import write_hdf5
+from s3_standin import BENCH_BUCKET, mock_s3, inject_latency
+from utils.repack import repack_hdf5, read_consolidated_metadata, read_stacked_row, STACKED_DATA, STACKED_INDEX
+from utils.s3file import S3RangeFile
+
+"""
+Repack synthetic files of random betas (tests/create_hdf5.py) with each
+compression and compare them with the originals: file size, and the time,
+range requests and bytes fetched to
+  index  - list every beta with its stimulus filename
+  rows   - read --rows random betas by name
+  voxels - read --voxels voxels of every beta
+from a local file and from S3 through S3RangeFile (moto, with optional
+per-request latency).
+"""
+
+def read_index(f, repacked):
+    if repacked:
+        read_consolidated_metadata(f)
+        return len(f['betas'][STACKED_INDEX].fields(['name', 'presented_stimulus_filename'])[:])
+    return len([f['betas'][name].attrs['presented_stimulus_filename'] for name in f['betas']])
+
+def read_rows(f, repacked, names):
+    if repacked:
+        metadata = read_consolidated_metadata(f)
+        return sum(read_stacked_row(f, '/betas', name, metadata).nbytes for name in names)
+    return sum(f['betas'][name][()].nbytes for name in names)
+
+def read_voxels(f, repacked, start, stop):
+    if repacked:
+        return f['betas'][STACKED_DATA][:, start:stop].nbytes
+    return sum(f['betas'][name][start:stop].nbytes for name in f['betas'])
+
+def time_reads(open_file, repacked, args, rng):
+    """{scenario: (seconds, requests, bytes fetched)}, the counts are None for local files"""
+    names = [f"beta_{i:04d}" for i in rng.choice(args.betas, size=min(args.rows, args.betas), replace=False)]
+    start_voxel = int(rng.integers(0, args.n_values - args.voxels))
+    scenarios = {
+        'index': lambda f: read_index(f, repacked),
+        'rows': lambda f: read_rows(f, repacked, names),
+        'voxels': lambda f: read_voxels(f, repacked, start_voxel, start_voxel + args.voxels),
+    }
+    results = {}
+    for scenario, read in scenarios.items():
+        fileobj = open_file()
+        start = time.perf_counter()
+        with h5py.File(fileobj, 'r') as f:
+            read(f)
+        seconds = time.perf_counter() - start
+        if isinstance(fileobj, S3RangeFile):
+            results[scenario] = (seconds, fileobj.requests, fileobj.bytes_fetched)
+        else:
+            results[scenario] = (seconds, None, None)
+    return results
+
+def add_reads(totals, results):
+    for scenario, result in results.items():
+        previous = totals.get(scenario, (0, 0, 0))
+        totals[scenario] = tuple(None if value is None else value + previous[k] for k, value in enumerate(result))
+
+def print_reads(label, original, repacked):
+    for scenario in original:
+        seconds, requests, fetched = original[scenario]
+        r_seconds, r_requests, r_fetched = repacked[scenario]
+        line = f"  {label:<6}{scenario:<8}{seconds * 1000:>10.1f} ms ->{r_seconds * 1000:>9.1f} ms  x{seconds / r_seconds:>5.1f}"
+        if requests is not None:
+            line += f"   {requests:>5} -> {r_requests:<5} requests  {fetched / 1e6:>7.2f} -> {r_fetched / 1e6:.2f} MB"
+        print(line)
+
+def main(args):
+    rng = np.random.default_rng(args.seed)
+    with tempfile.TemporaryDirectory() as tmp, mock_s3():
+        s3_client = boto3.client('s3', region_name='us-east-1')
+        s3_client.create_bucket(Bucket=BENCH_BUCKET)
+        if args.latency_ms:
+            inject_latency(s3_client, args.latency_ms / 1000)
+
+        originals = []
+        for i in range(args.files):
+            path = os.path.join(tmp, f"sub-{i + 1:02d}_hw.hdf5")
+            write_hdf5(path, f"sub-{i + 1:02d}_hw", "helloworld", args.n_values, args.betas, rng)
+            s3_client.upload_file(path, BENCH_BUCKET, os.path.basename(path))
+            originals.append(path)
+        original_size = sum(os.path.getsize(path) for path in originals)
+        print(f"{args.files} files of {args.betas} betas x {args.n_values} values, {original_size / 1e6:.1f} MB"
+              f"{f', {args.latency_ms} ms per S3 request' if args.latency_ms else ''}")
+
+        for compression in args.compressions:
+            repacked_size = repack_seconds = 0
+            reads = {}
+            for path in originals:
+                repacked = path.replace('.hdf5', f'.{compression}.hdf5')
+                report = repack_hdf5(path, repacked, compression=compression, level=args.level,
+                                     chunk_rows=args.chunk_rows)
+                repack_seconds += report['seconds']
+                repacked_size += os.path.getsize(repacked)
+                s3_client.upload_file(repacked, BENCH_BUCKET, os.path.basename(repacked))
+                openers = {
+                    'local': lambda p: (lambda: open(p, 'rb')),
+                    's3': lambda p: (lambda: S3RangeFile(s3_client, BENCH_BUCKET, os.path.basename(p), block_size=args.block_size)),
+                }
+                for label, opener in openers.items():
+                    # Same betas and voxels for both layouts
+                    seed = int(rng.integers(1 << 31))
+                    before, after = reads.setdefault(label, ({}, {}))
+                    add_reads(before, time_reads(opener(path), False, args, np.random.default_rng(seed)))
+                    add_reads(after, time_reads(opener(repacked), True, args, np.random.default_rng(seed)))
+            print(f"\n{compression}: {original_size / 1e6:.1f} -> {repacked_size / 1e6:.1f} MB "
+                  f"({1 - repacked_size / original_size:.1%} smaller), repacked in {repack_seconds:.2f} s")
+            for label, (before, after) in reads.items():
+                print_reads(label, before, after)
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=3, help="Number of synthetic files.")
+    parser.add_argument("--betas", type=int, default=200, help="Betas per file.")
+    parser.add_argument("--n_values", type=int, default=20000, help="Values per beta.")
+    parser.add_argument("--compressions", nargs="+", default=["gzip", "lzf", "none"], help="Filters to compare.")
+    parser.add_argument("--level", type=int, default=4, help="gzip level.")
+    parser.add_argument("--chunk_rows", type=int, default=1, help="Rows per chunk of the stacked arrays.")
+    parser.add_argument("--rows", type=int, default=20, help="Betas read in the rows scenario.")
+    parser.add_argument("--voxels", type=int, default=100, help="Voxels read in the voxels scenario.")
+    parser.add_argument("--block_size", type=int, default=256 * 1024, help="S3RangeFile block size.")
+    parser.add_argument("--latency_ms", type=float, default=0, help="Added latency per S3 request.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the random betas.")
+
+    args = parser.parse_args()
+
+    main(args)
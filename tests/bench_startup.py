@@ -0,0 +1,150 @@
+import os
+import sys
+import argparse
+import json
+import multiprocessing
+import statistics
+import subprocess
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+"""
+Import time of the app and latency of the first requests a new gunicorn
+worker serves.
+
+A moto server behind a proxy adding --latency_ms to every S3 call is seeded
+with --objects synthetic HDF5 files, a catalog snapshot of them is written,
+and --changed objects are added after it, like uploads since the last
+snapshot. Then, --runs times, a fresh interpreter imports the app the way
+the gunicorn master does with preload_app, and forks a worker from it. The
+worker runs the warm-up of gunicorn.conf.py (without it with --no_warm_up)
+and sends its first requests through the test client:
+
+    files    GET /api/s3/files?limit=100
+    inspect  GET /api/s3/inspect/<key>
+    again    GET /api/s3/files?limit=100 once more, the warm latency
+
+Reported are the median import time, the heavy modules the import loaded,
+the warm-up time and the latency of each request. Compare with --no_warm_up,
+or against an older checkout, to see what the warm-up and lazy imports buy.
+
+python tests/bench_startup.py
+python tests/bench_startup.py --no_warm_up
+
+Requires `pip install "moto[server]"`.
+"""
+
+# Imported only by the routes that need them
+HEAVY_MODULES = ["boto3", "h5py", "numpy", "humanize"]
+REQUESTS = [("files", "/api/s3/files?limit=100"), ("inspect", "/api/s3/inspect/{key}"),
+            ("again", "/api/s3/files?limit=100")]
+
+def worker(key, warm_up):
+    """Run in the forked worker: the warm-up, then the first requests, returning their seconds"""
+    import app
+    timings = {}
+    if warm_up and hasattr(app, "warm_up_worker"):
+        start = time.perf_counter()
+        app.warm_up_worker()
+        timings["warm_up"] = time.perf_counter() - start
+    client = app.app.test_client()
+    for name, url in REQUESTS:
+        start = time.perf_counter()
+        status = client.get(url.format(key=key)).status_code
+        timings[name] = time.perf_counter() - start
+        if status != 200:
+            raise RuntimeError(f"{url} returned {status}")
+    return timings
+
+def run_child(args):
+    """One master: import the app, fork a worker and print the timings as JSON"""
+    start = time.perf_counter()
+    import app  # noqa: F401
+    result = {"import": time.perf_counter() - start,
+              "loaded": [name for name in HEAVY_MODULES if name in sys.modules]}
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        try:
+            data = json.dumps(worker(args.key, not args.no_warm_up))
+        except Exception as e:
+            data = json.dumps({"error": str(e)})
+        os.write(write_fd, data.encode())
+        os._exit(0)
+    os.close(write_fd)
+    with os.fdopen(read_fd) as f:
+        result.update(json.loads(f.read()))
+    os.waitpid(pid, 0)
+    print(json.dumps(result))
+
+def main(args):
+    # Imported here, the --child processes measure an interpreter without them
+    import boto3
+    from s3_standin import BENCH_BUCKET, fake_metadata
+    from create_hdf5 import group_names
+    from bench_suite import object_key, run_standin
+
+    os.environ.update(AWS_ACCESS_KEY_ID="testing", AWS_SECRET_ACCESS_KEY="testing")
+    urls = multiprocessing.Queue()
+    standin = multiprocessing.Process(target=run_standin, args=(args.latency_ms / 1000, args.objects, args.n_values, urls),
+                                      daemon=True)
+    standin.start()
+    proxy_url = urls.get(timeout=600)
+    key = object_key(0, group_names(args.objects, 10)[0])
+    with tempfile.TemporaryDirectory() as workdir:
+        env = dict(os.environ,
+                   S3_ENDPOINT_URL=proxy_url,
+                   S3_BUCKET=BENCH_BUCKET,
+                   METRICS_DIR=os.path.join(workdir, "metrics"),
+                   SNAPSHOT_DIR=os.path.join(workdir, "snapshots"),
+                   STATE_DB_PATH=os.path.join(workdir, "state.sqlite3"))
+        subprocess.run([sys.executable, "-c", "import app; app.run_snapshot_job(None, None)"],
+                       cwd=workdir, env=dict(env, PYTHONPATH=REPO_ROOT), check=True, stdout=subprocess.DEVNULL)
+        # Uploads since the snapshot, every new worker has to HEAD them
+        client = boto3.client("s3", region_name="us-east-1", endpoint_url=proxy_url)
+        for i in range(args.changed):
+            client.put_object(Bucket=BENCH_BUCKET, Key=f"sub-{i:04d}_changed_crc32-{i:08x}.hdf5",
+                              Body=b"\x89HDF\r\n\x1a\n", Metadata=fake_metadata(args.objects + i))
+
+        runs = []
+        for _ in range(args.runs):
+            command = [sys.executable, os.path.abspath(__file__), "--child", "--key", key]
+            if args.no_warm_up:
+                command.append("--no_warm_up")
+            output = subprocess.run(command, cwd=workdir, env=env, check=True, capture_output=True, text=True).stdout
+            runs.append(json.loads(output.strip().splitlines()[-1]))
+    standin.terminate()
+
+    errors = [run["error"] for run in runs if "error" in run]
+    if errors:
+        sys.exit(f"Worker failed: {errors[0]}")
+    print(f"{args.objects} objects in the snapshot, {args.changed} added since, {args.latency_ms} ms S3 latency, "
+          f"{args.runs} runs, {'no warm-up' if args.no_warm_up else 'warm-up'}")
+    print(f"heavy modules loaded by the import: {', '.join(runs[0]['loaded']) or 'none'}")
+    for name in ["import", "warm_up"] + [name for name, _ in REQUESTS]:
+        values = [run[name] for run in runs if name in run]
+        if values:
+            print(f"  {name:<8} median {statistics.median(values) * 1000:>8.1f} ms   max {max(values) * 1000:>8.1f} ms")
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--objects", type=int, default=500, help="Synthetic HDF5 objects seeded into the bucket.")
+    parser.add_argument("--n_values", type=int, default=1000, help="Length of each dataset in the synthetic files.")
+    parser.add_argument("--changed", type=int, default=50, help="Objects added after the snapshot was written.")
+    parser.add_argument("--latency_ms", type=float, default=20, help="Latency added to every S3 call.")
+    parser.add_argument("--runs", type=int, default=5, help="Masters started, one worker forked from each.")
+    parser.add_argument("--no_warm_up", action="store_true", help="Skip the worker warm-up.")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--key", type=str, default=None, help=argparse.SUPPRESS)
+
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args)
+    else:
+        main(args)
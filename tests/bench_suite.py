@@ -0,0 +1,299 @@
+from dotenv import load_dotenv
+load_dotenv()
+import os
+import sys
+import argparse
+import json
+import multiprocessing
+import random
+import re
+import subprocess
+import tempfile
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from s3_standin import BENCH_BUCKET, fake_metadata, free_port, start_latency_proxy, start_moto_server
+from create_hdf5 import dataset_names, group_names, write_hdf5
+
+"""
+Benchmark the app end to end against a local S3 stand-in and compare runs.
+
+A moto server, behind a proxy adding --latency_ms to every S3 call, is
+seeded with --objects synthetic HDF5 files from create_hdf5.py. The app runs
+under gunicorn with its own state database, and each scenario sends
+--requests requests from --clients concurrent clients:
+
+    files          GET /api/s3/files?limit=100
+    presign        GET /api/s3/download/<key> of a random key
+    presign_batch  POST /api/s3/download/batch of 100 random keys
+    inspect        GET /api/s3/inspect/<key> of a random key
+    upload         POST /api/s3/upload of a new file, timed until its job finishes
+
+Each scenario reports throughput, p50/p95/p99 latency and the S3 calls it
+caused by operation, read from the app's /metrics. Save a run with --save
+and check a later one against it with --compare. Metrics are flushed on every
+request (METRICS_FLUSH_INTERVAL=0), so numbers are comparable between runs
+of this suite, not with production.
+
+python tests/bench_suite.py --save bench_baseline.json
+python tests/bench_suite.py --compare bench_baseline.json
+
+Requires `pip install "moto[server]" gunicorn`.
+"""
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCENARIOS = ["files", "presign", "presign_batch", "inspect", "upload"]
+
+def percentile(sorted_values, p):
+    return sorted_values[min(len(sorted_values) - 1, int(p / 100 * len(sorted_values)))]
+
+def object_key(i, group):
+    return f"{group}_crc32-{i:08x}.hdf5"
+
+def run_standin(latency, objects, n_values, urls):
+    """Seed the S3 stand-in with synthetic HDF5 files and serve it until terminated"""
+    moto_server, moto_url = start_moto_server()
+    proxy, proxy_url = start_latency_proxy(moto_url, latency)
+    client = boto3.client("s3", region_name="us-east-1", endpoint_url=moto_url)
+    client.create_bucket(Bucket=BENCH_BUCKET)
+    long_names = dataset_names(10)
+    with tempfile.TemporaryDirectory() as tmp:
+        for i, group in enumerate(group_names(objects, 10)):
+            path = os.path.join(tmp, f"{group}.hdf5")
+            write_hdf5(path, group, long_names[group.split("_")[1]], n_values)
+            metadata = dict(fake_metadata(i), dataset_name=long_names[group.split("_")[1]])
+            with open(path, "rb") as f:
+                client.put_object(Bucket=BENCH_BUCKET, Key=object_key(i, group), Body=f.read(), Metadata=metadata)
+            os.remove(path)
+    urls.put(proxy_url)
+    while True:
+        time.sleep(60)
+
+def start_app(args, endpoint_url, workdir):
+    port = free_port()
+    env = dict(os.environ,
+               AWS_ACCESS_KEY_ID="testing",
+               AWS_SECRET_ACCESS_KEY="testing",
+               GUNICORN_BIND=f"127.0.0.1:{port}",
+               GUNICORN_WORKERS=str(args.workers),
+               GUNICORN_THREADS=str(args.threads),
+               JOB_WORKERS=str(args.job_workers),
+               S3_ENDPOINT_URL=endpoint_url,
+               S3_BUCKET=BENCH_BUCKET,
+               CATALOG_TTL=str(args.catalog_ttl),
+               METRICS_FLUSH_INTERVAL="0",
+               METRICS_DIR=os.path.join(workdir, "metrics"),
+               SNAPSHOT_DIR=os.path.join(workdir, "snapshots"),
+               STATE_DB_PATH=os.path.join(workdir, "state.sqlite3"))
+    process = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "--config", os.path.join(REPO_ROOT, "gunicorn.conf.py"),
+         "--pythonpath", REPO_ROOT, "--timeout", "120", "wsgi:app"],
+        cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base_url = f"http://127.0.0.1:{port}"
+    for _ in range(300):
+        try:
+            urllib.request.urlopen(f"{base_url}/api/s3/files?limit=1", timeout=60).read()
+            return process, base_url
+        except Exception:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError("gunicorn did not start")
+
+def s3_calls(base_url):
+    """S3 calls so far by operation, summed over all workers from /metrics"""
+    with urllib.request.urlopen(f"{base_url}/metrics", timeout=60) as response:
+        text = response.read().decode()
+    calls = {}
+    for operation, value in re.findall(r'^mosaic_s3_calls_total\{operation="([^"]+)",status="[^"]+"\} (\S+)$', text, re.M):
+        calls[operation] = calls.get(operation, 0) + int(float(value))
+    return calls
+
+def request(method, url, body=None, headers=None):
+    req = urllib.request.Request(url, data=body, method=method, headers=headers or {})
+    try:
+        with urllib.request.urlopen(req, timeout=300) as response:
+            return response.status, response.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.read()
+
+def multipart_body(path):
+    boundary = uuid.uuid4().hex
+    with open(path, "rb") as f:
+        data = f.read()
+    body = (f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"{os.path.basename(path)}\"\r\n"
+            f"Content-Type: application/x-hdf\r\n\r\n").encode() + data + f"\r\n--{boundary}--\r\n".encode()
+    return body, {"Content-Type": f"multipart/form-data; boundary={boundary}"}
+
+def upload_and_wait(base_url, path):
+    body, headers = multipart_body(path)
+    status, data = request("POST", f"{base_url}/api/s3/upload", body, headers)
+    while status == 503:
+        # More uploads than UPLOAD_MAX_CONCURRENT, the app asks to come back later
+        time.sleep(0.5)
+        status, data = request("POST", f"{base_url}/api/s3/upload", body, headers)
+    if status != 202:
+        return False
+    job_url = f"{base_url}/{json.loads(data)['statusUrl'].lstrip('/')}"
+    while True:
+        status, data = request("GET", job_url)
+        job = json.loads(data)
+        if job["status"] in ("succeeded", "failed"):
+            return job["status"] == "succeeded"
+        time.sleep(0.05)
+
+def make_requests(name, base_url, keys, args, workdir):
+    """Return the callables of one scenario, each sending one request and returning True on success"""
+    rng = random.Random(0)
+    if name == "files":
+        return [lambda: request("GET", f"{base_url}/api/s3/files?limit=100")[0] == 200] * args.requests
+    if name == "presign":
+        return [lambda key=rng.choice(keys): request("GET", f"{base_url}/api/s3/download/{key}")[0] == 200
+                for _ in range(args.requests)]
+    if name == "presign_batch":
+        return [lambda batch=rng.sample(keys, min(100, len(keys))): request(
+                    "POST", f"{base_url}/api/s3/download/batch", json.dumps({"keys": batch}).encode(),
+                    {"Content-Type": "application/json"})[0] == 200
+                for _ in range(args.requests)]
+    if name == "inspect":
+        return [lambda key=rng.choice(keys): request("GET", f"{base_url}/api/s3/inspect/{key}")[0] == 200
+                for _ in range(args.requests)]
+    if name == "upload":
+        # Every upload needs new content, or it is rejected as a duplicate
+        upload_dir = os.path.join(workdir, f"upload-files-{uuid.uuid4().hex[:8]}")
+        os.makedirs(upload_dir)
+        paths = []
+        for i in range(args.upload_requests):
+            group = f"sub-up{uuid.uuid4().hex[:8]}_hw"
+            path = os.path.join(upload_dir, f"{group}.hdf5")
+            write_hdf5(path, group, "helloworld", args.n_values)
+            paths.append(path)
+        return [lambda path=path: upload_and_wait(base_url, path) for path in paths]
+    raise ValueError(f"Unknown scenario {name}")
+
+def timed(call):
+    start = time.perf_counter()
+    try:
+        ok = call()
+    except Exception:
+        ok = False
+    return time.perf_counter() - start, ok
+
+def run_scenario(name, base_url, keys, args, workdir):
+    calls = make_requests(name, base_url, keys, args, workdir)
+    before = s3_calls(base_url)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.clients) as executor:
+        results = list(executor.map(timed, calls))
+    seconds = time.perf_counter() - start
+    # Job workers flush their metrics on their next poll
+    time.sleep(1.5 if name == "upload" else 0)
+    after = s3_calls(base_url)
+    latencies = sorted(latency for latency, _ in results)
+    operations = {op: after.get(op, 0) - before.get(op, 0) for op in after if after.get(op, 0) > before.get(op, 0)}
+    return {
+        "requests": len(results),
+        "errors": sum(1 for _, ok in results if not ok),
+        "seconds": round(seconds, 3),
+        "throughput": round(len(results) / seconds, 2),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "s3_calls": operations,
+        "s3_calls_per_request": round(sum(operations.values()) / len(results), 3),
+    }
+
+def print_results(results):
+    print(f"{'scenario':<15}{'requests':>9}{'errors':>8}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'S3/req':>8}  S3 calls")
+    for name, r in results["scenarios"].items():
+        calls = ", ".join(f"{op} {n}" for op, n in sorted(r["s3_calls"].items()))
+        print(f"{name:<15}{r['requests']:>9}{r['errors']:>8}{r['throughput']:>9.1f}{r['p50_ms']:>9.1f}{r['p95_ms']:>9.1f}"
+              f"{r['p99_ms']:>9.1f}{r['s3_calls_per_request']:>8.2f}  {calls}")
+
+def compare(results, baseline, tolerance):
+    """Print the change of each metric against a baseline run, return the regressions"""
+    regressions = []
+    print(f"\nAgainst {baseline['config'].get('saved_at', 'the baseline')} (tolerance {tolerance:.0%}):")
+    print(f"{'scenario':<15}{'req/s':>10}{'p50':>10}{'p95':>10}{'p99':>10}{'S3/req':>10}")
+    for name, r in results["scenarios"].items():
+        base = baseline["scenarios"].get(name)
+        if base is None:
+            print(f"{name:<15}  not in baseline")
+            continue
+        cells = []
+        for metric, higher_is_worse in (("throughput", False), ("p50_ms", True), ("p95_ms", True),
+                                        ("p99_ms", True), ("s3_calls_per_request", True)):
+            change = (r[metric] - base[metric]) / base[metric] if base[metric] else 0.0
+            worse = change > tolerance if higher_is_worse else change < -tolerance
+            if worse:
+                regressions.append(f"{name} {metric}: {base[metric]} -> {r[metric]}")
+            cells.append(f"{change:+.0%}{'!' if worse else ' '}")
+        print(f"{name:<15}" + "".join(f"{cell:>10}" for cell in cells))
+    return regressions
+
+def main(args):
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        # Same load as the baseline, or the comparison means nothing
+        for option in ("objects", "clients", "requests", "upload_requests", "workers", "threads", "latency_ms", "n_values"):
+            setattr(args, option, baseline["config"][option])
+
+    urls = multiprocessing.Queue()
+    standin = multiprocessing.Process(target=run_standin, args=(args.latency_ms / 1000, args.objects, args.n_values, urls),
+                                      daemon=True)
+    standin.start()
+    proxy_url = urls.get(timeout=600)
+    keys = [object_key(i, group) for i, group in enumerate(group_names(args.objects, 10))]
+
+    config = {option: getattr(args, option) for option in
+              ("objects", "clients", "requests", "upload_requests", "workers", "threads", "latency_ms", "n_values", "catalog_ttl")}
+    results = {"config": dict(config, saved_at=time.strftime("%Y-%m-%d %H:%M:%S")), "scenarios": {}}
+    print(f"{args.objects} objects, {args.latency_ms} ms S3 latency, {args.workers} workers x {args.threads} threads, "
+          f"{args.clients} clients")
+    with tempfile.TemporaryDirectory() as workdir:
+        process, base_url = start_app(args, proxy_url, workdir)
+        try:
+            for name in args.scenarios:
+                results["scenarios"][name] = run_scenario(name, base_url, keys, args, workdir)
+        finally:
+            process.terminate()
+            process.wait()
+    standin.terminate()
+
+    print_results(results)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nSaved to {args.save}")
+    if args.compare:
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print("\nRegressions:\n  " + "\n  ".join(regressions))
+            sys.exit(1)
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scenarios", type=str, nargs="+", default=SCENARIOS, choices=SCENARIOS, help="Scenarios to run.")
+    parser.add_argument("--objects", type=int, default=500, help="Synthetic HDF5 objects seeded into the bucket.")
+    parser.add_argument("--n_values", type=int, default=1000, help="Length of each dataset in the synthetic files.")
+    parser.add_argument("--clients", type=int, default=20, help="Concurrent clients.")
+    parser.add_argument("--requests", type=int, default=500, help="Requests per scenario.")
+    parser.add_argument("--upload_requests", type=int, default=20, help="Requests of the upload scenario.")
+    parser.add_argument("--workers", type=int, default=2, help="gunicorn worker processes.")
+    parser.add_argument("--threads", type=int, default=8, help="Threads per gunicorn worker.")
+    parser.add_argument("--job_workers", type=int, default=1, help="Upload job worker processes.")
+    parser.add_argument("--latency_ms", type=float, default=20, help="Latency added to every S3 call.")
+    parser.add_argument("--catalog_ttl", type=float, default=60, help="CATALOG_TTL of the app under test.")
+    parser.add_argument("--save", type=str, default=None, help="Write the results to this JSON file, e.g. as a baseline.")
+    parser.add_argument("--compare", type=str, default=None, help="Baseline JSON file to compare against, runs with its settings.")
+    parser.add_argument("--tolerance", type=float, default=0.20, help="Relative change counted as a regression, runs on a busy machine vary by 10-20%%.")
+
+    args = parser.parse_args()
+
+    main(args)
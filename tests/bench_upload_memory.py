@@ -0,0 +1,187 @@
+import os
+import sys
+import argparse
+import http.client
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+import boto3
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from s3_standin import BENCH_BUCKET, start_moto_server
+from bench_suite import start_app
+
+"""
+Peak memory and disk use of the app while it receives concurrent uploads.
+
+The app runs under gunicorn against a local moto server. For each size in
+--sizes_mb, --clients clients send --uploads uploads of that size to
+/api/s3/upload, as multipart/form-data or with --raw as the raw body, and
+retry after a 503. The body is generated as it is sent, so the clients hold
+one chunk at a time. A sampler reads the RSS of the gunicorn master and all
+its children from /proc, and the bytes under the app's working and temp
+directories, every --interval seconds. Peak RSS and disk use should not grow
+with the upload size; RSS grows with --max_concurrent by about
+(INGEST_CONCURRENCY + 1) * INGEST_PART_SIZE per upload.
+
+python tests/bench_upload_memory.py --sizes_mb 32 128 512
+
+Linux only (/proc). Requires `pip install "moto[server]" gunicorn`.
+"""
+
+CHUNK_SIZE = 1024 * 1024
+
+def process_tree(pid):
+    """pid and the pids of all its descendants"""
+    pids = [pid]
+    for current in pids:
+        try:
+            for task in os.listdir(f"/proc/{current}/task"):
+                with open(f"/proc/{current}/task/{task}/children") as f:
+                    pids.extend(int(child) for child in f.read().split())
+        except OSError:
+            pass
+    return pids
+
+def rss_bytes(pid):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+def disk_bytes(directory):
+    total = 0
+    for root, _, files in os.walk(directory):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+class Sampler(threading.Thread):
+    """Tracks the peak RSS of a process tree and the peak bytes under some directories"""
+
+    def __init__(self, pid, directories, interval):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.directories = directories
+        self.interval = interval
+        self.peak_rss = self.peak_process_rss = self.peak_disk = 0
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            rss = [rss_bytes(pid) for pid in process_tree(self.pid)]
+            self.peak_rss = max(self.peak_rss, sum(rss))
+            self.peak_process_rss = max([self.peak_process_rss] + rss)
+            self.peak_disk = max(self.peak_disk, sum(disk_bytes(directory) for directory in self.directories))
+            self.stopped.wait(self.interval)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+def body_chunks(size, head=b"", tail=b""):
+    """Random upload body of `size` bytes between head and tail, one chunk at a time"""
+    yield head
+    sent = 0
+    while sent < size:
+        n = min(CHUNK_SIZE, size - sent)
+        yield os.urandom(n)
+        sent += n
+    yield tail
+
+def upload(base_url, size, raw):
+    """Send one upload, retrying after 503s; returns (HTTP status, 503s before it)"""
+    url = urlparse(base_url)
+    filename = f"sub-{uuid.uuid4().hex[:8]}_bench.hdf5"
+    if raw:
+        path = f"/api/s3/upload?filename={filename}"
+        head = tail = b""
+        content_type = "application/octet-stream"
+    else:
+        boundary = uuid.uuid4().hex
+        path = "/api/s3/upload"
+        head = (f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"{filename}\"\r\n"
+                f"Content-Type: application/x-hdf\r\n\r\n").encode()
+        tail = f"\r\n--{boundary}--\r\n".encode()
+        content_type = f"multipart/form-data; boundary={boundary}"
+    rejected = 0
+    while True:
+        connection = http.client.HTTPConnection(url.hostname, url.port, timeout=600)
+        try:
+            connection.putrequest("POST", path)
+            connection.putheader("Content-Type", content_type)
+            connection.putheader("Content-Length", str(len(head) + size + len(tail)))
+            connection.endheaders()
+            try:
+                for chunk in body_chunks(size, head, tail):
+                    connection.send(chunk)
+            except (BrokenPipeError, ConnectionResetError):
+                # Turned away before the body was read
+                pass
+            response = connection.getresponse()
+            response.read()
+            if response.status != 503:
+                return response.status, rejected
+            rejected += 1
+            time.sleep(min(float(response.getheader("Retry-After", 1)), 1))
+        finally:
+            connection.close()
+
+def main(args):
+    moto_server, moto_url = start_moto_server()
+    boto3.client("s3", region_name="us-east-1", endpoint_url=moto_url).create_bucket(Bucket=BENCH_BUCKET)
+    with tempfile.TemporaryDirectory() as workdir:
+        tmpdir = os.path.join(workdir, "tmp")
+        os.makedirs(tmpdir)
+        os.environ.update(UPLOAD_MAX_CONCURRENT=str(args.max_concurrent), TMPDIR=tmpdir)
+        process, base_url = start_app(args, moto_url, workdir)
+        try:
+            print(f"{args.clients} clients, {args.uploads} uploads per size, at most {args.max_concurrent} at once, "
+                  f"{'raw bodies' if args.raw else 'multipart/form-data'}")
+            print(f"{'size':>8} {'seconds':>8} {'MB/s':>7} {'202':>5} {'503':>5} {'peak RSS':>10} "
+                  f"{'peak process':>13} {'peak disk':>10}")
+            for size_mb in args.sizes_mb:
+                size = size_mb * 1024 * 1024
+                sampler = Sampler(process.pid, [os.path.join(workdir, "uploads"), tmpdir], args.interval)
+                sampler.start()
+                start = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=args.clients) as executor:
+                    results = list(executor.map(lambda _: upload(base_url, size, args.raw), range(args.uploads)))
+                seconds = time.perf_counter() - start
+                sampler.stop()
+                accepted = sum(status == 202 for status, _ in results)
+                print(f"{size_mb:>5} MB {seconds:>8.1f} {args.uploads * size / 1e6 / seconds:>7.1f} {accepted:>5} "
+                      f"{sum(rejected for _, rejected in results):>5} {sampler.peak_rss / 1e6:>7.0f} MB "
+                      f"{sampler.peak_process_rss / 1e6:>10.0f} MB {sampler.peak_disk / 1e6:>7.0f} MB")
+        finally:
+            process.terminate()
+            process.wait()
+            moto_server.stop()
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes_mb", type=int, nargs="+", default=[32, 128], help="Upload sizes to compare, in MiB.")
+    parser.add_argument("--uploads", type=int, default=8, help="Uploads per size.")
+    parser.add_argument("--clients", type=int, default=8, help="Concurrent clients.")
+    parser.add_argument("--max_concurrent", type=int, default=4, help="UPLOAD_MAX_CONCURRENT of the app under test.")
+    parser.add_argument("--raw", action="store_true", help="Send raw bodies instead of multipart/form-data.")
+    parser.add_argument("--interval", type=float, default=0.05, help="Seconds between samples.")
+    parser.add_argument("--workers", type=int, default=2, help="gunicorn worker processes.")
+    parser.add_argument("--threads", type=int, default=8, help="Threads per gunicorn worker.")
+    parser.add_argument("--job_workers", type=int, default=1, help="Upload job worker processes.")
+    parser.add_argument("--catalog_ttl", type=float, default=60, help="CATALOG_TTL of the app under test.")
+
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,133 @@
+from dotenv import load_dotenv
+load_dotenv()
+import os
+import sys
+import argparse
+import itertools
+import multiprocessing
+import subprocess
+import tempfile
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from s3_standin import BENCH_BUCKET, free_port, seed_bucket, start_latency_proxy, start_moto_server
+
+"""
+Compare gunicorn worker classes (sync vs gthread) under concurrent load.
+
+The app runs under gunicorn against a local moto S3 stand-in behind a proxy
+that adds --latency_ms to every S3 call, so requests spend their time waiting
+on S3 the way they do in production. Each worker class is loaded with 50 and
+200 concurrent clients by default, alternating between /api/s3/bucket/info
+(two S3 calls per request) and /api/s3/files (S3 listing and HEADs whenever
+the catalog TTL expires).
+
+Requires `pip install "moto[server]" gunicorn`.
+"""
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def timed_get(url):
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(url, timeout=120) as response:
+            response.read()
+            ok = response.status == 200
+    except Exception:
+        ok = False
+    return time.perf_counter() - start, ok
+
+def percentile(sorted_values, p):
+    return sorted_values[min(len(sorted_values) - 1, int(p / 100 * len(sorted_values)))]
+
+def start_gunicorn(worker_class, args, endpoint_url, workdir):
+    port = free_port()
+    env = dict(os.environ,
+               AWS_ACCESS_KEY_ID="testing",
+               AWS_SECRET_ACCESS_KEY="testing",
+               GUNICORN_BIND=f"127.0.0.1:{port}",
+               GUNICORN_WORKER_CLASS=worker_class,
+               GUNICORN_WORKERS=str(args.workers),
+               GUNICORN_THREADS=str(args.threads),
+               JOB_WORKERS="0",
+               S3_ENDPOINT_URL=endpoint_url,
+               S3_BUCKET=BENCH_BUCKET,
+               CATALOG_TTL=str(args.catalog_ttl),
+               STATE_DB_PATH=os.path.join(workdir, f"state-{worker_class}.sqlite3"))
+    process = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "--config", os.path.join(REPO_ROOT, "gunicorn.conf.py"),
+         "--pythonpath", REPO_ROOT, "--timeout", "120", "wsgi:app"],
+        cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base_url = f"http://127.0.0.1:{port}"
+    for _ in range(300):
+        try:
+            urllib.request.urlopen(f"{base_url}/api/s3/bucket/info", timeout=5).read()
+            return process, base_url
+        except Exception:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError(f"gunicorn ({worker_class}) did not start")
+
+def run_load(base_url, paths, clients, requests_per_client):
+    urls = itertools.cycle([base_url + path for path in paths])
+    batch = [next(urls) for _ in range(clients * requests_per_client)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as executor:
+        results = list(executor.map(timed_get, batch))
+    seconds = time.perf_counter() - start
+    latencies = sorted(latency for latency, _ in results)
+    errors = sum(1 for _, ok in results if not ok)
+    return len(batch) / seconds, percentile(latencies, 50), percentile(latencies, 99), errors
+
+def run_standin(latency, objects, urls):
+    """Serve the seeded S3 stand-in and latency proxy until terminated"""
+    moto_server, moto_url = start_moto_server()
+    proxy, proxy_url = start_latency_proxy(moto_url, latency)
+    seed_client = boto3.client("s3", region_name="us-east-1", endpoint_url=moto_url)
+    seed_bucket(seed_client, BENCH_BUCKET, objects)
+    urls.put(proxy_url)
+    while True:
+        time.sleep(60)
+
+def main(args):
+    # The stand-in gets its own process so it does not compete with the load
+    # generator's threads for the GIL
+    urls = multiprocessing.Queue()
+    standin = multiprocessing.Process(target=run_standin, args=(args.latency_ms / 1000, args.objects, urls), daemon=True)
+    standin.start()
+    proxy_url = urls.get(timeout=120)
+    paths = ["/api/s3/bucket/info", "/api/s3/files?limit=100"]
+
+    print(f"{args.objects} objects, {args.latency_ms} ms S3 latency, {args.workers} workers, {args.threads} threads for gthread")
+    print(f"{'worker class':<14}{'clients':>8}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'errors':>8}")
+    with tempfile.TemporaryDirectory() as workdir:
+        for worker_class in args.worker_classes:
+            process, base_url = start_gunicorn(worker_class, args, proxy_url, workdir)
+            try:
+                for clients in args.clients:
+                    throughput, p50, p99, errors = run_load(base_url, paths, clients, args.requests_per_client)
+                    print(f"{worker_class:<14}{clients:>8}{throughput:>10.1f}{p50 * 1000:>10.1f}{p99 * 1000:>10.1f}{errors:>8}")
+            finally:
+                process.terminate()
+                process.wait()
+
+    standin.terminate()
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--worker_classes", type=str, nargs="+", default=["sync", "gthread"], help="gunicorn worker classes to compare.")
+    parser.add_argument("--clients", type=int, nargs="+", default=[50, 200], help="Concurrent client counts.")
+    parser.add_argument("--requests_per_client", type=int, default=10, help="Requests each client sends.")
+    parser.add_argument("--workers", type=int, default=4, help="gunicorn worker processes.")
+    parser.add_argument("--threads", type=int, default=8, help="Threads per worker for gthread.")
+    parser.add_argument("--latency_ms", type=float, default=50, help="Latency added to every S3 call.")
+    parser.add_argument("--objects", type=int, default=500, help="Objects seeded into the bucket.")
+    parser.add_argument("--catalog_ttl", type=float, default=5, help="CATALOG_TTL of the app under test.")
+
+    args = parser.parse_args()
+
+    main(args)
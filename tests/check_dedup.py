@@ -0,0 +1,174 @@
+import os
+import sys
+import argparse
+import base64
+import subprocess
+import tempfile
+import zlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from s3_standin import mock_s3
+from create_hdf5 import write_hdf5
+
+"""
+Check the upload dedup against an in-process S3 stand-in (moto):
+
+1. a new file is accepted
+2. the same file uploaded again is rejected as a duplicate
+3. after its object is deleted from the bucket, the file is accepted again,
+   the stale rows of the hash index do not reject it
+4. a file matching an object from before content hashes, indexed by CRC32
+   only, is rejected
+5. a file of the same CRC32 and size as such an object, but other content,
+   is accepted
+6. a file matching such an object that is gone from the bucket is accepted
+7. a file whose earlier finalize died between claiming its hash and storing
+   the object is accepted when retried
+8. a file claimed under another name by a worker that has since died is
+   accepted
+9. the preflight of a file matching an object by CRC32 and size, but with
+   other content, calls it a probable duplicate and still issues a token,
+   and the upload with that token is accepted
+10. the preflight of a file that is in the bucket calls it a probable
+    duplicate too, and the upload with its token is rejected
+
+Uploads go through POST /api/s3/upload, some after POST
+/api/s3/upload/preflight, and their ingest jobs are run in this process. Prints each step and exits non-zero on a failed check.
+"""
+
+BUCKET = "mosaic-check"
+
+def preflight(client, path):
+    """Preflight a file like the upload page does, returning (HTTP status, response)"""
+    with open(path, "rb") as f:
+        data = f.read()
+    response = client.post("/api/s3/upload/preflight", json={
+        "filename": os.path.basename(path), "size": len(data), "crc32": f"{zlib.crc32(data):08x}",
+        "header": base64.b64encode(data[:64 * 1024]).decode()})
+    return response.status_code, response.get_json()
+
+def upload(client, webapp, path, token=None):
+    """Upload a file as a raw body and run its ingest job, returning (HTTP status, job result)"""
+    with open(path, "rb") as f:
+        response = client.post(f"/api/s3/upload?filename={os.path.basename(path)}", data=f.read(),
+                               content_type="application/octet-stream",
+                               headers={"X-Upload-Token": token} if token else {})
+    if response.status_code != 202:
+        return response.status_code, response.get_json()
+    # Run the queued jobs in order, e.g. the snapshot after an earlier upload, up to this upload's
+    job_id = response.get_json()["jobId"]
+    while True:
+        job = webapp.job_queue.claim_next()
+        result, status = webapp.JOB_HANDLERS[job["kind"]](job, lambda seen, total: None)
+        if job["id"] == job_id:
+            return status, result
+
+def legacy_object(webapp, path, key, body=None):
+    """Put an object like one uploaded before content hashes: indexed by the CRC32 of path only"""
+    with open(path, "rb") as f:
+        data = f.read()
+    crc32_hash = f"{zlib.crc32(data):08x}"
+    if body is not None:
+        webapp.s3_client.put_object(Bucket=BUCKET, Key=key, Body=body, Metadata={"crc32_hash": crc32_hash})
+    webapp.hash_index.add(webapp.hash_id("crc32", crc32_hash), key)
+
+def content_claim(webapp, path):
+    """(content hash ID, final key) an upload of path claims in the hash index"""
+    with open(path, "rb") as f:
+        data = f.read()
+    hasher = webapp.new_hasher(webapp.CONTENT_HASH_ALGORITHM)
+    hasher.update(data)
+    name, ext = os.path.splitext(os.path.basename(path))
+    return webapp.hash_id(webapp.CONTENT_HASH_ALGORITHM, hasher.hexdigest()), f"{name}_crc32-{zlib.crc32(data):08x}{ext}"
+
+def main(args):
+    failures = []
+    def check(name, actual, expected):
+        ok = actual == expected
+        print(f"{'ok' if ok else 'FAILED':<7}{name}: {actual}, expected {expected}")
+        if not ok:
+            failures.append(name)
+
+    with tempfile.TemporaryDirectory() as workdir, mock_s3():
+        os.environ.update(S3_BUCKET=BUCKET, STATE_DB_PATH=os.path.join(workdir, "state.sqlite3"),
+                          METRICS_DIR=os.path.join(workdir, "metrics"),
+                          SNAPSHOT_DIR=os.path.join(workdir, "snapshots"))
+        import app as webapp
+        from utils.db import connect
+        webapp.s3_client.create_bucket(Bucket=BUCKET)
+        client = webapp.app.test_client()
+
+        path = os.path.join(workdir, "sub-01_hw.hdf5")
+        write_hdf5(path, "sub-01_hw", "helloworld", n_values=args.n_values)
+
+        status, result = upload(client, webapp, path)
+        check("new file", status, 200)
+        key = result.get("filename")
+        status, _ = upload(client, webapp, path)
+        check("same file again", status, 409)
+
+        webapp.s3_client.delete_object(Bucket=BUCKET, Key=key)
+        status, result = upload(client, webapp, path)
+        check("same file after its object was deleted", status, 200)
+        if status == 200:
+            webapp.s3_client.head_object(Bucket=BUCKET, Key=result["filename"])
+
+        paths = []
+        for i in range(2, 5):
+            paths.append(os.path.join(workdir, f"sub-0{i}_hw.hdf5"))
+            write_hdf5(paths[-1], f"sub-0{i}_hw", "helloworld", n_values=args.n_values)
+        with open(paths[0], "rb") as f:
+            legacy_object(webapp, paths[0], "sub-02_legacy.hdf5", body=f.read())
+        status, _ = upload(client, webapp, paths[0])
+        check("same file as a legacy object", status, 409)
+
+        legacy_object(webapp, paths[1], "sub-03_legacy.hdf5", body=os.urandom(os.path.getsize(paths[1])))
+        status, _ = upload(client, webapp, paths[1])
+        check("same CRC32 and size as a legacy object, other content", status, 200)
+
+        legacy_object(webapp, paths[2], "sub-04_legacy.hdf5")
+        status, _ = upload(client, webapp, paths[2])
+        check("same file as a legacy object that is gone", status, 200)
+
+        for i in range(5, 7):
+            paths.append(os.path.join(workdir, f"sub-0{i}_hw.hdf5"))
+            write_hdf5(paths[-1], f"sub-0{i}_hw", "helloworld", n_values=args.n_values)
+        # The claim a finalize leaves behind when its worker dies before the object is stored
+        webapp.hash_index.claim(*content_claim(webapp, paths[3]))
+        status, _ = upload(client, webapp, paths[3])
+        check("retry after a finalize died holding the claim", status, 200)
+
+        content_hash, _ = content_claim(webapp, paths[4])
+        webapp.hash_index.claim(content_hash, "sub-06_other_name.hdf5")
+        dead = subprocess.Popen(["true"])
+        dead.wait()
+        connect(webapp.hash_index.path).execute("UPDATE content_hashes SET pid = ? WHERE hash = ?",
+                                                (dead.pid, content_hash))
+        status, _ = upload(client, webapp, paths[4])
+        check("same file as a claim of a dead worker", status, 200)
+
+        paths.append(os.path.join(workdir, "sub-07_hw.hdf5"))
+        write_hdf5(paths[-1], "sub-07_hw", "helloworld", n_values=args.n_values)
+        legacy_object(webapp, paths[5], "sub-07_legacy.hdf5", body=os.urandom(os.path.getsize(paths[5])))
+        status, answer = preflight(client, paths[5])
+        check("preflight, same CRC32 and size as an object, other content",
+              (status, answer.get("decision"), answer.get("existingKey")), (200, "duplicate", "sub-07_legacy.hdf5"))
+        status, _ = upload(client, webapp, paths[5], token=answer.get("uploadToken"))
+        check("upload after that preflight", status, 200)
+
+        status, answer = preflight(client, path)
+        check("preflight, same file as an object", (status, answer.get("decision")), (200, "duplicate"))
+        status, _ = upload(client, webapp, path, token=answer.get("uploadToken"))
+        check("upload after that preflight", status, 409)
+
+    if failures:
+        sys.exit(f"{len(failures)} check(s) failed")
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n_values", type=int, default=1000, help="Length of each dataset in the uploaded files.")
+
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,128 @@
+import os
+import sys
+import argparse
+import json
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import zlib
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DOWNLOADER = os.path.join(REPO_ROOT, "static", "mosaic_download.py")
+
+"""
+Exercise static/mosaic_download.py against a local Range-capable HTTP server
+standing in for CloudFront:
+
+1. a clean parallel download of several files
+2. a file whose first response is cut off halfway, resumed with a Range request
+3. a leftover .part file from an earlier run, resumed without refetching it
+4. a file whose bytes do not match its crc32_hash, reported as failed
+
+Prints what the server saw for each case and exits non-zero on a failed check.
+"""
+
+class RangeHandler(SimpleHTTPRequestHandler):
+    """Static files with single Range support; 'flaky' files drop the first response halfway"""
+    requests_seen = []
+    dropped = set()
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        path = self.translate_path(self.path)
+        name = os.path.basename(path)
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return
+        size = os.path.getsize(path)
+        start = 0
+        range_header = self.headers.get("Range")
+        RangeHandler.requests_seen.append((name, range_header))
+        if range_header:
+            start = int(range_header.split("=")[1].split("-")[0])
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{size - 1}/{size}")
+        else:
+            self.send_response(200)
+        self.send_header("Content-Length", str(size - start))
+        self.end_headers()
+        with open(path, "rb") as f:
+            f.seek(start)
+            if name.startswith("flaky") and name not in RangeHandler.dropped:
+                RangeHandler.dropped.add(name)
+                self.wfile.write(f.read((size - start) // 2))
+                self.close_connection = True
+                return
+            shutil.copyfileobj(f, self.wfile)
+
+def check(label, ok):
+    print(f"{'PASS' if ok else 'FAIL'}  {label}")
+    return ok
+
+def main(args):
+    served = tempfile.mkdtemp()
+    out = tempfile.mkdtemp()
+    names = [f"sub-{i:02d}_check.hdf5" for i in range(args.files)] + ["flaky_check.hdf5", "partial_check.hdf5", "corrupt_check.hdf5"]
+    crcs = {}
+    for name in names:
+        data = os.urandom(int(args.size_mb * 1024 * 1024))
+        with open(os.path.join(served, name), "wb") as f:
+            f.write(data)
+        crcs[name] = f"{zlib.crc32(data) & 0xffffffff:08x}"
+        if name == "partial_check.hdf5":
+            with open(os.path.join(out, name + ".part"), "wb") as f:
+                f.write(data[:len(data) // 3])
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), lambda *a, **kw: RangeHandler(*a, directory=served, **kw))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    manifest = {"files": [{
+        "key": name,
+        "size": os.path.getsize(os.path.join(served, name)),
+        "crc32_hash": "00000000" if name == "corrupt_check.hdf5" else crcs[name],
+        "url": f"{base_url}/{name}",
+    } for name in names], "missing": []}
+    manifest_path = os.path.join(out, "mosaic_manifest.json")
+    with open(manifest_path, "w") as f:
+        json.dump(manifest, f)
+
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, DOWNLOADER, manifest_path, "--out", out,
+                             "--parallel", str(args.parallel), "--retries", "1"], capture_output=True, text=True)
+    seconds = time.perf_counter() - start
+    server.shutdown()
+    print(result.stderr)
+    print(f"{sum(os.path.getsize(os.path.join(served, n)) for n in names) / 1e6:.0f} MB in {seconds:.2f} s")
+
+    ok = True
+    for name in names[:args.files]:
+        ok &= check(f"{name} downloaded intact", os.path.exists(os.path.join(out, name))
+                    and f"{zlib.crc32(open(os.path.join(out, name), 'rb').read()) & 0xffffffff:08x}" == crcs[name])
+    flaky = [r for n, r in RangeHandler.requests_seen if n == "flaky_check.hdf5"]
+    ok &= check("cut-off download resumed with a Range request", len(flaky) == 2 and flaky[0] is None and flaky[1] is not None)
+    ok &= check("cut-off download intact", os.path.exists(os.path.join(out, "flaky_check.hdf5")))
+    partial = [r for n, r in RangeHandler.requests_seen if n == "partial_check.hdf5"]
+    ok &= check("leftover .part resumed without refetching", len(partial) == 1 and partial[0] is not None
+                and os.path.exists(os.path.join(out, "partial_check.hdf5")))
+    ok &= check("hash mismatch reported", not os.path.exists(os.path.join(out, "corrupt_check.hdf5"))
+                and "corrupt_check.hdf5" in result.stderr and result.returncode == 1)
+
+    shutil.rmtree(served)
+    shutil.rmtree(out)
+    sys.exit(0 if ok else 1)
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=6, help="Number of clean files.")
+    parser.add_argument("--size_mb", type=float, default=8, help="Size of each file in MiB.")
+    parser.add_argument("--parallel", type=int, default=4, help="Parallel downloads.")
+
+    args = parser.parse_args()
+
+    main(args)
@@ -10,58 +10,96 @@ import pandas as pd
 from tqdm import tqdm
 
 """
-Generate a fake hdf5 file with all the required attributes to test uploads.
+Generate fake hdf5 files with all the required attributes to test uploads.
+With --count, generate that many subjects spread over --datasets datasets,
+e.g. to seed a local S3 stand-in for tests/bench_suite.py. With --betas and
+--random, write many betas of noise instead of one of zeros, e.g. for
+tests/bench_repack.py.
 """
 
-def main(args):
-    short_to_long = {"hw": "helloworld"}
-    visual_angles = {"hw": 5}
-    publications = {"hw": "https://www.nature.com/"}
-    githubs = {"hw": "github.com"}
-    groups = ["sub-01_hw"]
-    # Create a file
-    print("starting hdf5 file creation...")
-    for group in tqdm(groups, total=len(groups), desc="Adding 'sub-XX_DATASET' groups to hdf5 file"):
-        with h5py.File(os.path.join(args.save_root, "tests", f'{group}.hdf5'), 'w') as grp:
-            print(f"Working on group: {group}")
-            subject, fmri_dataset_name = group.split('_')
-            grp.attrs.create("visual_angle", visual_angles[fmri_dataset_name])
-            grp.attrs.create('sex', 'male')
-            grp.attrs.create('age', 30)
-            grp.attrs.create('publication_url', publications[fmri_dataset_name])
-            grp.attrs.create('github_url', githubs[fmri_dataset_name])
-            grp.attrs.create('owner_name', "John Smith")
-            grp.attrs.create('owner_email', "jsmith@email.com")
-            grp.attrs.create('dataset_name', short_to_long[fmri_dataset_name])
-            grp.attrs.create('sub-ID', subject)
-            grp.attrs.create('pipeline', "fMRIPrepv23.2.0")
-            grp.attrs.create('trial_format', "betas")
-                             
-            grp_noiseceiling = grp.create_group(f"noiseceilings", track_order=True)
-            n = '1'
-            phase = 'train'
-            dset = grp_noiseceiling.create_dataset('dummy', data=np.zeros((91282,)), track_order=True)
-            dset.attrs.create('nan_indices', np.zeros((1000,))) #arbitrary number of nans
-            dset.attrs.create('n', n)
-            dset.attrs.create('phase', phase)
-            
-            grp_betas = grp.create_group(f"betas", track_order=True)
-            phase = 'train'
-            stimulus_name = 'dummy_stimulus_name'
-            rep = '1'
+def dataset_names(n_datasets):
+    """Short -> long dataset names: hw/helloworld, then hw2/helloworld2, ..."""
+    return {("hw" if i == 0 else f"hw{i + 1}"): ("helloworld" if i == 0 else f"helloworld{i + 1}") for i in range(n_datasets)}
+
+def group_names(count, n_datasets):
+    short_names = list(dataset_names(n_datasets))
+    return [f"sub-{i:02d}_{short_names[(i - 1) % len(short_names)]}" for i in range(1, count + 1)]
+
+def beta_values(rng, n_values):
+    """Float32-precision noise stored as float64, like most GLM outputs, with some NaN voxels"""
+    values = rng.standard_normal(n_values).astype(np.float32).astype(np.float64)
+    nan_indices = np.sort(rng.choice(n_values, size=min(1000, n_values // 100), replace=False))
+    values[nan_indices] = np.nan
+    return values, nan_indices.astype(np.float64)
+
+def write_hdf5(path, group, long_name, n_values=91282, n_betas=1, rng=None):
+    """Write one fake 'sub-XX_DATASET' file to path
 
-            dset = grp_betas.create_dataset('dummy_betas', data=np.zeros((91282,)), track_order=True)
-            dset.attrs.create('nan_indices', np.zeros((1000,)))
+    Betas are zeros unless a numpy Generator is given for random values.
+    """
+    with h5py.File(path, 'w') as grp:
+        subject, fmri_dataset_name = group.split('_')
+        grp.attrs.create("visual_angle", 5)
+        grp.attrs.create('sex', 'male')
+        grp.attrs.create('age', 30)
+        grp.attrs.create('publication_url', "https://www.nature.com/")
+        grp.attrs.create('github_url', "github.com")
+        grp.attrs.create('owner_name', "John Smith")
+        grp.attrs.create('owner_email', "jsmith@email.com")
+        grp.attrs.create('dataset_name', long_name)
+        grp.attrs.create('sub-ID', subject)
+        grp.attrs.create('pipeline', "fMRIPrepv23.2.0")
+        grp.attrs.create('trial_format', "betas")
+
+        grp_noiseceiling = grp.create_group(f"noiseceilings", track_order=True)
+        n = '1'
+        phase = 'train'
+        dset = grp_noiseceiling.create_dataset('dummy', data=np.zeros((n_values,)), track_order=True)
+        dset.attrs.create('nan_indices', np.zeros((1000,))) #arbitrary number of nans
+        dset.attrs.create('n', n)
+        dset.attrs.create('phase', phase)
+
+        grp_betas = grp.create_group(f"betas", track_order=True)
+        phase = 'train'
+        stimulus_name = 'dummy_stimulus_name'
+        rep = '1'
+
+        for i in range(n_betas):
+            if rng is None:
+                values, nan_indices = np.zeros((n_values,)), np.zeros((1000,))
+            else:
+                values, nan_indices = beta_values(rng, n_values)
+            name = 'dummy_betas' if n_betas == 1 else f'beta_{i:04d}'
+            dset = grp_betas.create_dataset(name, data=values, track_order=True)
+            dset.attrs.create('nan_indices', nan_indices)
             dset.attrs.create('phase', phase)
             dset.attrs.create('repetition', rep)
-            dset.attrs.create('presented_stimulus_filename', stimulus_name)
-            dset.attrs.create('image_stimulus_filename', stimulus_name)
+            dset.attrs.create('presented_stimulus_filename', stimulus_name if n_betas == 1 else f'stimulus_{i:04d}.png')
+            dset.attrs.create('image_stimulus_filename', stimulus_name if n_betas == 1 else f'stimulus_{i:04d}.png')
+
+def main(args):
+    short_to_long = dataset_names(args.datasets)
+    groups = group_names(args.count, args.datasets)
+    out_dir = args.out_dir or os.path.join(args.save_root, "tests")
+    os.makedirs(out_dir, exist_ok=True)
+    rng = np.random.default_rng(args.seed) if args.random else None
+    # Create the files
+    print("starting hdf5 file creation...")
+    for group in tqdm(groups, total=len(groups), desc="Adding 'sub-XX_DATASET' groups to hdf5 file"):
+        write_hdf5(os.path.join(out_dir, f'{group}.hdf5'), group, short_to_long[group.split('_')[1]], args.n_values, args.betas, rng)
 
 if __name__=='__main__':
     save_root_default = os.path.join(os.getenv("PROJECT_ROOT", "/default/path/to/project"), "mosaic-website") #use default if DATASETS_ROOT env variable is not set.
 
     parser = argparse.ArgumentParser()
     parser.add_argument("--save_root", type=str, default=save_root_default, help="Root path to scratch datasets folder.")
+    parser.add_argument("--out_dir", type=str, default=None, help="Directory for the files, <save_root>/tests by default.")
+    parser.add_argument("--count", type=int, default=1, help="Number of subject files to generate.")
+    parser.add_argument("--datasets", type=int, default=1, help="Number of datasets the subjects are spread over.")
+    parser.add_argument("--n_values", type=int, default=91282, help="Length of each dataset in a file, sets the file size.")
+    parser.add_argument("--betas", type=int, default=1, help="Number of beta datasets per file.")
+    parser.add_argument("--random", action="store_true", help="Fill betas with random values instead of zeros.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the random values.")
 
     args = parser.parse_args()
     
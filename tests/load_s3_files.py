@@ -0,0 +1,78 @@
+from dotenv import load_dotenv
+load_dotenv()
+import argparse
+import json
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+"""
+Load test /api/s3/files on a running server and report latency percentiles
+together with the S3 connection counters of the gunicorn workers.
+
+Each worker keeps its own S3 connection pool, so /api/s3/pool/stats answers
+for whichever worker serves it. The script samples it repeatedly and keeps
+the latest snapshot per worker pid. Compare runs by new connections (TCP and
+TLS handshakes) per request and by p99, e.g. with S3_MAX_POOL_CONNECTIONS=1
+against the default. Run the server with a short CATALOG_TTL so the requests
+actually reach S3.
+
+python tests/load_s3_files.py --url http://127.0.0.1:5000 --clients 50 --requests 2000
+"""
+
+def get_json(url):
+    with urllib.request.urlopen(url, timeout=60) as response:
+        return json.loads(response.read())
+
+def pool_snapshot(base_url, samples):
+    by_pid = {}
+    for _ in range(samples):
+        stats = get_json(f"{base_url}/api/s3/pool/stats")
+        if stats['requests'] >= by_pid.get(stats['pid'], {}).get('requests', -1):
+            by_pid[stats['pid']] = stats
+    return by_pid
+
+def timed_get(url):
+    start = time.perf_counter()
+    with urllib.request.urlopen(url, timeout=60) as response:
+        response.read()
+        status = response.status
+    return time.perf_counter() - start, status
+
+def percentile(sorted_values, p):
+    return sorted_values[min(len(sorted_values) - 1, int(p / 100 * len(sorted_values)))]
+
+def main(args):
+    url = f"{args.url}/api/s3/files?limit={args.limit}"
+    before = pool_snapshot(args.url, args.stats_samples)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.clients) as executor:
+        results = list(executor.map(lambda _: timed_get(url), range(args.requests)))
+    seconds = time.perf_counter() - start
+
+    after = pool_snapshot(args.url, args.stats_samples)
+    latencies = sorted(latency for latency, _ in results)
+    errors = sum(1 for _, status in results if status != 200)
+    print(f"{args.requests} requests, {args.clients} clients, {errors} errors, {args.requests / seconds:.1f} req/s")
+    print(f"latency ms  p50 {percentile(latencies, 50) * 1000:.1f}  p95 {percentile(latencies, 95) * 1000:.1f}  p99 {percentile(latencies, 99) * 1000:.1f}")
+
+    s3_requests = new_connections = 0
+    for pid, stats in after.items():
+        base = before.get(pid, {'requests': 0, 'poolMisses': 0})
+        s3_requests += stats['requests'] - base['requests']
+        new_connections += stats['poolMisses'] - base['poolMisses']
+    print(f"S3 requests {s3_requests}, new connections (handshakes) {new_connections}, "
+          f"pool hit rate {(1 - new_connections / s3_requests) * 100 if s3_requests else 100:.1f}% across {len(after)} workers")
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", type=str, default="http://127.0.0.1:5000", help="Base URL of the running app.")
+    parser.add_argument("--clients", type=int, default=50, help="Concurrent clients.")
+    parser.add_argument("--requests", type=int, default=1000, help="Total requests.")
+    parser.add_argument("--limit", type=int, default=100, help="Page size requested from /api/s3/files.")
+    parser.add_argument("--stats_samples", type=int, default=20, help="Pool stats requests used to reach every worker.")
+
+    args = parser.parse_args()
+
+    main(args)
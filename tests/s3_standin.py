@@ -0,0 +1,143 @@
+import http.client
+import logging
+import os
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+"""
+Helpers for running the app and the benchmark scripts against a local S3
+stand-in (moto) instead of the real bucket. Requires `pip install "moto[s3]"`.
+"""
+
+BENCH_BUCKET = "mosaic-bench"
+
+def mock_s3():
+    """Return a moto context manager that intercepts all boto3 S3 calls"""
+    # Fake credentials so botocore never looks for real ones
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    try:
+        from moto import mock_aws as mock
+    except ImportError:  # moto < 5
+        from moto import mock_s3 as mock
+    return mock()
+
+def inject_latency(s3_client, seconds):
+    """Sleep before every request the client sends to simulate network round trips"""
+    def _sleep(**kwargs):
+        time.sleep(seconds)
+    s3_client.meta.events.register("before-send.s3", _sleep)
+
+def fake_metadata(i):
+    """S3 object metadata shaped like what upload_to_s3() writes"""
+    dataset = f"dataset{i % 10:02d}"
+    return {
+        "dataset_name": dataset,
+        "subjectID": f"sub-{i:05d}",
+        "preprocessing_pipeline": "fMRIPrepv23.2.0",
+        "owner_name": "John Smith",
+        "owner_email": "jsmith@email.com",
+        "beta_pipeline": "GLMsingle",
+        "github_url": "github.com",
+        "publication_url": "https://www.nature.com/",
+        "crc32_hash": f"{i:08x}",
+    }
+
+def seed_bucket(s3_client, bucket, n, body=b"\x89HDF\r\n\x1a\n"):
+    """Create the bucket and put n small HDF5-named objects with metadata"""
+    s3_client.create_bucket(Bucket=bucket)
+    keys = []
+    for i in range(n):
+        key = f"sub-{i:05d}_dataset{i % 10:02d}_crc32-{i:08x}.hdf5"
+        s3_client.put_object(Bucket=bucket, Key=key, Body=body, Metadata=fake_metadata(i))
+        keys.append(key)
+    return keys
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def start_moto_server(port=None):
+    """Start moto's S3 stand-in as a local HTTP server, returns (server, endpoint url)"""
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    from moto.server import ThreadedMotoServer
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)  # no access log line per S3 call
+    port = port or free_port()
+    server = ThreadedMotoServer(ip_address="127.0.0.1", port=port, verbose=False)
+    server.start()
+    return server, f"http://127.0.0.1:{port}"
+
+def start_latency_proxy(target_url, seconds, port=0):
+    """Forward HTTP requests to target_url after sleeping, to give a local
+    stand-in the round trip time of real S3. Returns (server, proxy url)."""
+    target = urlsplit(target_url)
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _forward(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            time.sleep(seconds)
+            upstream = http.client.HTTPConnection(target.hostname, target.port, timeout=60)
+            upstream.request(self.command, self.path, body=body, headers=dict(self.headers))
+            response = upstream.getresponse()
+            data = response.read()
+            self.send_response(response.status)
+            for name, value in response.getheaders():
+                if name.lower() not in ("transfer-encoding", "connection", "content-length"):
+                    self.send_header(name, value)
+            # HEAD responses carry the object's length, not the empty body's
+            length = response.getheader("Content-Length", "0") if self.command == "HEAD" else str(len(data))
+            self.send_header("Content-Length", length)
+            self.end_headers()
+            if self.command != "HEAD":
+                self.wfile.write(data)
+            upstream.close()
+
+        do_GET = do_PUT = do_POST = do_DELETE = do_HEAD = _forward
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+def run_synthetic_s3(object_size, port, chunk_size=1024 * 1024):
+    """Serve GetObject for any key as object_size bytes generated on the fly.
+    Lets archive benchmarks read far more data than moto can hold in memory."""
+    chunk = bytes(range(256)) * (chunk_size // 256)
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _headers(self):
+            self.send_response(200)
+            self.send_header("Content-Length", str(object_size))
+            self.send_header("ETag", '"synthetic"')
+            self.send_header("Content-Type", "application/x-hdf")
+            self.end_headers()
+
+        def do_HEAD(self):
+            self._headers()
+
+        def do_GET(self):
+            self._headers()
+            remaining = object_size
+            while remaining > 0:
+                n = min(remaining, len(chunk))
+                self.wfile.write(chunk[:n])
+                remaining -= n
+
+        def log_message(self, *args):
+            pass
+
+    ThreadingHTTPServer(("127.0.0.1", port), Handler).serve_forever()
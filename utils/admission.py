@@ -0,0 +1,64 @@
+import os
+import time
+
+#local
+from utils.db import connect, transaction, STATE_DB_PATH
+from utils.jobs import pid_alive
+
+# Uploads streaming through /api/s3/upload at once, over all workers on this host
+UPLOAD_MAX_CONCURRENT = int(os.environ.get('UPLOAD_MAX_CONCURRENT', 4))
+# Most bytes of those uploads still to arrive, by their Content-Length
+UPLOAD_MAX_INFLIGHT_BYTES = int(os.environ.get('UPLOAD_MAX_INFLIGHT_BYTES', 64 * 1024**3))
+# Seconds a client is told to wait when an upload is turned away
+UPLOAD_RETRY_AFTER = int(os.environ.get('UPLOAD_RETRY_AFTER', 30))
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS upload_slots (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    bytes INTEGER NOT NULL,
+    pid INTEGER NOT NULL,
+    started_at REAL NOT NULL
+);
+'''
+
+
+class AdmissionController:
+    """Caps the uploads streaming at once and the bytes they announce, shared by all workers
+
+    Each admitted upload holds a slot row until it is released. Slots of
+    workers that died mid-upload are reclaimed on the next acquire.
+    """
+
+    def __init__(self, path=STATE_DB_PATH, max_concurrent=UPLOAD_MAX_CONCURRENT,
+                 max_inflight_bytes=UPLOAD_MAX_INFLIGHT_BYTES):
+        self.path = path
+        self.max_concurrent = max_concurrent
+        self.max_inflight_bytes = max_inflight_bytes
+        connect(self.path).executescript(SCHEMA)
+
+    def acquire(self, nbytes):
+        """Admit an upload of nbytes, returning its slot ID, or None if the host is saturated
+
+        An upload larger than max_inflight_bytes on its own is still admitted
+        when nothing else is in flight, so it is not turned away forever.
+        """
+        conn = connect(self.path)
+        with transaction(conn):
+            for row in conn.execute("SELECT DISTINCT pid FROM upload_slots").fetchall():
+                if not pid_alive(row['pid']):
+                    conn.execute("DELETE FROM upload_slots WHERE pid = ?", (row['pid'],))
+            count, inflight = conn.execute("SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM upload_slots").fetchone()
+            if count >= self.max_concurrent or (count and inflight + nbytes > self.max_inflight_bytes):
+                return None
+            cursor = conn.execute("INSERT INTO upload_slots (bytes, pid, started_at) VALUES (?, ?, ?)",
+                                  (nbytes, os.getpid(), time.time()))
+            return cursor.lastrowid
+
+    def release(self, slot_id):
+        connect(self.path).execute("DELETE FROM upload_slots WHERE id = ?", (slot_id,))
+
+    def stats(self):
+        count, inflight = connect(self.path).execute(
+            "SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM upload_slots").fetchone()
+        return {'uploads': count, 'inflightBytes': inflight,
+                'maxConcurrent': self.max_concurrent, 'maxInflightBytes': self.max_inflight_bytes}
@@ -0,0 +1,325 @@
+import hashlib
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+import warnings
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, as_completed, wait
+
+#local
+from utils.lazy import lazy_import
+from utils.s3 import get_s3_client
+from utils.s3file import S3RangeFile
+
+h5py = lazy_import('h5py')
+np = lazy_import('numpy')
+
+# Processes reading member files at once
+AGGREGATE_WORKERS = int(os.environ.get('AGGREGATE_WORKERS', os.cpu_count() or 1))
+# Bytes of one read from one file, and the budget of one percentile slab over all files
+AGGREGATE_CHUNK_BYTES = int(os.environ.get('AGGREGATE_CHUNK_BYTES', 16 * 1024 * 1024))
+# Most files in one aggregation
+AGGREGATE_MAX_FILES = int(os.environ.get('AGGREGATE_MAX_FILES', 2000))
+# Results by cache key, as <key>.npy with a <key>.json description
+AGGREGATE_CACHE_DIR = os.environ.get('AGGREGATE_CACHE_DIR', 'aggregates')
+# Range request size of the member reads
+AGGREGATE_BLOCK_SIZE = int(os.environ.get('AGGREGATE_BLOCK_SIZE', 1024 * 1024))
+# Directory of the spill file a percentile copies every file's dataset into, the system temp dir by default
+AGGREGATE_SPILL_DIR = os.environ.get('AGGREGATE_SPILL_DIR') or None
+
+REDUCTIONS = ('mean', 'count', 'percentile')
+
+# Catalog metadata fields that make up a dataset group, as groupData() in static/js/download.js
+GROUP_FIELDS = {
+    'datasetName': 'dataset_name',
+    'preprocessingPipeline': 'preprocessing_pipeline',
+    'betaPipeline': 'beta_pipeline',
+    'publicationUrl': 'publication_url',
+}
+
+
+def group_members(entries, group):
+    """Catalog entries of a dataset group given as {datasetName, preprocessingPipeline, betaPipeline, publicationUrl}"""
+    wanted = {field: group.get(name, '') or '' for name, field in GROUP_FIELDS.items()}
+    return [entry for entry in entries
+            if all((entry['metadata'].get(field, '') or '') == value for field, value in wanted.items())]
+
+
+def parse_reduction(reduction, q=None):
+    """Validate a reduction and its percentile, returning q as a float or None
+
+    Raises:
+        ValueError: For unknown reductions or percentiles outside 0-100
+    """
+    if reduction not in REDUCTIONS:
+        raise ValueError(f"reduction must be one of {', '.join(REDUCTIONS)}")
+    if reduction != 'percentile':
+        return None
+    try:
+        q = float(50 if q is None else q)
+    except (TypeError, ValueError):
+        raise ValueError('q must be a number')
+    if not 0 <= q <= 100:
+        raise ValueError('q must be between 0 and 100')
+    return q
+
+
+def cache_key(members, dataset, reduction, q=None):
+    """Content address of an aggregation: its inputs' keys and ETags and the reduction
+
+    A new upload or a replaced object changes the key, so cached results never go stale.
+    """
+    inputs = sorted((member['key'], member['etag']) for member in members)
+    data = json.dumps([inputs, dataset.strip('/'), reduction, q], separators=(',', ':'))
+    return hashlib.sha256(data.encode()).hexdigest()[:32]
+
+
+def _open(s3_client, bucket, member):
+    return S3RangeFile(s3_client, bucket, member['key'], block_size=AGGREGATE_BLOCK_SIZE,
+                       size=member['size'], etag=member['etag'])
+
+
+def _dataset(h5, member, dataset_path):
+    dataset = h5.get(dataset_path)
+    if not isinstance(dataset, h5py.Dataset) or dataset.shape is None or dataset.dtype.kind not in 'biuf':
+        raise ValueError(f"{member['key']} has no numeric dataset {dataset_path}")
+    return dataset
+
+
+def _row_slices(shape, itemsize, chunk_bytes):
+    """Slices along the first axis of about chunk_bytes each"""
+    if not shape:
+        return [()]
+    row_bytes = max(1, int(np.prod(shape[1:], dtype=np.int64)) * itemsize)
+    rows = max(1, chunk_bytes // row_bytes)
+    return [slice(start, min(start + rows, shape[0])) for start in range(0, shape[0], rows)]
+
+
+def partial_sums(bucket, member, dataset_path, chunk_bytes=AGGREGATE_CHUNK_BYTES):
+    """Sum and non-NaN count of one file's dataset, read chunk by chunk
+
+    Runs in a pool process. Memory is the two output-sized arrays plus one chunk.
+
+    Returns:
+        (sum, count, bytes fetched, range requests)
+    """
+    with _open(get_s3_client(), bucket, member) as f, h5py.File(f, 'r') as h5:
+        dataset = _dataset(h5, member, dataset_path)
+        total = np.zeros(dataset.shape, dtype=np.float64)
+        count = np.zeros(dataset.shape, dtype=np.int64)
+        for index in _row_slices(dataset.shape, dataset.dtype.itemsize, chunk_bytes):
+            values = np.asarray(dataset[index], dtype=np.float64)
+            valid = ~np.isnan(values)
+            total[index] = np.where(valid, values, 0)
+            count[index] = valid
+    return total, count, f.bytes_fetched, f.requests
+
+
+def spill_member(bucket, member, dataset_path, spill_path, position, shape, dtype, chunk_bytes=AGGREGATE_CHUNK_BYTES):
+    """Copy one file's dataset into its place in the spill file, read chunk by chunk
+
+    Runs in a pool process. Memory is one chunk.
+
+    Returns:
+        (bytes fetched, range requests)
+    """
+    dtype = np.dtype(dtype)
+    offset = position * int(np.prod(shape, dtype=np.int64)) * dtype.itemsize
+    spill = np.memmap(spill_path, dtype=dtype, mode='r+', offset=offset, shape=shape)
+    with _open(get_s3_client(), bucket, member) as f, h5py.File(f, 'r') as h5:
+        dataset = _dataset(h5, member, dataset_path)
+        for index in _row_slices(dataset.shape, dataset.dtype.itemsize, chunk_bytes):
+            spill[index] = dataset[index]
+    spill.flush()
+    del spill
+    return f.bytes_fetched, f.requests
+
+
+def percentile_slab(spill_path, files, shape, dtype, index, q):
+    """Elementwise percentile over all files of one slab of rows of the spill file
+
+    Runs in a pool process. Memory is the slab of every file, which
+    aggregate() keeps under AGGREGATE_CHUNK_BYTES.
+
+    Returns:
+        (index, percentiles)
+    """
+    spill = np.memmap(spill_path, dtype=np.dtype(dtype), mode='r', shape=(files,) + tuple(shape))
+    slabs = np.asarray(spill[(slice(None),) + ((index,) if isinstance(index, slice) else index)], dtype=np.float64)
+    del spill
+    with warnings.catch_warnings():
+        # Elements that are NaN in every file stay NaN
+        warnings.simplefilter('ignore', RuntimeWarning)
+        result = np.nanpercentile(slabs, q, axis=0)
+    return index, result
+
+
+def dataset_shape(bucket, member, dataset_path):
+    """(shape, dtype string) of one file's dataset, from its header"""
+    with _open(get_s3_client(), bucket, member) as f, h5py.File(f, 'r') as h5:
+        dataset = _dataset(h5, member, dataset_path)
+        return dataset.shape, dataset.dtype.str
+
+
+def _pool(workers):
+    """Process pool from a fork server, safe to start from a process that has threads"""
+    context = multiprocessing.get_context('forkserver')
+    context.set_forkserver_preload(['utils.aggregate', 'h5py', 'numpy'])
+    return ProcessPoolExecutor(max_workers=workers, mp_context=context)
+
+
+def aggregate(bucket, members, dataset_path, reduction, q=None, workers=AGGREGATE_WORKERS,
+              chunk_bytes=AGGREGATE_CHUNK_BYTES, progress=None):
+    """Reduce one dataset elementwise across many files
+
+    mean and count fan out one file per task, at most two tasks per worker
+    ahead. Each task returns its partial sums, which are merged and dropped
+    as they arrive, so memory stays at a few output-sized arrays per worker
+    however many files there are. percentile needs every file's value of an
+    element at once. Each file's dataset is first read once into its place
+    in a spill file on local disk, and then slabs of rows are fanned out,
+    each sized so that all files' copies of it fit in chunk_bytes.
+
+    Args:
+        bucket: Bucket of the members
+        members: Dicts of key, etag and size, e.g. catalog entries
+        dataset_path: Path of the dataset inside each file, the same shape in all of them
+        reduction: One of REDUCTIONS
+        q: Percentile for the percentile reduction
+        workers: Pool size
+        chunk_bytes: Read and slab size budget
+        progress: Called with (tasks done, tasks)
+
+    Returns:
+        (result array, stats dict)
+
+    Raises:
+        ValueError: If a file lacks the dataset or the shapes differ
+    """
+    start = time.perf_counter()
+    # Only what the pool processes need is pickled to them
+    members = [{'key': member['key'], 'etag': member['etag'], 'size': member['size']} for member in members]
+    stats = {'files': len(members), 'bytesFetched': 0, 'rangeRequests': 0}
+    with _pool(workers) as executor:
+        if reduction in ('mean', 'count'):
+            remaining = iter(members)
+            pending = {}
+            total = count = None
+            done = 0
+            while True:
+                # A finished task holds two output-sized arrays until it is merged, so only a
+                # couple per worker are submitted ahead
+                for member in remaining:
+                    pending[executor.submit(partial_sums, bucket, member, dataset_path, chunk_bytes)] = member
+                    if len(pending) >= workers * 2:
+                        break
+                if not pending:
+                    break
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    member = pending.pop(future)
+                    partial_total, partial_count, fetched, requests = future.result()
+                    if total is None:
+                        total, count = partial_total, partial_count
+                    elif partial_total.shape != total.shape:
+                        raise ValueError(f"{member['key']} has shape {partial_total.shape}, other files {total.shape}")
+                    else:
+                        total += partial_total
+                        count += partial_count
+                    del future, partial_total, partial_count
+                    stats['bytesFetched'] += fetched
+                    stats['rangeRequests'] += requests
+                    done += 1
+                    if progress:
+                        progress(done, len(members))
+            if reduction == 'count':
+                result = count
+            else:
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    result = np.where(count > 0, total / np.maximum(count, 1), np.nan)
+        else:
+            headers = executor.map(dataset_shape, [bucket] * len(members), members, [dataset_path] * len(members))
+            shape = None
+            dtypes = set()
+            for member, (other, dtype) in zip(members, headers):
+                if shape is not None and other != shape:
+                    raise ValueError(f"{member['key']} has shape {other}, other files {shape}")
+                shape = other
+                dtypes.add(dtype)
+            dtype = np.result_type(*sorted(dtypes))
+            fd, spill_path = tempfile.mkstemp(dir=AGGREGATE_SPILL_DIR, prefix='aggregate-', suffix='.spill')
+            try:
+                spill_bytes = len(members) * int(np.prod(shape, dtype=np.int64)) * dtype.itemsize
+                os.ftruncate(fd, spill_bytes)
+                os.close(fd)
+                stats['spillBytes'] = spill_bytes
+                slices = _row_slices(shape, 8 * len(members), chunk_bytes)
+                tasks = len(members) + len(slices)
+                futures = [executor.submit(spill_member, bucket, member, dataset_path, spill_path, position, shape,
+                                           dtype.str, chunk_bytes)
+                           for position, member in enumerate(members)]
+                for done, future in enumerate(as_completed(futures), 1):
+                    fetched, requests = future.result()
+                    stats['bytesFetched'] += fetched
+                    stats['rangeRequests'] += requests
+                    if progress:
+                        progress(done, tasks)
+                result = np.full(shape, np.nan)
+                futures = [executor.submit(percentile_slab, spill_path, len(members), shape, dtype.str, index, q)
+                           for index in slices]
+                for done, future in enumerate(as_completed(futures), len(members) + 1):
+                    index, values = future.result()
+                    result[index] = values
+                    if progress:
+                        progress(done, tasks)
+            finally:
+                os.remove(spill_path)
+    stats['seconds'] = round(time.perf_counter() - start, 3)
+    return result, stats
+
+
+def result_summary(result):
+    """Scalar overview of a result array for the JSON description"""
+    values = np.asarray(result, dtype=np.float64)
+    finite = values[np.isfinite(values)]
+    if not finite.size:
+        return {'finite': 0}
+    return {'finite': int(finite.size), 'min': float(finite.min()), 'max': float(finite.max()),
+            'mean': float(finite.mean())}
+
+
+class AggregateCache:
+    """Aggregation results on disk by cache key, shared by all workers
+
+    Keys are content addresses of the inputs, so entries never need
+    invalidating.
+    """
+
+    def __init__(self, directory=AGGREGATE_CACHE_DIR):
+        self.directory = directory
+
+    def _path(self, key, suffix):
+        return os.path.join(self.directory, f"{key}{suffix}")
+
+    def get(self, key):
+        """(description, path of the .npy), or None"""
+        try:
+            with open(self._path(key, '.json')) as f:
+                return json.load(f), self._path(key, '.npy')
+        except (OSError, ValueError):
+            return None
+
+    def put(self, key, result, description):
+        """Write the array before its description, so a description always has its array"""
+        os.makedirs(self.directory, exist_ok=True)
+        for suffix, write in (('.npy', lambda f: np.save(f, result)),
+                              ('.json', lambda f: f.write(json.dumps(description).encode()))):
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix='.tmp-')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    write(f)
+                os.replace(tmp_path, self._path(key, suffix))
+            except BaseException:
+                os.remove(tmp_path)
+                raise
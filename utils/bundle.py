@@ -0,0 +1,69 @@
+import os
+import tarfile
+
+# Bytes read from S3 and yielded to the client at a time
+BUNDLE_CHUNK_SIZE = int(os.environ.get('BUNDLE_CHUNK_SIZE', 1024 * 1024))
+# Most objects in one archive
+BUNDLE_MAX_FILES = int(os.environ.get('BUNDLE_MAX_FILES', 5000))
+
+
+def tar_header(entry):
+    """512-byte aligned tar header of a catalog entry
+
+    PAX headers carry sizes above the 8 GiB limit of the classic ustar size field.
+    """
+    info = tarfile.TarInfo(name=entry['key'])
+    info.size = entry['size']
+    info.mtime = int(entry['last_modified'].timestamp())
+    info.mode = 0o644
+    return info.tobuf(format=tarfile.PAX_FORMAT)
+
+
+def tar_padding(size):
+    return b'\0' * (-size % tarfile.BLOCKSIZE)
+
+
+# Two zero blocks end a tar archive
+TAR_END = b'\0' * (2 * tarfile.BLOCKSIZE)
+
+
+def tar_size(entries):
+    """Exact byte size of the archive iter_tar() produces, known before any object is read"""
+    return sum(len(tar_header(entry)) + entry['size'] + len(tar_padding(entry['size'])) for entry in entries) + len(TAR_END)
+
+
+def iter_tar(s3_client, bucket, entries, chunk_size=BUNDLE_CHUNK_SIZE):
+    """Stream a tar archive of S3 objects without staging them
+
+    Each member is its header, the object body as it arrives from S3, and
+    zero padding to the next 512-byte block. Memory use is one chunk no
+    matter how large the objects or the archive are.
+
+    Args:
+        s3_client: boto3 S3 client
+        bucket: Bucket of the objects
+        entries: Catalog entries with key, size, etag and last_modified
+        chunk_size: Bytes read from S3 per chunk
+
+    Raises:
+        IOError: If an object's body does not match its listed size, the
+            archive would otherwise be silently corrupt
+    """
+    for entry in entries:
+        yield tar_header(entry)
+        params = {'Bucket': bucket, 'Key': entry['key']}
+        if entry.get('etag'):
+            # Fail instead of mixing a replaced object's bytes into the listed size
+            params['IfMatch'] = entry['etag']
+        body = s3_client.get_object(**params)['Body']
+        sent = 0
+        try:
+            for chunk in body.iter_chunks(chunk_size):
+                sent += len(chunk)
+                yield chunk
+        finally:
+            body.close()
+        if sent != entry['size']:
+            raise IOError(f"{entry['key']} sent {sent} bytes, expected {entry['size']}")
+        yield tar_padding(entry['size'])
+    yield TAR_END
@@ -0,0 +1,342 @@
+import hashlib
+import os
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import Future, TimeoutError
+
+#local
+from utils.db import connect, STATE_DB_PATH
+from utils.fetch import PERMANENT_ERRORS
+from utils.metrics import metrics
+
+# Seconds a catalog listing is served from memory before it is refreshed
+CATALOG_TTL = float(os.environ.get('CATALOG_TTL', 60))
+# Seconds a read waits for a refresh before it is served the previous index
+CATALOG_REFRESH_TIMEOUT = float(os.environ.get('CATALOG_REFRESH_TIMEOUT', 2))
+
+HDF5_EXTENSIONS = ('.hdf5', '.h5')
+
+# Sortable fields of a catalog query, mapped to the value each entry sorts by
+SORT_FIELDS = {
+    'fileId': lambda entry: entry['key'],
+    'lastModified': lambda entry: entry['last_modified'],
+    'size': lambda entry: entry['size'],
+    'datasetName': lambda entry: entry['metadata'].get('dataset_name', '').lower(),
+    'subjectName': lambda entry: entry['metadata'].get('subjectID', '').lower(),
+}
+
+# Metadata searched by the free-text `q` filter, same fields as the download page filter
+SEARCH_FIELDS = ['dataset_name', 'preprocessing_pipeline', 'beta_pipeline', 'github_url', 'owner_name']
+
+GENERATION_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS catalog_generation (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    value INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO catalog_generation VALUES (0, 0);
+'''
+
+
+class CatalogGeneration:
+    """Counter in the state DB that marks the catalogs of all processes stale
+
+    Each process has its own S3Catalog, so a change to the bucket made by
+    one process, e.g. a job worker finalizing an upload, bumps the counter.
+    Catalogs compare it on every read and refresh once it has moved.
+    """
+
+    def __init__(self, path=STATE_DB_PATH):
+        self.path = path
+        connect(self.path).executescript(GENERATION_SCHEMA)
+
+    def get(self):
+        return connect(self.path).execute("SELECT value FROM catalog_generation WHERE id = 0").fetchone()['value']
+
+    def bump(self):
+        connect(self.path).execute("UPDATE catalog_generation SET value = value + 1 WHERE id = 0")
+
+
+class S3Catalog:
+    """In-memory index of the HDF5 objects in an S3 bucket.
+
+    The catalog is filled by one listing of the bucket and then refreshed
+    incrementally: a refresh lists the bucket again and only HEADs keys whose
+    ETag or LastModified changed since the previous listing. Entries are
+    served from memory until the TTL expires, the shared generation is
+    bumped or `invalidate()` is called.
+
+    Once the catalog holds entries, from a refresh or from a snapshot via
+    `seed()`, reads never wait long on S3: a stale read starts a background
+    refresh and waits at most refresh_timeout for it, then serves the
+    previous index. S3 errors are handled the same way.
+    """
+
+    def __init__(self, s3_client, bucket, fetch_metadata, ttl=CATALOG_TTL, exclude_prefixes=(),
+                 refresh_timeout=CATALOG_REFRESH_TIMEOUT, generation=None):
+        """
+        Args:
+            s3_client: boto3 S3 client used for listing the bucket
+            bucket: Name of the bucket to index
+            fetch_metadata: Callable taking a list of keys and returning a dict of
+                key to object metadata, e.g. a concurrent batch of HEADs
+            ttl: Seconds before a listing is considered stale
+            exclude_prefixes: Key prefixes left out of the catalog, e.g. staged uploads
+            refresh_timeout: Seconds a read of a filled catalog waits for a refresh
+            generation: CatalogGeneration shared with the other processes, if any
+        """
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.fetch_metadata = fetch_metadata
+        self.ttl = ttl
+        self.exclude_prefixes = tuple(exclude_prefixes)
+        self.refresh_timeout = refresh_timeout
+        self.generation = generation
+        # Entries and the lookup structures built from them are swapped in as
+        # one dict so readers never see an index from a different refresh
+        self._index = build_index({})
+        self._refreshed_at = None
+        # Shared generation the current index was listed at
+        self._generation_seen = None
+        self._lock = threading.Lock()
+        self._loaded = False
+        # (pid, Future) of the background refresh in flight, threads do not survive fork
+        self._pending = (None, None)
+        self._pending_lock = threading.Lock()
+        # Counted by every request thread, `+=` on a dict value is not atomic
+        self._stats_lock = threading.Lock()
+        self.stats = {'refreshes': 0, 'heads': 0, 'hits': 0, 'stale_hits': 0}
+
+    def _count(self, name, n=1):
+        with self._stats_lock:
+            self.stats[name] += n
+
+    def _list_objects(self):
+        """Return the HDF5 objects from every page of the bucket listing"""
+        paginator = self.s3_client.get_paginator('list_objects_v2')
+        objects = []
+        for page in paginator.paginate(Bucket=self.bucket):
+            objects.extend(obj for obj in page.get('Contents', [])
+                           if obj['Key'].endswith(HDF5_EXTENSIONS)
+                           and not obj['Key'].startswith(self.exclude_prefixes))
+        return objects
+
+    def is_stale(self):
+        if self._refreshed_at is None or time.monotonic() - self._refreshed_at > self.ttl:
+            return True
+        return self.generation is not None and self.generation.get() != self._generation_seen
+
+    def refresh(self):
+        """List the bucket and HEAD only new or changed keys"""
+        with self._lock:
+            self._refresh()
+
+    def _refresh(self):
+        with metrics.timer('mosaic_catalog_refresh_seconds'):
+            self._refresh_index()
+
+    def _refresh_index(self):
+        # Read before listing, a bump during the listing makes the next read refresh again
+        generation = self.generation.get() if self.generation is not None else None
+        previous = self._index['entries']
+        entries = {}
+        changed = []
+        for obj in self._list_objects():
+            key = obj['Key']
+            cached = previous.get(key)
+            if cached and cached['etag'] == obj.get('ETag', '') and cached['last_modified'] == obj['LastModified']:
+                entries[key] = cached
+            else:
+                changed.append(obj)
+
+        # HEAD only new or changed keys, as one concurrent batch
+        metadata = self.fetch_metadata([obj['Key'] for obj in changed])
+        self._count('heads', len(changed))
+        for obj in changed:
+            key = obj['Key']
+            entries[key] = {
+                'key': key,
+                # A failed HEAD returns no metadata, leave the ETag unset so it is retried
+                'etag': obj.get('ETag', '') if metadata.get(key) else None,
+                'last_modified': obj['LastModified'],
+                'size': obj['Size'],
+                'metadata': metadata.get(key, {}),
+            }
+
+        # Keys missing from the listing were deleted and drop out here
+        self._index = build_index(entries)
+        self._refreshed_at = time.monotonic()
+        self._generation_seen = generation
+        self._loaded = True
+        self._count('refreshes')
+
+    def seed(self, entries, replace=False):
+        """Fill an empty catalog with entries saved earlier, e.g. a snapshot
+
+        The seeded entries are served right away but count as stale, so the
+        next read refreshes them. Unchanged keys are not HEADed again. With
+        replace, a stale catalog's entries are swapped out too, e.g. for a
+        newer snapshot than the one a forked worker inherited.
+        """
+        with self._lock:
+            if not self._loaded or (replace and self.is_stale()):
+                self._index = build_index({entry['key']: entry for entry in entries})
+                self._loaded = True
+
+    @property
+    def version(self):
+        """Content version of the current index, changes whenever an object does"""
+        return self._index['version']
+
+    def invalidate(self):
+        """Force the next read of this process's catalog to refresh, see CatalogGeneration for all of them"""
+        self._refreshed_at = None
+
+    def _background_refresh(self):
+        """Return the Future of the refresh in flight, starting one if there is none"""
+        with self._pending_lock:
+            pid, future = self._pending
+            if pid != os.getpid() or future.done():
+                future = Future()
+
+                def run():
+                    try:
+                        with self._lock:
+                            # Another thread may have refreshed while we waited on the lock
+                            if self.is_stale():
+                                self._refresh()
+                        future.set_result(None)
+                    except Exception as e:
+                        future.set_exception(e)
+
+                threading.Thread(target=run, name='catalog-refresh', daemon=True).start()
+                self._pending = (os.getpid(), future)
+            return future
+
+    def refresh_within(self, timeout):
+        """Refresh a stale catalog in the background, waiting at most timeout seconds for it
+
+        Returns:
+            True if the catalog is fresh by the time this returns
+
+        Raises:
+            Exception: Errors of the refresh, if it failed in time
+        """
+        if not self.is_stale():
+            return True
+        try:
+            self._background_refresh().result(timeout=timeout)
+        except TimeoutError:
+            return False
+        return True
+
+    def _current_index(self):
+        """Return the index, refreshing it first if stale
+
+        Only one refresh runs at a time. Until the catalog holds entries,
+        reads wait for it and see its errors. Afterwards they wait at most
+        refresh_timeout and otherwise get the previous index.
+        """
+        if not self.is_stale():
+            self._count('hits')
+            return self._index
+        future = self._background_refresh()
+        if not self._loaded:
+            future.result()
+            return self._index
+        try:
+            future.result(timeout=self.refresh_timeout)
+        except TimeoutError:
+            self._count('stale_hits')
+        except Exception as e:
+            if getattr(e, 'response', {}).get('Error', {}).get('Code') in PERMANENT_ERRORS:
+                raise
+            print(f"Catalog refresh failed, serving the previous listing: {e}")
+            self._count('stale_hits')
+        return self._index
+
+    def lookup(self, keys):
+        """Return {key: entry} for the given keys that are in the catalog, refreshing if stale"""
+        entries = self._current_index()['entries']
+        return {key: entries[key] for key in keys if key in entries}
+
+    def entries(self):
+        """Return catalog entries sorted by key, refreshing if stale"""
+        index = self._current_index()
+        return [index['entries'][key] for key in index['order']['fileId']]
+
+    def query(self, q='', dataset='', pipeline='', owner='', sort='fileId', limit=None, cursor=None):
+        """Filter, sort and page the catalog
+
+        Args:
+            q: Case-insensitive substring matched against the searchable metadata and key
+            dataset: Exact (case-insensitive) dataset name
+            pipeline: Exact preprocessing or beta pipeline name
+            owner: Exact owner name or email
+            sort: One of SORT_FIELDS, prefixed with '-' for descending order
+            limit: Maximum number of entries to return, None for all
+            cursor: Key of the last entry of the previous page
+
+        Returns:
+            (entries, next_cursor, total) where next_cursor is None on the last page
+        """
+        field = sort[1:] if sort.startswith('-') else sort
+        if field not in SORT_FIELDS:
+            raise ValueError(f"Unknown sort field '{field}'")
+
+        index = self._current_index()
+
+        # Intersect the exact-match postings before scanning
+        candidates = None
+        for name, value in (('dataset', dataset), ('pipeline', pipeline), ('owner', owner)):
+            if value:
+                postings = index[name].get(value.lower(), set())
+                candidates = postings if candidates is None else candidates & postings
+
+        order = index['order'][field]
+        if sort.startswith('-'):
+            order = order[::-1]
+        q = q.lower()
+        matches = [key for key in order
+                   if (candidates is None or key in candidates) and q in index['text'][key]]
+
+        start = 0
+        if cursor:
+            try:
+                start = matches.index(cursor) + 1
+            except ValueError:
+                raise ValueError('Invalid cursor')
+
+        page = matches[start:] if limit is None else matches[start:start + limit]
+        next_cursor = page[-1] if page and start + len(page) < len(matches) else None
+        return [index['entries'][key] for key in page], next_cursor, len(matches)
+
+
+def build_index(entries):
+    """Build the lookup structures served by S3Catalog.query()"""
+    index = {
+        'entries': entries,
+        'dataset': defaultdict(set),
+        'pipeline': defaultdict(set),
+        'owner': defaultdict(set),
+        'text': {},
+        'order': {},
+    }
+    for key, entry in entries.items():
+        metadata = entry['metadata']
+        index['dataset'][metadata.get('dataset_name', '').lower()].add(key)
+        for field in ('preprocessing_pipeline', 'beta_pipeline'):
+            index['pipeline'][metadata.get(field, '').lower()].add(key)
+        for field in ('owner_name', 'owner_email'):
+            index['owner'][metadata.get(field, '').lower()].add(key)
+        index['text'][key] = '\n'.join([key] + [metadata.get(field, '') for field in SEARCH_FIELDS]).lower()
+
+    for field, sort_value in SORT_FIELDS.items():
+        # Ties break on the key so paging is stable
+        index['order'][field] = sorted(entries, key=lambda key: (sort_value(entries[key]), key))
+
+    digest = hashlib.sha256()
+    for key in index['order']['fileId']:
+        digest.update(f"{key}\0{entries[key]['etag']}\0{entries[key]['last_modified'].isoformat()}\n".encode())
+    index['version'] = digest.hexdigest()[:16]
+    return index
@@ -0,0 +1,43 @@
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+# SQLite file holding state shared by all gunicorn workers on this host
+STATE_DB_PATH = os.environ.get('STATE_DB_PATH', 'mosaic_state.sqlite3')
+
+_local = threading.local()
+
+
+def connect(path=STATE_DB_PATH):
+    """Return this thread's connection to the state database
+
+    Connections are cached per thread and per process, since a sqlite3
+    connection must not be shared across threads or inherited over fork.
+    """
+    connections = getattr(_local, 'connections', None)
+    if connections is None or _local.pid != os.getpid():
+        connections = _local.connections = {}
+        _local.pid = os.getpid()
+
+    if path not in connections:
+        # Autocommit mode, writers open their own transactions with transaction()
+        conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        connections[path] = conn
+    return connections[path]
+
+
+@contextmanager
+def transaction(conn):
+    """Run a block as one write transaction, serialized across processes"""
+    # IMMEDIATE takes the write lock up front so read-then-write is atomic
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        yield conn
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+    conn.execute('COMMIT')
@@ -0,0 +1,60 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from botocore.exceptions import ClientError
+
+# Parallelism cap, per-key retries and per-request timeout for metadata HEADs
+HEAD_CONCURRENCY = int(os.environ.get('HEAD_CONCURRENCY', 16))
+HEAD_RETRIES = int(os.environ.get('HEAD_RETRIES', 2))
+HEAD_TIMEOUT = float(os.environ.get('HEAD_TIMEOUT', 10))  # seconds
+
+# Client errors that will not go away on retry
+PERMANENT_ERRORS = {'404', 'NoSuchKey', '403', 'AccessDenied'}
+
+
+def fetch_with_retries(fetch, key, retries=HEAD_RETRIES, backoff=0.2):
+    """Call fetch(key), retrying transient failures with exponential backoff"""
+    for attempt in range(retries + 1):
+        try:
+            return fetch(key)
+        except ClientError as e:
+            if e.response['Error']['Code'] in PERMANENT_ERRORS or attempt == retries:
+                raise
+        except Exception:
+            if attempt == retries:
+                raise
+        time.sleep(backoff * 2 ** attempt)
+
+
+def fetch_batch(fetch, keys, max_workers=HEAD_CONCURRENCY, retries=HEAD_RETRIES):
+    """Fetch metadata for a batch of keys with bounded concurrency
+
+    boto3 clients are thread safe, so the pool shares one client whose
+    connection pool should hold at least `max_workers` connections. Request
+    timeouts are enforced by the client's botocore config (see HEAD_TIMEOUT).
+
+    Args:
+        fetch: Callable taking a key and returning its metadata, raising on failure
+        keys: Keys to fetch
+        max_workers: Maximum number of requests in flight
+        retries: Retries per key after the first attempt
+
+    Returns:
+        Dict of key to metadata, with an empty dict for keys that failed
+    """
+    keys = list(keys)
+    if not keys:
+        return {}
+
+    def _fetch(key):
+        try:
+            return fetch_with_retries(fetch, key, retries=retries)
+        except Exception as e:
+            print(f"Error getting metadata for {key}: {e}")
+            return {}
+
+    if max_workers <= 1 or len(keys) == 1:
+        return {key: _fetch(key) for key in keys}
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(keys))) as executor:
+        return dict(zip(keys, executor.map(_fetch, keys)))
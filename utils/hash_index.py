@@ -0,0 +1,143 @@
+import os
+import time
+
+#local
+from utils.db import connect, transaction, STATE_DB_PATH
+from utils.jobs import pid_alive
+
+# Seconds after which an unfinished claim is assumed abandoned, even if its process still runs
+HASH_CLAIM_TIMEOUT = float(os.environ.get('HASH_CLAIM_TIMEOUT', 6 * 3600))
+
+# Bumped when the meaning of stored hashes changes, forcing a rebuild.
+# 2: hashes are algorithm-prefixed ids like 'sha256:<hex>' and 'crc32:<hex>'
+INDEX_VERSION = '2'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS content_hashes (
+    hash TEXT PRIMARY KEY,
+    key TEXT NOT NULL,
+    state TEXT NOT NULL,  -- 'pending' while uploading, 'committed' once in the bucket
+    claimed_at REAL NOT NULL,
+    pid INTEGER           -- process holding a pending claim
+);
+CREATE INDEX IF NOT EXISTS content_hashes_key ON content_hashes (key);
+CREATE TABLE IF NOT EXISTS hash_index_meta (
+    name TEXT PRIMARY KEY,
+    value TEXT
+);
+'''
+
+
+class HashIndex:
+    """Persistent content hash -> object key index used for upload dedup.
+
+    Hashes are algorithm-prefixed ids (see utils.hashing.hash_id). Every
+    object has a 'crc32:' row, and objects uploaded with a strong content
+    hash also have a row for it. An upload first claims its strong hash. The
+    claim is a single write transaction, so when two workers race on the same
+    file exactly one of them wins and the other sees a duplicate. The winner
+    commits the claim once the object is in the bucket, or releases it if the
+    upload fails.
+    """
+
+    def __init__(self, path=STATE_DB_PATH):
+        self.path = path
+        conn = connect(self.path)
+        conn.executescript(SCHEMA)
+        columns = {row['name'] for row in conn.execute("PRAGMA table_info(content_hashes)")}
+        if 'pid' not in columns:
+            conn.execute("ALTER TABLE content_hashes ADD COLUMN pid INTEGER")
+
+    def is_built(self):
+        row = connect(self.path).execute(
+            "SELECT value FROM hash_index_meta WHERE name = 'version'").fetchone()
+        return row is not None and row['value'] == INDEX_VERSION
+
+    def rebuild(self, hashes):
+        """Fill the index from bucket metadata, unless another worker already did
+
+        Args:
+            hashes: Iterable of (hash id, object key) pairs
+        """
+        conn = connect(self.path)
+        with transaction(conn):
+            if self.is_built():
+                return
+            now = time.time()
+            # Rows from an older index version are not comparable, start over
+            conn.execute("DELETE FROM content_hashes WHERE state = 'committed'")
+            conn.executemany(
+                "INSERT OR REPLACE INTO content_hashes (hash, key, state, claimed_at) VALUES (?, ?, 'committed', ?)",
+                [(content_hash, key, now) for content_hash, key in hashes])
+            conn.execute("INSERT OR REPLACE INTO hash_index_meta VALUES ('built_at', ?)", (str(now),))
+            conn.execute("INSERT OR REPLACE INTO hash_index_meta VALUES ('version', ?)", (INDEX_VERSION,))
+
+    def lookup(self, content_hash):
+        """Return the key stored under a hash, or None"""
+        row = connect(self.path).execute(
+            "SELECT key FROM content_hashes WHERE hash = ?", (content_hash,)).fetchone()
+        return row['key'] if row else None
+
+    def lookup_legacy(self, crc32_id):
+        """Return the key of an object matching a 'crc32:' id that has no strong hash
+
+        Objects uploaded before strong hashes were introduced can only be
+        compared by CRC32.
+        """
+        row = connect(self.path).execute(
+            """SELECT key FROM content_hashes AS crc WHERE hash = ? AND NOT EXISTS (
+                   SELECT 1 FROM content_hashes AS strong
+                   WHERE strong.key = crc.key AND strong.hash NOT LIKE 'crc32:%')""",
+            (crc32_id,)).fetchone()
+        return row['key'] if row else None
+
+    def add(self, content_hash, key):
+        """Record an extra hash of a committed object, e.g. its CRC32"""
+        connect(self.path).execute(
+            "INSERT OR IGNORE INTO content_hashes (hash, key, state, claimed_at) VALUES (?, ?, 'committed', ?)",
+            (content_hash, key, time.time()))
+
+    def claim(self, content_hash, key):
+        """Reserve a hash for an upload
+
+        A pending claim for the same key is taken over, e.g. when a failed
+        finalize is retried, and so is one whose process has died.
+
+        Returns:
+            None if the claim succeeded, otherwise the key of the existing
+            (or in-flight) object with the same content
+        """
+        conn = connect(self.path)
+        with transaction(conn):
+            row = conn.execute(
+                "SELECT key, state, claimed_at, pid FROM content_hashes WHERE hash = ?",
+                (content_hash,)).fetchone()
+            if row and (row['state'] == 'committed' or (
+                    row['key'] != key and time.time() - row['claimed_at'] < HASH_CLAIM_TIMEOUT
+                    and (row['pid'] is None or pid_alive(row['pid'])))):
+                return row['key']
+            conn.execute(
+                "INSERT OR REPLACE INTO content_hashes (hash, key, state, claimed_at, pid) VALUES (?, ?, 'pending', ?, ?)",
+                (content_hash, key, time.time(), os.getpid()))
+        return None
+
+    def commit(self, content_hash, key):
+        """Mark a claimed hash as uploaded under key"""
+        connect(self.path).execute(
+            "UPDATE content_hashes SET state = 'committed', key = ? WHERE hash = ?",
+            (key, content_hash))
+
+    def forget(self, key):
+        """Drop the committed rows of an object that is no longer in the bucket
+
+        Returns:
+            Number of rows dropped, 0 if the key only has pending claims
+        """
+        return connect(self.path).execute(
+            "DELETE FROM content_hashes WHERE key = ? AND state = 'committed'", (key,)).rowcount
+
+    def release(self, content_hash, key):
+        """Drop a pending claim after a failed upload"""
+        connect(self.path).execute(
+            "DELETE FROM content_hashes WHERE hash = ? AND key = ? AND state = 'pending'",
+            (content_hash, key))
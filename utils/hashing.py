@@ -0,0 +1,174 @@
+import hashlib
+import mmap
+import os
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+# Size of the reusable read buffer and of each leaf in tree mode
+HASH_CHUNK_SIZE = int(os.environ.get('HASH_CHUNK_SIZE', 8 * 1024 * 1024))
+HASH_TREE_LEAF_SIZE = int(os.environ.get('HASH_TREE_LEAF_SIZE', 64 * 1024 * 1024))
+# Algorithm of the content hash used for upload dedup
+CONTENT_HASH_ALGORITHM = os.environ.get('CONTENT_HASH_ALGORITHM', 'sha256')
+
+
+class Crc32:
+    """zlib CRC32 with the hashlib update/hexdigest interface"""
+    name = 'crc32'
+
+    def __init__(self):
+        self._crc = 0
+
+    def update(self, data):
+        self._crc = zlib.crc32(data, self._crc)
+
+    def hexdigest(self):
+        return f"{self._crc & 0xffffffff:08x}"
+
+    def digest(self):
+        return (self._crc & 0xffffffff).to_bytes(4, 'big')
+
+
+class Crc32c(Crc32):
+    """CRC32C (Castagnoli), hardware accelerated by the optional `crc32c` package"""
+    name = 'crc32c'
+
+    def __init__(self):
+        import crc32c
+        self._update = crc32c.crc32c
+        self._crc = 0
+
+    def update(self, data):
+        self._crc = self._update(data, self._crc)
+
+
+def _xxhash():
+    import xxhash
+    return xxhash.xxh3_128()
+
+
+def _blake3():
+    from blake3 import blake3
+    # blake3 hashes large buffers on several threads itself
+    return blake3(max_threads=blake3.AUTO)
+
+
+# Algorithm name -> hasher factory. crc32c, xxhash and blake3 need their optional packages.
+ALGORITHMS = {
+    'crc32': Crc32,
+    'crc32c': Crc32c,
+    'xxhash': _xxhash,
+    'blake3': _blake3,
+    'sha256': hashlib.sha256,
+}
+
+
+def new_hasher(algorithm):
+    """Return a fresh hasher with update()/hexdigest() for an algorithm name"""
+    if algorithm not in ALGORITHMS:
+        raise ValueError(f"Unknown hash algorithm '{algorithm}', choose from {sorted(ALGORITHMS)}")
+    try:
+        return ALGORITHMS[algorithm]()
+    except ImportError as e:
+        raise ValueError(f"Hash algorithm '{algorithm}' needs an optional package: {e}")
+
+
+def available_algorithms():
+    """Algorithms whose optional dependencies are installed"""
+    available = []
+    for algorithm in ALGORITHMS:
+        try:
+            new_hasher(algorithm)
+            available.append(algorithm)
+        except ValueError:
+            pass
+    return available
+
+
+def hash_id(algorithm, hexdigest):
+    """Algorithm-prefixed digest, e.g. 'sha256:9f86...', as stored in the hash index"""
+    return f"{algorithm}:{hexdigest}"
+
+
+def update_from_fileobj(fileobj, hashers, chunk_size=HASH_CHUNK_SIZE):
+    """Feed a file object to several hashers in one pass through one reused buffer
+
+    Returns:
+        Number of bytes hashed
+    """
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    total = 0
+    while True:
+        n = fileobj.readinto(buffer)
+        if not n:
+            return total
+        for hasher in hashers:
+            hasher.update(view[:n])
+        total += n
+
+
+def hash_file(file_path, algorithm='crc32', chunk_size=HASH_CHUNK_SIZE, use_mmap=False):
+    """Hash a file with one algorithm
+
+    Args:
+        file_path: Path to the file
+        algorithm: One of ALGORITHMS
+        chunk_size: Bytes passed to the hasher per update
+        use_mmap: Hash slices of a memory map instead of reading into a buffer
+
+    Returns:
+        Hex digest
+    """
+    hasher = new_hasher(algorithm)
+    with open(file_path, 'rb', buffering=0) as f:
+        if use_mmap and os.fstat(f.fileno()).st_size > 0:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                view = memoryview(mm)
+                try:
+                    for offset in range(0, len(mm), chunk_size):
+                        hasher.update(view[offset:offset + chunk_size])
+                finally:
+                    view.release()
+        else:
+            update_from_fileobj(f, [hasher], chunk_size)
+    return hasher.hexdigest()
+
+
+def _hash_leaf(file_path, algorithm, offset, length, chunk_size):
+    """Digest of one byte range of a file, read through a private buffer"""
+    hasher = new_hasher(algorithm)
+    buffer = bytearray(min(chunk_size, length) or 1)
+    view = memoryview(buffer)
+    with open(file_path, 'rb', buffering=0) as f:
+        f.seek(offset)
+        remaining = length
+        while remaining > 0:
+            n = f.readinto(view[:min(remaining, len(buffer))])
+            if not n:
+                break
+            hasher.update(view[:n])
+            remaining -= n
+    return hasher.digest()
+
+
+def tree_hash(file_path, algorithm='sha256', leaf_size=HASH_TREE_LEAF_SIZE, workers=None, chunk_size=HASH_CHUNK_SIZE):
+    """Hash fixed-size leaves of a file in parallel and combine them
+
+    zlib and hashlib release the GIL while hashing large buffers, so leaves on
+    a thread pool use several cores. The result is the digest of the
+    concatenated leaf digests. It depends on leaf_size and differs from the
+    flat hash of the file, so the returned id names both.
+
+    Returns:
+        Hash id like 'tree-sha256-64m:<hex>'
+    """
+    size = os.path.getsize(file_path)
+    offsets = range(0, max(size, 1), leaf_size)
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        leaves = executor.map(
+            lambda offset: _hash_leaf(file_path, algorithm, offset, min(leaf_size, size - offset), chunk_size),
+            offsets)
+        root = new_hasher(algorithm)
+        for leaf in leaves:
+            root.update(leaf)
+    return f"tree-{algorithm}-{leaf_size // (1024 * 1024)}m:{root.hexdigest()}"
@@ -2,26 +2,29 @@ from dotenv import load_dotenv
 load_dotenv()
 import os
 import argparse
-import h5py
 from pathlib import Path
-import humanize
-import boto3
 from botocore.exceptions import NoCredentialsError
-import h5py
 import os
 import zlib
 import threading
-from tqdm import tqdm
+
+#local
+from utils.hashing import hash_file
+from utils.lazy import lazy_import
+
+tqdm = lazy_import('tqdm')
 
 class TqdmUploadCallback:
-    def __init__(self, filename):
+    def __init__(self, filename, size=None, on_progress=None):
         self._filename = filename
-        self._size = float(os.path.getsize(filename))
+        self._size = float(os.path.getsize(filename) if size is None else size)
         self._seen_so_far = 0
         self._lock = threading.Lock()
+        # Optional hook called with (bytes so far, total bytes), e.g. a job's progress
+        self._on_progress = on_progress
         
         # Create progress bar
-        self.pbar = tqdm(
+        self.pbar = tqdm.tqdm(
             total=self._size,
             unit='B',
             unit_scale=True,
@@ -32,6 +35,8 @@ class TqdmUploadCallback:
         with self._lock:
             self._seen_so_far += bytes_amount
             self.pbar.update(bytes_amount)
+            if self._on_progress:
+                self._on_progress(self._seen_so_far, self._size)
 
     def close(self):
         self.pbar.close()
@@ -75,14 +80,6 @@ def generate_content_hash(file_path, hash_length=8):
     Returns:
         Short hash string
     """
-    # Option 1: CRC32 (fast, good distribution, 8 hex chars max)
-    if hash_length <= 8:
-        with open(file_path, 'rb') as f:
-            crc = 0
-            while True:
-                chunk = f.read(8192)  # Read in chunks for memory efficiency
-                if not chunk:
-                    break
-                crc = zlib.crc32(chunk, crc)
-        # Convert to unsigned and take first hash_length characters
-        return f"{crc & 0xffffffff:08x}"[:hash_length]
\ No newline at end of file
+    # CRC32 (fast, good distribution, 8 hex chars max). Too short to tell
+    # files apart at scale, use utils.hashing for dedup keys.
+    return hash_file(file_path, 'crc32')[:hash_length]
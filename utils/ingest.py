@@ -0,0 +1,351 @@
+import io
+import os
+import queue
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.sansio.multipart import Data, Epilogue, Field, File, MultipartDecoder, NeedData
+
+#local
+from utils.metrics import metrics
+
+# Multipart part size and number of parts uploading at once. Memory use of one
+# ingest is bounded by (INGEST_CONCURRENCY + 1) * INGEST_PART_SIZE.
+INGEST_PART_SIZE = int(os.environ.get('INGEST_PART_SIZE', 16 * 1024 * 1024))
+INGEST_CONCURRENCY = int(os.environ.get('INGEST_CONCURRENCY', 4))
+
+# Uploads land here first, then are copied server-side to their final key
+STAGING_PREFIX = 'incoming/'
+
+# Bytes read from the request body at a time when streaming an upload
+UPLOAD_STREAM_CHUNK_SIZE = int(os.environ.get('UPLOAD_STREAM_CHUNK_SIZE', 1024 * 1024))
+# Most bytes of the form fields next to the file, e.g. the upload token
+UPLOAD_MAX_FORM_BYTES = int(os.environ.get('UPLOAD_MAX_FORM_BYTES', 64 * 1024))
+
+S3_MIN_PART_SIZE = 5 * 1024 * 1024
+
+
+class CountingReader(io.RawIOBase):
+    """Read-only wrapper around a file object that counts bytes read, seekable if the file object is"""
+
+    def __init__(self, fileobj):
+        self._fileobj = fileobj
+        self.bytes_read = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return self._fileobj.seekable()
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        return self._fileobj.seek(offset, whence)
+
+    def tell(self):
+        return self._fileobj.tell()
+
+    def readinto(self, b):
+        if hasattr(self._fileobj, 'readinto'):
+            n = self._fileobj.readinto(b)
+        else:
+            data = self._fileobj.read(len(b))
+            n = len(data)
+            b[:n] = data
+        self.bytes_read += n or 0
+        return n
+
+
+class _StreamingDecoder(MultipartDecoder):
+    """MultipartDecoder that holds back only what could be the start of a boundary
+
+    Werkzeug 2.3 keeps everything after the last CR or LF of a file's data in
+    its buffer until more arrives, which for binary files with long runs free
+    of line breaks grows to the whole run.
+    """
+
+    def last_newline(self, data):
+        # A partial CRLF--boundary can only start this close to the end
+        offset = max(0, len(data) - len(self.boundary) - 4)
+        return offset + super().last_newline(data[offset:])
+
+
+class MultipartFileReader(io.RawIOBase):
+    """Read-only file object over one file of a multipart/form-data body, parsed as it arrives
+
+    Werkzeug's form parsing writes the whole file somewhere before the view
+    runs. This decodes the body incrementally instead, so the file's bytes can
+    go straight to S3 with only one chunk of the body in memory. Other form
+    fields are collected into `fields`; the ones after the file are only
+    there once finish() has read the rest of the body.
+    """
+
+    def __init__(self, stream, boundary, file_field='file', chunk_size=UPLOAD_STREAM_CHUNK_SIZE,
+                 max_form_bytes=UPLOAD_MAX_FORM_BYTES):
+        self._stream = stream
+        # The decoder keeps at most one chunk plus an unfinished part header
+        self._decoder = _StreamingDecoder(boundary, max_form_memory_size=chunk_size + max_form_bytes)
+        self._file_field = file_field
+        self._chunk_size = chunk_size
+        self._max_form_bytes = max_form_bytes
+        self._form_bytes = 0
+        self._pending = memoryview(b'')
+        self._file_done = False
+        self._eof = False
+        self._chunks = self._file_chunks()
+        self.fields = {}
+        self.filename = None
+
+    def readable(self):
+        return True
+
+    def _next_event(self):
+        """Next decoder event, reading more of the body while the decoder needs it"""
+        while True:
+            event = self._decoder.next_event()
+            if not isinstance(event, NeedData):
+                return event
+            if self._eof:
+                raise ValueError('Upload body ended before the form was complete')
+            chunk = self._stream.read(self._chunk_size)
+            if chunk:
+                self._decoder.receive_data(chunk)
+            else:
+                self._eof = True
+                self._decoder.receive_data(None)
+
+    def _file_chunks(self):
+        """Yield b'' once the file part starts, then its data, collecting the other fields"""
+        part = None
+        value = []
+        while True:
+            event = self._next_event()
+            if isinstance(event, Epilogue):
+                return
+            if isinstance(event, (Field, File)):
+                part, value = event, []
+                if isinstance(event, File) and event.name == self._file_field and self.filename is None:
+                    self.filename = event.filename or ''
+                    yield b''
+            elif isinstance(event, Data) and part is not None:
+                if isinstance(part, File):
+                    if part.name == self._file_field and not self._file_done:
+                        self._file_done = not event.more_data
+                        if event.data:
+                            yield event.data
+                    # Data of any other file is dropped
+                    continue
+                self._form_bytes += len(event.data)
+                if self._form_bytes > self._max_form_bytes:
+                    raise ValueError('Form fields are too large')
+                value.append(event.data)
+                if not event.more_data:
+                    self.fields[part.name] = b''.join(value).decode('utf-8', errors='replace')
+
+    def start(self):
+        """Read the body up to the start of the file, after which `filename` is set
+
+        Raises:
+            ValueError: If the body has no such file or is malformed
+        """
+        if self.filename is None and next(self._chunks, None) is None:
+            raise ValueError('No file provided')
+
+    def readinto(self, b):
+        while not self._pending:
+            if self._file_done:
+                return 0
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                self._file_done = True
+                return 0
+            self._pending = memoryview(chunk)
+        n = min(len(b), len(self._pending))
+        b[:n] = self._pending[:n]
+        self._pending = self._pending[n:]
+        return n
+
+    def finish(self):
+        """Read the rest of the body, collecting the fields after the file"""
+        for _ in self._chunks:
+            pass
+
+
+class BufferReader(io.RawIOBase):
+    """Read-only file object over a memoryview
+
+    botocore only takes bytes or file objects as a request body, this lets a
+    reused part buffer be sent without copying it.
+    """
+
+    def __init__(self, view):
+        self._view = view
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._pos, io.SEEK_END: len(self._view)}[whence]
+        self._pos = max(0, base + offset)
+        return self._pos
+
+    def readinto(self, b):
+        chunk = self._view[self._pos:self._pos + len(b)]
+        n = len(chunk)
+        b[:n] = chunk
+        self._pos += n
+        return n
+
+
+def read_full(fileobj, view):
+    """Fill a memoryview from a file object, returning bytes read (short only at EOF)"""
+    filled = 0
+    while filled < len(view):
+        n = fileobj.readinto(view[filled:])
+        if not n:
+            break
+        filled += n
+    return filled
+
+
+def staging_key(filename):
+    return f"{STAGING_PREFIX}{uuid.uuid4().hex}/{filename}"
+
+
+def stream_to_s3(fileobj, s3_client, bucket, key, hashers=(), content_type='application/x-hdf',
+                 part_size=INGEST_PART_SIZE, concurrency=INGEST_CONCURRENCY, callback=None):
+    """Multipart-upload a file object to S3, hashing it in the same pass
+
+    Each part is read once into one of a few reused buffers, fed to the
+    hashers and then uploaded from the same buffer, with up to `concurrency`
+    parts in flight.
+
+    Args:
+        fileobj: Readable file object positioned at the start of the body
+        s3_client: boto3 S3 client
+        bucket: Destination bucket
+        key: Destination key
+        hashers: Hashers (see utils.hashing) updated with every part
+        content_type: Content type of the object
+        part_size: Size of each part, at least 5 MiB
+        concurrency: Maximum number of parts uploading at once
+        callback: Called with the byte count of each uploaded part
+
+    Returns:
+        Total bytes uploaded
+    """
+    part_size = max(part_size, S3_MIN_PART_SIZE)
+    upload_id = s3_client.create_multipart_upload(
+        Bucket=bucket, Key=key, ContentType=content_type)['UploadId']
+
+    free_buffers = queue.Queue()
+    for _ in range(concurrency + 1):
+        free_buffers.put(bytearray(part_size))
+
+    def _upload_part(part_number, buffer, n):
+        try:
+            response = s3_client.upload_part(
+                Bucket=bucket, Key=key, UploadId=upload_id, PartNumber=part_number,
+                Body=BufferReader(memoryview(buffer)[:n]))
+            metrics.inc('mosaic_bytes_uploaded_total', n)
+            if callback:
+                callback(n)
+            return {'PartNumber': part_number, 'ETag': response['ETag']}
+        finally:
+            free_buffers.put(buffer)
+
+    total = 0
+    futures = []
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            part_number = 1
+            while True:
+                # Blocks until a part upload hands its buffer back
+                buffer = free_buffers.get()
+                view = memoryview(buffer)
+                n = read_full(fileobj, view)
+                if n == 0 and part_number > 1:
+                    free_buffers.put(buffer)
+                    break
+                for hasher in hashers:
+                    hasher.update(view[:n])
+                metrics.inc('mosaic_bytes_hashed_total', n)
+                total += n
+                futures.append(executor.submit(_upload_part, part_number, buffer, n))
+                part_number += 1
+                # Surface a failed part before reading more of the file
+                for future in futures:
+                    if future.done() and future.exception():
+                        raise future.exception()
+                if n < part_size:
+                    break
+            parts = [future.result() for future in futures]
+
+        s3_client.complete_multipart_upload(
+            Bucket=bucket, Key=key, UploadId=upload_id, MultipartUpload={'Parts': parts})
+    except BaseException:
+        s3_client.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+        raise
+
+    return total
+
+
+def hash_s3_object(s3_client, bucket, key, hashers, chunk_size=INGEST_PART_SIZE, callback=None):
+    """Hash an object already in S3, streamed in one pass without staging to disk
+
+    Returns:
+        Total bytes hashed
+    """
+    body = s3_client.get_object(Bucket=bucket, Key=key)['Body']
+    total = 0
+    for chunk in body.iter_chunks(chunk_size):
+        for hasher in hashers:
+            hasher.update(chunk)
+        metrics.inc('mosaic_bytes_hashed_total', len(chunk))
+        total += len(chunk)
+        if callback:
+            callback(len(chunk))
+    return total
+
+
+def promote_staged_object(s3_client, bucket, staged_key, key, metadata, content_type='application/x-hdf'):
+    """Copy a staged object to its final key with metadata, then delete the staged copy
+
+    The copy runs inside S3 (multipart UploadPartCopy for large objects), so
+    no object bytes pass through this host.
+    """
+    s3_client.copy(
+        CopySource={'Bucket': bucket, 'Key': staged_key},
+        Bucket=bucket,
+        Key=key,
+        ExtraArgs={
+            'Metadata': metadata,
+            'MetadataDirective': 'REPLACE',
+            'ContentType': content_type
+        }
+    )
+    s3_client.delete_object(Bucket=bucket, Key=staged_key)
+
+
+class IngestStats:
+    """Bytes read from the upload and throughput of one ingest"""
+
+    def __init__(self, reader):
+        self._reader = reader
+        self._start = time.perf_counter()
+
+    def report(self, file_size):
+        seconds = time.perf_counter() - self._start
+        return {
+            'file_size': file_size,
+            'bytes_read': self._reader.bytes_read,
+            'seconds': round(seconds, 3),
+            'throughput_mb_s': round(file_size / 1e6 / seconds, 1) if seconds > 0 else None
+        }
@@ -0,0 +1,277 @@
+import argparse
+import json
+import multiprocessing
+import os
+import signal
+import time
+import traceback
+import uuid
+
+#local
+from utils.db import connect, transaction, STATE_DB_PATH
+from utils.metrics import metrics
+
+# Number of job worker processes gunicorn starts next to the web workers
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+JOB_POLL_INTERVAL = float(os.environ.get('JOB_POLL_INTERVAL', 1.0))  # seconds
+# Minimum seconds between progress writes of one job
+JOB_PROGRESS_INTERVAL = float(os.environ.get('JOB_PROGRESS_INTERVAL', 1.0))
+# Seconds before a job worker that exited is restarted, doubled for each
+# worker that exits sooner than JOB_MAX_RESTART_DELAY after it started
+JOB_RESTART_DELAY = float(os.environ.get('JOB_RESTART_DELAY', 1.0))
+JOB_MAX_RESTART_DELAY = float(os.environ.get('JOB_MAX_RESTART_DELAY', 60.0))
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL,        -- 'queued', 'running', 'succeeded' or 'failed'
+    progress_bytes INTEGER NOT NULL DEFAULT 0,
+    total_bytes INTEGER NOT NULL DEFAULT 0,
+    result TEXT,
+    http_status INTEGER,
+    error TEXT,
+    worker_pid INTEGER,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at);
+'''
+
+
+class JobQueue:
+    """SQLite-backed job queue, no broker needed
+
+    Web workers enqueue jobs and return right away, job worker processes on
+    the same host claim them one at a time inside a write transaction.
+    """
+
+    def __init__(self, path=STATE_DB_PATH):
+        self.path = path
+        connect(self.path).executescript(SCHEMA)
+
+    def enqueue(self, kind, payload, total_bytes=0, job_id=None):
+        job_id = job_id or new_job_id()
+        connect(self.path).execute(
+            "INSERT INTO jobs (id, kind, payload, status, total_bytes, created_at) VALUES (?, ?, ?, 'queued', ?, ?)",
+            (job_id, kind, json.dumps(payload), total_bytes, time.time()))
+        return job_id
+
+    def enqueue_unique(self, kind, payload, min_interval=0, same_payload=False):
+        """Enqueue a job unless one of this kind is still queued or was enqueued in the last min_interval seconds
+
+        For jobs like snapshot rebuilds, where one queued run covers every
+        request made before it starts. With same_payload, only a queued or
+        running job with an identical payload counts, e.g. for the same
+        aggregation requested twice.
+
+        Returns:
+            ID of the new or the already waiting job
+        """
+        conn = connect(self.path)
+        with transaction(conn):
+            if same_payload:
+                row = conn.execute(
+                    "SELECT id FROM jobs WHERE kind = ? AND payload = ? AND status IN ('queued', 'running') "
+                    "ORDER BY created_at DESC LIMIT 1",
+                    (kind, json.dumps(payload))).fetchone()
+            else:
+                row = conn.execute(
+                    "SELECT id FROM jobs WHERE kind = ? AND (status = 'queued' OR created_at > ?) "
+                    "ORDER BY created_at DESC LIMIT 1",
+                    (kind, time.time() - min_interval)).fetchone()
+            if row is not None:
+                return row['id']
+            return self.enqueue(kind, payload)
+
+    def get(self, job_id):
+        row = connect(self.path).execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job['payload'] = json.loads(job['payload'])
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        return job
+
+    def claim_next(self):
+        """Mark the oldest queued job as running in this process and return it"""
+        conn = connect(self.path)
+        with transaction(conn):
+            row = conn.execute(
+                "SELECT id FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1").fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = 'running', worker_pid = ?, started_at = ? WHERE id = ?",
+                (os.getpid(), time.time(), row['id']))
+        return self.get(row['id'])
+
+    def update_progress(self, job_id, progress_bytes, total_bytes=None):
+        connect(self.path).execute(
+            "UPDATE jobs SET progress_bytes = ?, total_bytes = COALESCE(?, total_bytes) WHERE id = ?",
+            (progress_bytes, total_bytes, job_id))
+
+    def finish(self, job_id, result, http_status):
+        """Store a handler's (response dict, HTTP status) outcome"""
+        status = 'succeeded' if http_status < 400 else 'failed'
+        connect(self.path).execute(
+            "UPDATE jobs SET status = ?, result = ?, http_status = ?, error = ?, finished_at = ? WHERE id = ?",
+            (status, json.dumps(result), http_status, result.get('error'), time.time(), job_id))
+
+    def fail(self, job_id, error):
+        connect(self.path).execute(
+            "UPDATE jobs SET status = 'failed', http_status = 500, error = ?, finished_at = ? WHERE id = ?",
+            (error, time.time(), job_id))
+
+    def fail_orphaned(self):
+        """Fail running jobs whose worker process died, they will not finish"""
+        for row in connect(self.path).execute(
+                "SELECT id, worker_pid FROM jobs WHERE status = 'running'").fetchall():
+            if not pid_alive(row['worker_pid']):
+                self.fail(row['id'], 'Job worker exited before the job finished')
+
+
+def new_job_id():
+    return uuid.uuid4().hex
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class JobProgress:
+    """Progress hook for TqdmUploadCallback that writes byte counts to a job, throttled"""
+
+    def __init__(self, queue, job_id, min_interval=JOB_PROGRESS_INTERVAL):
+        self.queue = queue
+        self.job_id = job_id
+        self.min_interval = min_interval
+        self._last_write = 0
+
+    def __call__(self, seen_so_far, total):
+        now = time.monotonic()
+        if seen_so_far >= total or now - self._last_write >= self.min_interval:
+            self.queue.update_progress(self.job_id, int(seen_so_far), int(total))
+            self._last_write = now
+
+
+def run_worker(handlers, queue=None, poll_interval=JOB_POLL_INTERVAL, schedule=None):
+    """Claim and run jobs until SIGTERM
+
+    Args:
+        handlers: Dict of job kind to callable(job, progress) returning
+            (response dict, HTTP status code)
+        queue: JobQueue to work on
+        poll_interval: Seconds to sleep when the queue is empty
+        schedule: Dict of job kind to seconds between runs, enqueued once
+            per interval across all workers
+    """
+    queue = queue or JobQueue()
+    stopping = []
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.append(signum))
+    queue.fail_orphaned()
+
+    while not stopping:
+        metrics.maybe_flush()
+        for kind, interval in (schedule or {}).items():
+            queue.enqueue_unique(kind, {}, min_interval=interval)
+        job = queue.claim_next()
+        if job is None:
+            time.sleep(poll_interval)
+            continue
+        start = time.perf_counter()
+        status = 'failed'
+        try:
+            result, http_status = handlers[job['kind']](job, JobProgress(queue, job['id']))
+            queue.finish(job['id'], result, http_status)
+            status = 'succeeded' if http_status < 400 else 'failed'
+        except Exception as e:
+            traceback.print_exc()
+            queue.fail(job['id'], str(e))
+        metrics.inc('mosaic_jobs_total', kind=job['kind'], status=status)
+        metrics.observe('mosaic_job_seconds', time.perf_counter() - start, kind=job['kind'])
+    metrics.flush()
+
+
+def _worker_main():
+    # Forked from the supervisor, whose handlers would only set its flags
+    for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP, signal.SIGCHLD):
+        signal.signal(signum, signal.SIG_DFL)
+    # Job handlers live next to the routes in app.py
+    import app
+    run_worker(app.JOB_HANDLERS, schedule=app.JOB_SCHEDULE)
+
+
+def start_worker():
+    """Start one job worker process
+
+    Not a daemon: aggregation jobs run a process pool, which daemonic
+    processes may not start. The supervisor stops its workers itself.
+    """
+    process = multiprocessing.Process(target=_worker_main, name='mosaic-job-worker')
+    process.start()
+    return process
+
+
+def supervise(count=JOB_WORKERS, parent_pid=None, poll_interval=JOB_POLL_INTERVAL):
+    """Keep `count` job workers running until SIGTERM or SIGINT
+
+    A worker that exits, e.g. killed by the OOM killer, is restarted after
+    JOB_RESTART_DELAY. The delay doubles while workers keep exiting soon
+    after they start, so a broken deploy does not fork in a tight loop. The
+    jobs a dead worker was running are failed by the worker replacing it. On
+    shutdown each worker gets SIGTERM and finishes its current job first.
+
+    Args:
+        count: Number of worker processes
+        parent_pid: Also stop once this process, e.g. the gunicorn master, is gone
+        poll_interval: Seconds between checks of the workers
+    """
+    stopping = []
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda signum, frame: stopping.append(signum))
+    workers = [None] * count
+    started_at = [0.0] * count
+    restart_at = [0.0] * count
+    delays = [JOB_RESTART_DELAY] * count
+
+    while not stopping and (parent_pid is None or os.getppid() == parent_pid):
+        now = time.monotonic()
+        for i, process in enumerate(workers):
+            if process is not None and process.exitcode is None:
+                continue
+            if process is not None:
+                if now - started_at[i] < JOB_MAX_RESTART_DELAY:
+                    delays[i] = min(delays[i] * 2, JOB_MAX_RESTART_DELAY)
+                else:
+                    delays[i] = JOB_RESTART_DELAY
+                restart_at[i] = now + delays[i]
+                workers[i] = None
+                print(f"Job worker {process.pid} exited with code {process.exitcode}, restarting it in {delays[i]:.0f} s")
+            if now >= restart_at[i]:
+                workers[i] = start_worker()
+                started_at[i] = now
+        time.sleep(poll_interval)
+
+    running = [process for process in workers if process is not None]
+    for process in running:
+        process.terminate()
+    for process in running:
+        process.join()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run MOSAIC upload job workers, restarting any that exit.")
+    parser.add_argument("--workers", type=int, default=JOB_WORKERS, help="Number of worker processes.")
+    parser.add_argument("--parent_pid", type=int, default=None, help="Exit when this process exits, e.g. the gunicorn master.")
+    args = parser.parse_args()
+
+    supervise(args.workers, parent_pid=args.parent_pid)
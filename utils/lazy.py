@@ -0,0 +1,31 @@
+import importlib
+import sys
+
+
+class LazyModule:
+    """Stand-in for a module that imports it on first attribute access
+
+    h5py, numpy and boto3 take most of the app's import time but only some
+    routes use them. Modules bind them with lazy_import() instead of import,
+    so a process pays for them when it first needs them, and the worker
+    warm-up (app.warm_up_worker) pays for them before a worker takes requests.
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            # import_module is thread-safe, concurrent first uses import once
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+    def __repr__(self):
+        return f"<lazy module {self._name!r}{'' if self._module is None else ' (loaded)'}>"
+
+
+def lazy_import(name):
+    """Module `name` if it is already imported, otherwise a LazyModule for it"""
+    module = sys.modules.get(name)
+    return module if module is not None else LazyModule(name)
@@ -0,0 +1,132 @@
+import json
+import os
+import time
+
+#local
+from utils.db import connect, STATE_DB_PATH
+from utils.lazy import lazy_import
+
+h5py = lazy_import('h5py')
+np = lazy_import('numpy')
+
+# Attribute arrays with more elements than this are summarized by shape and dtype
+MANIFEST_ATTR_MAX_ELEMENTS = int(os.environ.get('MANIFEST_ATTR_MAX_ELEMENTS', 64))
+# Smaller blocks than data reads, HDF5 metadata is scattered in small pieces
+MANIFEST_BLOCK_SIZE = int(os.environ.get('MANIFEST_BLOCK_SIZE', 64 * 1024))
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS manifests (
+    key TEXT NOT NULL,
+    etag TEXT NOT NULL,
+    manifest TEXT NOT NULL,
+    bytes_fetched INTEGER NOT NULL,
+    requests INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (key, etag)
+);
+'''
+
+
+def attr_to_json(value):
+    """JSON-friendly form of an HDF5 attribute value"""
+    if isinstance(value, bytes):
+        return value.decode('utf-8', errors='replace')
+    if isinstance(value, np.ndarray):
+        if value.size > MANIFEST_ATTR_MAX_ELEMENTS:
+            return {'shape': list(value.shape), 'dtype': str(value.dtype)}
+        return attr_to_json(value.tolist())
+    if isinstance(value, (list, tuple)):
+        return [attr_to_json(item) for item in value]
+    if isinstance(value, np.generic):
+        return attr_to_json(value.item())
+    if isinstance(value, float) and value != value:
+        return None  # NaN is not valid JSON
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+    return str(value)
+
+
+def attrs_to_json(attrs):
+    result = {}
+    for name in attrs:
+        try:
+            result[name] = attr_to_json(attrs[name])
+        except Exception as e:
+            # e.g. attribute types h5py cannot read
+            result[name] = {'error': str(e)}
+    return result
+
+
+def dataset_manifest(dataset):
+    return {
+        'type': 'dataset',
+        'shape': list(dataset.shape) if dataset.shape is not None else None,
+        'dtype': str(dataset.dtype),
+        'chunks': list(dataset.chunks) if dataset.chunks else None,
+        'compression': dataset.compression,
+        'compressionOpts': attr_to_json(dataset.compression_opts),
+        'shuffle': dataset.shuffle,
+        'nbytes': int(dataset.size * dataset.dtype.itemsize) if dataset.shape is not None else 0,
+        # Read from the object header, no data blocks are touched
+        'storageBytes': dataset.id.get_storage_size(),
+        'attrs': attrs_to_json(dataset.attrs)
+    }
+
+
+def group_manifest(group):
+    """Describe a group and everything below it without reading any dataset values"""
+    children = {}
+    for name in group:
+        link = group.get(name, getlink=True)
+        if isinstance(link, h5py.SoftLink):
+            children[name] = {'type': 'softlink', 'path': link.path}
+        elif isinstance(link, h5py.ExternalLink):
+            children[name] = {'type': 'externallink', 'filename': link.filename, 'path': link.path}
+        else:
+            child = group[name]
+            if isinstance(child, h5py.Group):
+                children[name] = group_manifest(child)
+            elif isinstance(child, h5py.Dataset):
+                children[name] = dataset_manifest(child)
+            else:
+                children[name] = {'type': 'datatype'}
+    return {'type': 'group', 'attrs': attrs_to_json(group.attrs), 'children': children}
+
+
+def build_manifest(fileobj):
+    """Structural manifest of an HDF5 file: group tree, dataset shapes, dtypes,
+    chunking, compression and attributes
+
+    Args:
+        fileobj: Path or seekable file object, e.g. an S3RangeFile
+
+    Returns:
+        Manifest dict rooted at '/'
+    """
+    with h5py.File(fileobj, 'r') as f:
+        return group_manifest(f)
+
+
+class ManifestCache:
+    """Manifests keyed by (key, ETag), shared by all workers
+
+    An object's manifest only changes when its ETag does, so entries never
+    need invalidating. Stale ETags just stop being looked up.
+    """
+
+    def __init__(self, path=STATE_DB_PATH):
+        self.path = path
+        connect(self.path).executescript(SCHEMA)
+
+    def get(self, key, etag):
+        row = connect(self.path).execute(
+            "SELECT manifest, bytes_fetched, requests FROM manifests WHERE key = ? AND etag = ?",
+            (key, etag)).fetchone()
+        if row is None:
+            return None
+        return {'manifest': json.loads(row['manifest']), 'bytes_fetched': row['bytes_fetched'], 'requests': row['requests']}
+
+    def put(self, key, etag, manifest, bytes_fetched, requests):
+        connect(self.path).execute(
+            "INSERT OR REPLACE INTO manifests VALUES (?, ?, ?, ?, ?, ?)",
+            (key, etag, json.dumps(manifest), bytes_fetched, requests, time.time()))
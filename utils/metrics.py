@@ -0,0 +1,348 @@
+import bisect
+import cProfile
+import fcntl
+import glob
+import json
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import g, has_request_context, request
+from flask.json.provider import DefaultJSONProvider
+
+# Per-process metrics files, merged by /metrics so it covers every gunicorn and job worker
+METRICS_DIR = os.environ.get('METRICS_DIR', 'metrics')
+# Minimum seconds between writes of one process's metrics file
+METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 5))
+# Fraction of requests run under cProfile, 0 turns profiling off
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+# Profiled requests slower than this many seconds are dumped to PROFILE_DIR
+PROFILE_SLOW_SECONDS = float(os.environ.get('PROFILE_SLOW_SECONDS', 1.0))
+PROFILE_DIR = os.environ.get('PROFILE_DIR', 'profiles')
+
+# Histogram bucket upper bounds in seconds, +Inf is implied
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# Name -> (type, help) of every metric, /metrics prints them in this order
+METRICS = {
+    'mosaic_http_requests_total': ('counter', 'HTTP requests by route, method and status'),
+    'mosaic_http_request_seconds': ('histogram', 'Time to the response headers by route and method'),
+    'mosaic_json_serialize_seconds': ('histogram', 'Time spent building JSON responses by route'),
+    'mosaic_template_render_seconds': ('histogram', 'Time spent rendering templates by template'),
+    'mosaic_s3_calls_total': ('counter', 'S3 API calls by operation and outcome'),
+    'mosaic_s3_call_seconds': ('histogram', 'S3 API call latency including retries by operation'),
+    'mosaic_catalog_refresh_seconds': ('histogram', 'Time to list the bucket and HEAD changed keys'),
+    'mosaic_bytes_hashed_total': ('counter', 'Bytes fed to the upload hashers'),
+    'mosaic_bytes_uploaded_total': ('counter', 'Bytes uploaded to S3 as multipart parts'),
+    'mosaic_uploads_rejected_total': ('counter', 'Streamed uploads turned away by admission control'),
+    'mosaic_cache_requests_total': ('counter', 'Cache lookups by cache and result (hit, miss or stale)'),
+    'mosaic_jobs_total': ('counter', 'Finished background jobs by kind and status'),
+    'mosaic_job_seconds': ('histogram', 'Background job run time by kind'),
+}
+
+
+def _label_key(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+class Metrics:
+    """Counters and histograms of this process, written to METRICS_DIR for aggregation
+
+    gunicorn workers do not share memory, so each process keeps its own
+    values and writes them to metrics-<pid>.json at most every flush
+    interval. `collect()` merges the files. Values inherited over fork are
+    dropped, each process starts from zero.
+    """
+
+    def __init__(self, directory=METRICS_DIR, flush_interval=METRICS_FLUSH_INTERVAL):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._collectors = []
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._counters = {}
+        self._histograms = {}
+        self._flushed_at = 0
+
+    def _check_pid(self):
+        if self._pid != os.getpid():
+            self._reset()
+
+    def inc(self, name, value=1, **labels):
+        with self._lock:
+            self._check_pid()
+            key = (name, _label_key(labels))
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        with self._lock:
+            self._check_pid()
+            key = (name, _label_key(labels))
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = {'buckets': [0] * (len(LATENCY_BUCKETS) + 1), 'sum': 0.0}
+            histogram['buckets'][bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+            histogram['sum'] += seconds
+
+    @contextmanager
+    def timer(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def register_collector(self, collector):
+        """Add a callable returning (name, labels, value) counters read at flush time
+
+        For counts objects already keep themselves, like cache hit counters.
+        """
+        self._collectors.append(collector)
+
+    def snapshot(self):
+        """This process's values as JSON-serializable lists"""
+        with self._lock:
+            self._check_pid()
+            values = {
+                'counters': dict(self._counters),
+                'histograms': {key: {'buckets': list(h['buckets']), 'sum': h['sum']}
+                               for key, h in self._histograms.items()},
+            }
+        for collector in self._collectors:
+            for name, labels, value in collector():
+                key = (name, _label_key(labels))
+                values['counters'][key] = values['counters'].get(key, 0) + value
+        return _to_lists(values)
+
+    def flush(self):
+        os.makedirs(self.directory, exist_ok=True)
+        _write_json_atomic(os.path.join(self.directory, f"metrics-{os.getpid()}.json"), self.snapshot())
+        self._flushed_at = time.monotonic()
+
+    def maybe_flush(self):
+        """Flush unless this process flushed within the flush interval"""
+        if time.monotonic() - self._flushed_at >= self.flush_interval:
+            self.flush()
+
+    def collect(self):
+        """Merged values of every process that wrote metrics, this one included
+
+        Files of exited processes are folded into metrics-archive.json, so
+        counters keep growing across worker restarts.
+        """
+        self.flush()
+        with open(os.path.join(self.directory, '.lock'), 'w') as lock:
+            # One collect at a time, so exited processes are archived once
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            archive_path = os.path.join(self.directory, 'metrics-archive.json')
+            archive = _add(_empty(), _read_json(archive_path) or _to_lists(_empty()))
+            live = _empty()
+            exited = []
+            for path in glob.glob(os.path.join(self.directory, 'metrics-*.json')):
+                match = re.fullmatch(r'metrics-(\d+)\.json', os.path.basename(path))
+                data = _read_json(path) if match else None
+                if data is None:
+                    continue
+                if _pid_alive(int(match.group(1))):
+                    _add(live, data)
+                else:
+                    _add(archive, data)
+                    exited.append(path)
+            if exited:
+                _write_json_atomic(archive_path, _to_lists(archive))
+                for path in exited:
+                    os.remove(path)
+        return _add(archive, _to_lists(live))
+
+
+def clear_metrics(directory=METRICS_DIR):
+    """Remove the metrics files of earlier runs, call before any worker starts"""
+    for path in glob.glob(os.path.join(directory, 'metrics-*.json')):
+        os.remove(path)
+
+
+def _pid_alive(pid):
+    # utils.jobs records job metrics, import it lazily
+    from utils.jobs import pid_alive
+    return pid_alive(pid)
+
+
+def _read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_json_atomic(path, data):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def _empty():
+    return {'counters': {}, 'histograms': {}}
+
+
+def _add(values, data):
+    """Add the lists of a snapshot file to {(name, labels): value} dicts, in place"""
+    for name, labels, value in data['counters']:
+        key = (name, _label_key(labels))
+        values['counters'][key] = values['counters'].get(key, 0) + value
+    for name, labels, buckets, total in data['histograms']:
+        key = (name, _label_key(labels))
+        histogram = values['histograms'].setdefault(key, {'buckets': [0] * len(buckets), 'sum': 0.0})
+        histogram['buckets'] = [a + b for a, b in zip(histogram['buckets'], buckets)]
+        histogram['sum'] += total
+    return values
+
+
+def _to_lists(values):
+    """JSON form of _add()'s dicts, label tuples become objects"""
+    return {
+        'pid': os.getpid(),
+        'counters': [[name, dict(labels), value] for (name, labels), value in values['counters'].items()],
+        'histograms': [[name, dict(labels), h['buckets'], h['sum']] for (name, labels), h in values['histograms'].items()],
+    }
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def prometheus_text(merged):
+    """Render merged metrics in the Prometheus text exposition format"""
+    lines = []
+    for name, (kind, help_text) in METRICS.items():
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+        if kind == 'counter':
+            for (metric, labels), value in sorted(merged['counters'].items()):
+                if metric == name:
+                    lines.append(f"{name}{_format_labels(labels)} {value}")
+        else:
+            for (metric, labels), histogram in sorted(merged['histograms'].items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), histogram['buckets']):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_format_labels(labels, [('le', bound)])} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {histogram['sum']}")
+                lines.append(f"{name}_count{_format_labels(labels)} {cumulative}")
+    return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
+
+
+def instrument_s3_client(client):
+    """Count and time every S3 API call of a boto3 client by operation"""
+    def before_call(model, context, **kwargs):
+        context['metrics_start'] = time.perf_counter()
+        context['metrics_operation'] = model.name
+
+    def after_call(http_response, model, context, **kwargs):
+        status = 'ok' if http_response.status_code < 300 else str(http_response.status_code)
+        _record_s3_call(model.name, context, status)
+
+    def after_call_error(exception, context, **kwargs):
+        # Connection errors after all retries, no response and no model are passed
+        _record_s3_call(context.get('metrics_operation', 'unknown'), context, type(exception).__name__)
+
+    client.meta.events.register('before-call.s3', before_call)
+    client.meta.events.register('after-call.s3', after_call)
+    client.meta.events.register('after-call-error.s3', after_call_error)
+
+
+def _record_s3_call(operation, context, status):
+    metrics.inc('mosaic_s3_calls_total', operation=operation, status=status)
+    start = context.get('metrics_start')
+    if start is not None:
+        metrics.observe('mosaic_s3_call_seconds', time.perf_counter() - start, operation=operation)
+
+
+def _route():
+    return request.url_rule.rule if request.url_rule else 'unmatched'
+
+
+class TimedJSONProvider(DefaultJSONProvider):
+    """Flask's JSON provider, timing jsonify() per route"""
+
+    def response(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return super().response(*args, **kwargs)
+        finally:
+            metrics.observe('mosaic_json_serialize_seconds', time.perf_counter() - start,
+                            route=_route() if has_request_context() else 'none')
+
+
+def init_app(app):
+    """Time every request, template render and JSON response of a Flask app
+
+    Streaming responses (bundles, slices) are timed to their headers, the
+    body is sent after the request handler returns. With a
+    PROFILE_SAMPLE_RATE above 0, that fraction of requests runs under
+    cProfile and those slower than PROFILE_SLOW_SECONDS are written to
+    PROFILE_DIR for `python -m pstats` or snakeviz.
+    """
+    from flask import before_render_template, template_rendered
+
+    app.json = TimedJSONProvider(app)
+
+    @app.before_request
+    def start_request_timer():
+        g.metrics_start = time.perf_counter()
+        if PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE:
+            g.profiler = cProfile.Profile()
+            g.profiler.enable()
+
+    @app.after_request
+    def record_request(response):
+        start = g.pop('metrics_start', None)
+        if start is None:
+            return response
+        seconds = time.perf_counter() - start
+        route = _route()
+        metrics.inc('mosaic_http_requests_total', route=route, method=request.method, status=response.status_code)
+        metrics.observe('mosaic_http_request_seconds', seconds, route=route, method=request.method)
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            profiler.disable()
+            if seconds >= PROFILE_SLOW_SECONDS:
+                _dump_profile(profiler, route, seconds)
+        metrics.maybe_flush()
+        return response
+
+    def start_template_timer(sender, template, context, **extra):
+        g.template_start = time.perf_counter()
+
+    def record_template(sender, template, context, **extra):
+        start = g.pop('template_start', None)
+        if start is not None:
+            metrics.observe('mosaic_template_render_seconds', time.perf_counter() - start,
+                            template=template.name)
+
+    before_render_template.connect(start_template_timer, app, weak=False)
+    template_rendered.connect(record_template, app, weak=False)
+
+
+def _dump_profile(profiler, route, seconds):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    name = re.sub(r'[^A-Za-z0-9]+', '_', route).strip('_') or 'root'
+    path = os.path.join(PROFILE_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{name}-{os.getpid()}-{int(seconds * 1000)}ms.prof")
+    profiler.dump_stats(path)
+    print(f"Profiled slow request {request.method} {request.path} ({seconds:.2f} s): {path}")
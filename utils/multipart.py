@@ -0,0 +1,101 @@
+import math
+import os
+import time
+
+#local
+from utils.db import connect, STATE_DB_PATH
+
+# Lifetime of a presigned part URL and the most URLs handed out per request
+PART_URL_EXPIRY = int(os.environ.get('PART_URL_EXPIRY', 3600))
+PART_URL_BATCH_LIMIT = int(os.environ.get('PART_URL_BATCH_LIMIT', 100))
+
+S3_MAX_PARTS = 10000
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS upload_sessions (
+    upload_id TEXT PRIMARY KEY,
+    key TEXT NOT NULL,        -- staging key the parts are uploaded to
+    filename TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    part_size INTEGER NOT NULL,
+    status TEXT NOT NULL,     -- 'active', 'assembled' (parts joined in S3), 'finalizing', 'completed' or 'aborted'
+    created_at REAL NOT NULL,
+    job_id TEXT,              -- background job finalizing the upload
+    expected_crc32 TEXT       -- CRC32 checked at preflight, re-verified when finalizing
+);
+'''
+
+
+def choose_part_size(size, min_part_size):
+    """Smallest part size (in whole MiB, at least min_part_size) that fits size in S3's part limit"""
+    mib = 1024 * 1024
+    part_size = max(min_part_size, math.ceil(size / S3_MAX_PARTS))
+    return math.ceil(part_size / mib) * mib
+
+
+class UploadSessions:
+    """Browser multipart uploads in progress, shared by all workers
+
+    S3 itself records which parts have arrived (ListParts), so a session only
+    needs to remember where the upload goes and how it is split into parts.
+    """
+
+    def __init__(self, path=STATE_DB_PATH):
+        self.path = path
+        conn = connect(self.path)
+        conn.executescript(SCHEMA)
+        columns = {row['name'] for row in conn.execute("PRAGMA table_info(upload_sessions)")}
+        if 'job_id' not in columns:
+            conn.execute("ALTER TABLE upload_sessions ADD COLUMN job_id TEXT")
+        if 'expected_crc32' not in columns:
+            conn.execute("ALTER TABLE upload_sessions ADD COLUMN expected_crc32 TEXT")
+
+    def create(self, upload_id, key, filename, size, part_size, expected_crc32=None):
+        connect(self.path).execute(
+            "INSERT INTO upload_sessions (upload_id, key, filename, size, part_size, status, created_at, expected_crc32) "
+            "VALUES (?, ?, ?, ?, ?, 'active', ?, ?)",
+            (upload_id, key, filename, size, part_size, time.time(), expected_crc32))
+        return self.get(upload_id)
+
+    def get(self, upload_id):
+        row = connect(self.path).execute(
+            "SELECT * FROM upload_sessions WHERE upload_id = ?", (upload_id,)).fetchone()
+        if row is None:
+            return None
+        session = dict(row)
+        session['part_count'] = max(1, math.ceil(session['size'] / session['part_size']))
+        return session
+
+    def set_status(self, upload_id, status):
+        connect(self.path).execute(
+            "UPDATE upload_sessions SET status = ? WHERE upload_id = ?", (status, upload_id))
+
+    def transition(self, upload_id, from_status, to_status, job_id=None):
+        """Atomically move a session between states, False if it was not in from_status"""
+        cursor = connect(self.path).execute(
+            "UPDATE upload_sessions SET status = ?, job_id = COALESCE(?, job_id) WHERE upload_id = ? AND status = ?",
+            (to_status, job_id, upload_id, from_status))
+        return cursor.rowcount == 1
+
+
+def list_uploaded_parts(s3_client, bucket, session):
+    """Return the parts S3 has received for a session, across all ListParts pages"""
+    paginator = s3_client.get_paginator('list_parts')
+    parts = []
+    for page in paginator.paginate(Bucket=bucket, Key=session['key'], UploadId=session['upload_id']):
+        parts.extend({'PartNumber': part['PartNumber'], 'ETag': part['ETag'], 'Size': part['Size']}
+                     for part in page.get('Parts', []))
+    return parts
+
+
+def presign_part_urls(s3_client, bucket, session, part_numbers, expires_in=PART_URL_EXPIRY):
+    """Presign PUT URLs for a batch of part numbers"""
+    return {
+        part_number: s3_client.generate_presigned_url(
+            'upload_part',
+            Params={'Bucket': bucket, 'Key': session['key'],
+                    'UploadId': session['upload_id'], 'PartNumber': part_number},
+            ExpiresIn=expires_in
+        )
+        for part_number in part_numbers
+    }
@@ -0,0 +1,122 @@
+import io
+import os
+import re
+
+from itsdangerous import BadSignature, SignatureExpired, URLSafeTimedSerializer
+
+# Leading bytes of a file sent with a preflight, enough for the superblock and
+# root group attributes of files written by h5py
+PREFLIGHT_HEADER_BYTES = int(os.environ.get('PREFLIGHT_HEADER_BYTES', 64 * 1024))
+# Seconds an upload token stays valid after the preflight
+UPLOAD_TOKEN_MAX_AGE = int(os.environ.get('UPLOAD_TOKEN_MAX_AGE', 24 * 3600))
+
+HDF5_SIGNATURE = b'\x89HDF\r\n\x1a\n'
+
+
+def find_hdf5_signature(header):
+    """Return the offset of the HDF5 signature, or None
+
+    The superblock is at offset 0 or, after a user block, at 512, 1024,
+    2048 and so on.
+    """
+    offset = 0
+    while offset + len(HDF5_SIGNATURE) <= len(header):
+        if header[offset:offset + len(HDF5_SIGNATURE)] == HDF5_SIGNATURE:
+            return offset
+        offset = 512 if offset == 0 else offset * 2
+    return None
+
+
+def parse_crc32(value):
+    """Normalize a hex CRC32 like the ones in object keys, raising ValueError if it is not one"""
+    if not isinstance(value, str) or not re.fullmatch(r'[0-9a-fA-F]{8}', value):
+        raise ValueError('crc32 must be 8 hex digits')
+    return value.lower()
+
+
+class HeaderFile(io.RawIOBase):
+    """Read-only file of `size` bytes of which only the leading `header` is known
+
+    Lets h5py open a file from its first bytes. Reads past the header return
+    zeros, so anything stored beyond it reads as empty or invalid.
+    """
+
+    def __init__(self, header, size):
+        self._header = header
+        self._size = size
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self._pos = offset
+        elif whence == io.SEEK_CUR:
+            self._pos += offset
+        else:
+            self._pos = self._size + offset
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+    def readinto(self, b):
+        n = max(0, min(len(b), self._size - self._pos))
+        known = self._header[self._pos:self._pos + n]
+        b[:len(known)] = known
+        b[len(known):n] = bytes(n - len(known))
+        self._pos += n
+        return n
+
+
+class UploadTokens:
+    """Signed, expiring upload tokens binding a filename and size to the CRC32 checked at preflight
+
+    Tokens are stateless, any worker holding the same secret can verify them.
+    """
+
+    def __init__(self, secret, max_age=UPLOAD_TOKEN_MAX_AGE):
+        self._serializer = URLSafeTimedSerializer(secret, salt='mosaic-upload-token')
+        self.max_age = max_age
+
+    def issue(self, filename, size, crc32):
+        return self._serializer.dumps({'filename': filename, 'size': size, 'crc32': crc32})
+
+    def read(self, token, filename):
+        """Return the claims of a token issued for filename
+
+        Raises:
+            ValueError: If the token is invalid, expired or for another file
+        """
+        try:
+            claims = self._serializer.loads(token, max_age=self.max_age)
+        except SignatureExpired:
+            raise ValueError('Upload token expired, check the file again')
+        except BadSignature:
+            raise ValueError('Invalid upload token')
+        if claims['filename'] != filename:
+            raise ValueError('Upload token was issued for a different file')
+        return claims
+
+    @staticmethod
+    def expected_crc32(claims, size):
+        """Return the CRC32 in a token's claims if they are for a file of this size
+
+        Raises:
+            ValueError: If the token was issued for another size
+        """
+        if claims['size'] != size:
+            raise ValueError('Upload token was issued for a different file')
+        return claims['crc32']
+
+    def verify(self, token, filename, size):
+        """Return the CRC32 a token was issued for
+
+        Raises:
+            ValueError: If the token is invalid, expired or for another file
+        """
+        return self.expected_crc32(self.read(token, filename), size)
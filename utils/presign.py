@@ -0,0 +1,75 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Minimum lifetime of a handed-out download URL
+PRESIGN_EXPIRY = int(os.environ.get('PRESIGN_EXPIRY', 3600))
+# Width of the window in which requests for a key share one signature
+PRESIGN_BUCKET_SECONDS = int(os.environ.get('PRESIGN_BUCKET_SECONDS', 300))
+# Signed URLs kept per worker process
+PRESIGN_CACHE_SIZE = int(os.environ.get('PRESIGN_CACHE_SIZE', 20000))
+# Most keys signed by one batch request
+PRESIGN_BATCH_LIMIT = int(os.environ.get('PRESIGN_BATCH_LIMIT', 5000))
+
+
+class PresignCache:
+    """LRU cache of presigned GET URLs keyed by (object key, expiry bucket)
+
+    Time is cut into windows of bucket_seconds. The first request for a key
+    in a window signs a URL valid for expiry + bucket_seconds, and every
+    later request in that window gets the same URL, which still has at least
+    `expiry` seconds left. Popular files are signed once per window instead
+    of once per request.
+    """
+
+    def __init__(self, s3_client, bucket, expiry=PRESIGN_EXPIRY, bucket_seconds=PRESIGN_BUCKET_SECONDS,
+                 max_entries=PRESIGN_CACHE_SIZE):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.expiry = expiry
+        self.bucket_seconds = bucket_seconds
+        self.max_entries = max_entries
+        self._urls = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _sign(self, key):
+        return self.s3_client.generate_presigned_url(
+            'get_object',
+            Params={'Bucket': self.bucket, 'Key': key},
+            ExpiresIn=self.expiry + self.bucket_seconds
+        )
+
+    def urls(self, keys):
+        """Return {key: presigned URL}, signing only keys not cached in the current window"""
+        keys = list(dict.fromkeys(keys))
+        window = int(time.time() // self.bucket_seconds)
+        result = {}
+        missing = []
+        with self._lock:
+            for key in keys:
+                url = self._urls.get((key, window))
+                if url is None:
+                    missing.append(key)
+                else:
+                    self._urls.move_to_end((key, window))
+                    result[key] = url
+            self.hits += len(result)
+            self.misses += len(missing)
+
+        # Sign outside the lock, it is the expensive part
+        signed = {key: self._sign(key) for key in missing}
+        result.update(signed)
+
+        with self._lock:
+            for key, url in signed.items():
+                self._urls[(key, window)] = url
+            # Entries of past windows age out of the LRU end first
+            while len(self._urls) > self.max_entries:
+                self._urls.popitem(last=False)
+        return result
+
+    def url(self, key):
+        return self.urls([key])[key]
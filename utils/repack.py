@@ -0,0 +1,243 @@
+import json
+import os
+import time
+
+#local
+from utils.lazy import lazy_import
+from utils.manifest import group_manifest
+
+h5py = lazy_import('h5py')
+np = lazy_import('numpy')
+
+# Repack files uploaded through /api/s3/upload before storing them
+REPACK_ON_INGEST = os.environ.get('REPACK_ON_INGEST', '0') == '1'
+# HDF5 filter of the repacked arrays: gzip, lzf or none
+REPACK_COMPRESSION = os.environ.get('REPACK_COMPRESSION', 'gzip')
+# gzip level, 1 (fastest) to 9 (smallest)
+REPACK_COMPRESSION_LEVEL = int(os.environ.get('REPACK_COMPRESSION_LEVEL', 4))
+# Rows per chunk of a stacked array. One row per chunk reads a single beta
+# without decompressing its neighbours; more rows favour reads across betas.
+REPACK_CHUNK_ROWS = int(os.environ.get('REPACK_CHUNK_ROWS', 1))
+# Most uncompressed bytes per chunk, long rows are split into several chunks
+REPACK_CHUNK_BYTES = int(os.environ.get('REPACK_CHUNK_BYTES', 1024 * 1024))
+
+# Written to the root attribute 'mosaic_layout' of repacked files
+REPACK_LAYOUT = 'stacked-v1'
+# Rows of a stacked group, one per original 1-D dataset
+STACKED_DATA = '_stacked'
+# Index table of a stacked group: the original name and attributes of each row
+STACKED_INDEX = '_index'
+# Root dataset holding the JSON metadata of the whole file, readable at once
+CONSOLIDATED_METADATA = '_metadata'
+
+COMPRESSIONS = ('gzip', 'lzf', 'none')
+
+
+def filter_options(compression=REPACK_COMPRESSION, level=REPACK_COMPRESSION_LEVEL):
+    """create_dataset() keywords of a compression filter
+
+    Raises:
+        ValueError: If the filter is not one of COMPRESSIONS
+    """
+    if compression not in COMPRESSIONS:
+        raise ValueError(f"Unknown compression {compression!r}, use one of {', '.join(COMPRESSIONS)}")
+    if compression == 'none':
+        return {}
+    # Byte shuffling groups the exponent bytes of floats, which compresses much better
+    options = {'compression': compression, 'shuffle': True}
+    if compression == 'gzip':
+        options['compression_opts'] = level
+    return options
+
+
+def chunk_shape(rows, length, itemsize, chunk_rows=REPACK_CHUNK_ROWS, chunk_bytes=REPACK_CHUNK_BYTES):
+    chunk_rows = min(rows, max(1, chunk_rows))
+    return (chunk_rows, min(length, max(1, chunk_bytes // (itemsize * chunk_rows))))
+
+
+def _copy_attrs(src, dst):
+    for name in src.attrs:
+        dst.attrs.create(name, src.attrs[name], dtype=src.attrs.get_id(name).dtype)
+
+
+def _column_dtype(values):
+    """Index table column type of one attribute over all rows, or None if the values do not fit one"""
+    if all(isinstance(value, (str, bytes)) for value in values):
+        return h5py.string_dtype()
+    arrays = [np.asarray(value) for value in values]
+    if any(array.dtype.kind not in 'biuf' for array in arrays):
+        return None
+    dtype = np.result_type(*arrays)
+    if all(array.ndim == 0 for array in arrays):
+        return dtype
+    if all(array.ndim == 1 for array in arrays):
+        return h5py.vlen_dtype(dtype)
+    return None
+
+
+def stackable(group):
+    """Whether every child of a group is a 1-D numeric dataset of the same length and
+    dtype, with the same attribute names, e.g. a group of betas"""
+    datasets = [group.get(name, getlink=True) for name in group]
+    if not datasets or not all(isinstance(link, h5py.HardLink) for link in datasets):
+        return False
+    datasets = [group[name] for name in group]
+    if not all(isinstance(dataset, h5py.Dataset) for dataset in datasets):
+        return False
+    first = datasets[0]
+    if len(first.shape or ()) != 1 or first.dtype.kind not in 'biuf':
+        return False
+    attr_names = set(first.attrs)
+    return all(dataset.shape == first.shape and dataset.dtype == first.dtype
+               and set(dataset.attrs) == attr_names for dataset in datasets)
+
+
+def index_table(datasets):
+    """Structured array with each dataset's name and attributes, or None if an
+    attribute has no common column type"""
+    names = [os.path.basename(dataset.name) for dataset in datasets]
+    fields = [('name', h5py.string_dtype())]
+    columns = {}
+    for attr in datasets[0].attrs:
+        values = [dataset.attrs[attr] for dataset in datasets]
+        dtype = _column_dtype(values)
+        if dtype is None or attr == 'name':
+            return None
+        fields.append((attr, dtype))
+        columns[attr] = values
+    table = np.empty(len(datasets), dtype=fields)
+    table['name'] = names
+    for attr, values in columns.items():
+        if h5py.check_string_dtype(table.dtype[attr]) is None and h5py.check_vlen_dtype(table.dtype[attr]) is not None:
+            # Assigned one by one, numpy would otherwise try to broadcast the arrays
+            for row, value in enumerate(values):
+                table[attr][row] = np.asarray(value)
+        else:
+            table[attr] = values
+    return table
+
+
+def _stack_group(src, dst, filters, chunking):
+    """Write the datasets of a stackable group as the rows of one 2-D array, or return None"""
+    datasets = [src[name] for name in src]
+    table = index_table(datasets)
+    if table is None:
+        return None
+    rows, length = len(datasets), datasets[0].shape[0]
+    data = dst.create_dataset(STACKED_DATA, shape=(rows, length), dtype=datasets[0].dtype,
+                              chunks=chunk_shape(rows, length, datasets[0].dtype.itemsize, *chunking),
+                              **filters)
+    # One original dataset in memory at a time
+    for row, dataset in enumerate(datasets):
+        data[row] = dataset[()]
+    dst.create_dataset(STACKED_INDEX, data=table)
+    return [str(name) for name in table['name'].astype(str)]
+
+
+def _copy_dataset(src, dst_group, name, filters, chunking):
+    """Copy a dataset, compressed if it is numeric and not scalar"""
+    if not src.shape or src.dtype.kind not in 'biufc' or src.size == 0:
+        src.parent.copy(src, dst_group, name=name)
+        return
+    rows_per_block = max(1, chunking[1] * 16 // max(1, src[0:1].nbytes))
+    dst = dst_group.create_dataset(name, shape=src.shape, dtype=src.dtype, chunks=True, **filters)
+    for start in range(0, src.shape[0], rows_per_block):
+        dst[start:start + rows_per_block] = src[start:start + rows_per_block]
+    _copy_attrs(src, dst)
+
+
+def _repack_group(src, dst, filters, chunking, stacked):
+    _copy_attrs(src, dst)
+    if src.name != '/' and stackable(src):
+        names = _stack_group(src, dst, filters, chunking)
+        if names is not None:
+            stacked[src.name] = names
+            return
+    for name in src:
+        link = src.get(name, getlink=True)
+        if not isinstance(link, h5py.HardLink):
+            dst[name] = link
+            continue
+        child = src[name]
+        if isinstance(child, h5py.Group):
+            _repack_group(child, dst.create_group(name, track_order=True), filters, chunking, stacked)
+        elif isinstance(child, h5py.Dataset):
+            _copy_dataset(child, dst, name, filters, chunking)
+        else:
+            src.copy(child, dst, name=name)
+
+
+def repack_hdf5(src, dst_path, compression=REPACK_COMPRESSION, level=REPACK_COMPRESSION_LEVEL,
+                chunk_rows=REPACK_CHUNK_ROWS, chunk_bytes=REPACK_CHUNK_BYTES, provenance=None):
+    """Rewrite an HDF5 file for fast partial reads
+
+    Every group whose children are 1-D datasets of one length and dtype, like
+    'betas', becomes a 2-D chunked, compressed '_stacked' array with one row
+    per dataset, plus an '_index' table holding each row's original name and
+    attributes. Other datasets are copied compressed. The JSON manifest of
+    the result, with the row names of every stacked group, is written to the
+    '_metadata' dataset so a reader gets the whole layout in one read.
+
+    Args:
+        src: Path or seekable file object of the original file
+        dst_path: Path of the repacked file
+        compression: One of COMPRESSIONS
+        level: gzip level
+        chunk_rows: Rows per chunk of the stacked arrays
+        chunk_bytes: Most uncompressed bytes per chunk
+        provenance: JSON-able dict stored under 'source' in the metadata,
+            e.g. the original file's hashes
+
+    Returns:
+        Dict of the layout, stacked groups and rows, and the seconds taken
+
+    Raises:
+        ValueError: If the compression is unknown
+    """
+    filters = filter_options(compression, level)
+    chunking = (chunk_rows, chunk_bytes)
+    start = time.perf_counter()
+    stacked = {}
+    with h5py.File(src, 'r') as f_in, h5py.File(dst_path, 'w', track_order=True) as f_out:
+        _repack_group(f_in, f_out, filters, chunking, stacked)
+        f_out.attrs['mosaic_layout'] = REPACK_LAYOUT
+        consolidated = {
+            'layout': REPACK_LAYOUT,
+            'compression': compression,
+            'source': provenance or {},
+            'stacked': stacked,
+            'manifest': group_manifest(f_out),
+        }
+        f_out.create_dataset(CONSOLIDATED_METADATA, data=json.dumps(consolidated),
+                             dtype=h5py.string_dtype())
+    return {
+        'layout': REPACK_LAYOUT,
+        'groupsStacked': len(stacked),
+        'rowsStacked': sum(len(names) for names in stacked.values()),
+        'seconds': round(time.perf_counter() - start, 3),
+    }
+
+
+def read_consolidated_metadata(h5file):
+    """The '_metadata' dict of a repacked file, or None for any other file"""
+    if CONSOLIDATED_METADATA not in h5file:
+        return None
+    return json.loads(h5file[CONSOLIDATED_METADATA][()])
+
+
+def read_stacked_row(h5file, group, name, metadata=None):
+    """Values of the original dataset `name` of a stacked group
+
+    Args:
+        h5file: Open repacked h5py.File
+        group: Path of the original group, e.g. '/betas'
+        name: Name of the original dataset
+        metadata: Consolidated metadata already read, looked up otherwise
+
+    Raises:
+        KeyError: If the group was not stacked or has no such dataset
+    """
+    names = (metadata or read_consolidated_metadata(h5file) or {}).get('stacked', {}).get(group, [])
+    if name not in names:
+        raise KeyError(f"{group}/{name} is not a stacked dataset")
+    return h5file[group][STACKED_DATA][names.index(name)]
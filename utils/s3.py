@@ -0,0 +1,160 @@
+import logging
+import os
+import threading
+
+#local
+from utils.fetch import HEAD_CONCURRENCY, HEAD_TIMEOUT
+from utils.lazy import lazy_import
+from utils.metrics import instrument_s3_client
+
+boto3 = lazy_import('boto3')
+
+AWS_REGION = os.environ.get('AWS_REGION', 'us-east-1')
+# Custom endpoint, e.g. a local S3 stand-in or a VPC endpoint
+S3_ENDPOINT_URL = os.environ.get('S3_ENDPOINT_URL') or None
+# Connections kept open per worker process: one per concurrent metadata HEAD
+# plus one per gunicorn request thread (see gunicorn.conf.py)
+S3_MAX_POOL_CONNECTIONS = int(os.environ.get(
+    'S3_MAX_POOL_CONNECTIONS', max(HEAD_CONCURRENCY, 10) + int(os.environ.get('GUNICORN_THREADS', 8))))
+S3_TCP_KEEPALIVE = os.environ.get('S3_TCP_KEEPALIVE', '1') == '1'
+S3_CONNECT_TIMEOUT = float(os.environ.get('S3_CONNECT_TIMEOUT', HEAD_TIMEOUT))  # seconds
+S3_READ_TIMEOUT = float(os.environ.get('S3_READ_TIMEOUT', HEAD_TIMEOUT))  # seconds
+# botocore retry policy: 'standard' backs off exponentially with jitter, 'adaptive' also rate limits the client
+S3_MAX_ATTEMPTS = int(os.environ.get('S3_MAX_ATTEMPTS', 5))
+S3_RETRY_MODE = os.environ.get('S3_RETRY_MODE', 'standard')
+
+_clients = {}
+# pid -> whether that process's client found credentials
+_has_credentials = {}
+_clients_lock = threading.Lock()
+
+
+class PoolStats:
+    """Connection counters of this process's S3 client
+
+    botocore's before-send event counts requests and urllib3's debug log
+    counts connections it had to open, each one a TCP and TLS handshake.
+    Every other request reused a pooled connection.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.requests = 0
+            self.new_connections = 0
+            self.dropped_connections = 0
+            self.discarded_connections = 0
+
+    def count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'pid': os.getpid(),
+                'requests': self.requests,
+                'poolHits': max(self.requests - self.new_connections - self.dropped_connections, 0),
+                'poolMisses': self.new_connections + self.dropped_connections,
+                'newConnections': self.new_connections,
+                'droppedConnections': self.dropped_connections,
+                'discardedConnections': self.discarded_connections,
+                'maxPoolConnections': S3_MAX_POOL_CONNECTIONS
+            }
+
+
+pool_stats = PoolStats()
+
+
+class _ConnectionLogCounter(logging.Filter):
+    """Count urllib3 connection pool events from its log records
+
+    urllib3 only reports connection setup through debug logging. The filter
+    sees every record of its logger, and drops the debug ones we only turned
+    on for counting so they do not reach the app's log handlers.
+    """
+
+    def __init__(self, drop_debug):
+        super().__init__()
+        self.drop_debug = drop_debug
+
+    def filter(self, record):
+        message = record.msg if isinstance(record.msg, str) else ''
+        if message.startswith('Starting new HTTP'):
+            pool_stats.count('new_connections')
+        elif message.startswith('Resetting dropped connection'):
+            pool_stats.count('dropped_connections')
+        elif message.startswith('Connection pool is full'):
+            pool_stats.count('discarded_connections')
+        return not (self.drop_debug and record.levelno <= logging.DEBUG)
+
+
+def _install_connection_counter():
+    pool_logger = logging.getLogger('urllib3.connectionpool')
+    if any(isinstance(f, _ConnectionLogCounter) for f in pool_logger.filters):
+        return
+    drop_debug = not pool_logger.isEnabledFor(logging.DEBUG)
+    pool_logger.addFilter(_ConnectionLogCounter(drop_debug))
+    if drop_debug:
+        pool_logger.setLevel(logging.DEBUG)
+
+
+def client_config():
+    from botocore.config import Config
+    return Config(
+        max_pool_connections=S3_MAX_POOL_CONNECTIONS,
+        tcp_keepalive=S3_TCP_KEEPALIVE,
+        connect_timeout=S3_CONNECT_TIMEOUT,
+        read_timeout=S3_READ_TIMEOUT,
+        retries={'max_attempts': S3_MAX_ATTEMPTS, 'mode': S3_RETRY_MODE}
+    )
+
+
+def get_s3_client():
+    """Return this process's S3 client, creating it on first use
+
+    Clients are never shared across fork: with gunicorn's preload_app the
+    master imports the app, and a client (with its open connections) made
+    there must not be reused by the forked workers. Each process builds its
+    own session and client the first time it needs one, and all its threads
+    share that client, which boto3 allows.
+    """
+    pid = os.getpid()
+    client = _clients.get(pid)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(pid)
+            if client is None:
+                _clients.clear()
+                _has_credentials.clear()
+                pool_stats.reset()
+                _install_connection_counter()
+                session = boto3.session.Session()
+                client = session.client('s3', region_name=AWS_REGION, endpoint_url=S3_ENDPOINT_URL,
+                                        config=client_config())
+                client.meta.events.register('before-send.s3', lambda **kwargs: pool_stats.count('requests'))
+                instrument_s3_client(client)
+                # Resolved by the client already, from the environment, config files or instance metadata
+                _has_credentials[pid] = session.get_credentials() is not None
+                _clients[pid] = client
+    return client
+
+
+class S3ClientProxy:
+    """Stand-in for a boto3 S3 client that forwards to the current process's client
+
+    Lets modules keep a single module-level `s3_client` while the real client
+    is created per process after fork. It is true only if that client has
+    credentials, so `if not s3_client:` turns requests away before botocore
+    fails to sign them. Testing it builds the client.
+    """
+
+    def __bool__(self):
+        get_s3_client()
+        return _has_credentials.get(os.getpid(), False)
+
+    def __getattr__(self, name):
+        return getattr(get_s3_client(), name)
@@ -0,0 +1,144 @@
+import io
+import os
+import threading
+from collections import OrderedDict
+
+# Granularity of range requests and cached blocks
+S3_BLOCK_SIZE = int(os.environ.get('S3_BLOCK_SIZE', 256 * 1024))
+# Memory budget of a block cache
+S3_BLOCK_CACHE_BYTES = int(os.environ.get('S3_BLOCK_CACHE_BYTES', 64 * 1024 * 1024))
+
+
+class BlockCache:
+    """Thread-safe LRU cache of object blocks, bounded by total bytes"""
+
+    def __init__(self, max_bytes=S3_BLOCK_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self._blocks = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, block_id):
+        with self._lock:
+            block = self._blocks.get(block_id)
+            if block is None:
+                self.misses += 1
+                return None
+            self._blocks.move_to_end(block_id)
+            self.hits += 1
+            return block
+
+    def put(self, block_id, block):
+        with self._lock:
+            if block_id in self._blocks:
+                return
+            self._blocks[block_id] = block
+            self._bytes += len(block)
+            while self._bytes > self.max_bytes and self._blocks:
+                _, evicted = self._blocks.popitem(last=False)
+                self._bytes -= len(evicted)
+
+
+class S3RangeFile(io.RawIOBase):
+    """Seekable read-only file object over an S3 object
+
+    Reads are served in fixed-size blocks fetched with HTTP range requests,
+    and contiguous missing blocks are coalesced into one request. h5py can
+    open it directly (`h5py.File(S3RangeFile(...), 'r')`) and then only
+    fetches the blocks that hold the metadata or data it touches.
+    """
+
+    def __init__(self, s3_client, bucket, key, block_size=S3_BLOCK_SIZE, cache=None, size=None, etag=None):
+        """
+        Args:
+            s3_client: boto3 S3 client
+            bucket: Bucket of the object
+            key: Key of the object
+            block_size: Size of each range request block
+            cache: BlockCache to share blocks with other readers, a private one by default
+            size: Object size, HEADed if not given
+            etag: Object ETag, HEADed if not given. Cached blocks are keyed on it.
+        """
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.key = key
+        self.block_size = block_size
+        self.cache = cache if cache is not None else BlockCache()
+        if size is None or etag is None:
+            response = s3_client.head_object(Bucket=bucket, Key=key)
+            size, etag = response['ContentLength'], response['ETag']
+        self.size = size
+        self.etag = etag
+        self._pos = 0
+        self.bytes_fetched = 0
+        self.requests = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._pos, io.SEEK_END: self.size}[whence]
+        self._pos = max(0, base + offset)
+        return self._pos
+
+    def _block_id(self, index):
+        return (self.bucket, self.key, self.etag, self.block_size, index)
+
+    def _fetch(self, first, last):
+        """Fetch blocks first..last (inclusive) with one range request and cache them"""
+        start = first * self.block_size
+        end = min((last + 1) * self.block_size, self.size) - 1
+        response = self.s3_client.get_object(
+            Bucket=self.bucket, Key=self.key, Range=f"bytes={start}-{end}", IfMatch=self.etag)
+        data = response['Body'].read()
+        self.bytes_fetched += len(data)
+        self.requests += 1
+        blocks = {}
+        for index in range(first, last + 1):
+            offset = (index - first) * self.block_size
+            blocks[index] = data[offset:offset + self.block_size]
+            self.cache.put(self._block_id(index), blocks[index])
+        return blocks
+
+    def readinto(self, b):
+        if self._pos >= self.size:
+            return 0
+        n = min(len(b), self.size - self._pos)
+        first = self._pos // self.block_size
+        last = (self._pos + n - 1) // self.block_size
+
+        blocks = {}
+        missing = []
+        for index in range(first, last + 1):
+            block = self.cache.get(self._block_id(index))
+            if block is None:
+                missing.append(index)
+            else:
+                blocks[index] = block
+        # Coalesce runs of missing blocks into single range requests
+        run_start = None
+        for i, index in enumerate(missing):
+            if run_start is None:
+                run_start = index
+            if i + 1 == len(missing) or missing[i + 1] != index + 1:
+                blocks.update(self._fetch(run_start, index))
+                run_start = None
+
+        view = memoryview(b)
+        written = 0
+        for index in range(first, last + 1):
+            block = blocks[index]
+            offset = self._pos + written - index * self.block_size
+            chunk = block[offset:offset + n - written]
+            view[written:written + len(chunk)] = chunk
+            written += len(chunk)
+        self._pos += written
+        return written
@@ -0,0 +1,99 @@
+import io
+import os
+
+#local
+from utils.lazy import lazy_import
+
+np = lazy_import('numpy')
+
+# Largest hyperslab returned by one slice request
+SLICE_MAX_BYTES = int(os.environ.get('SLICE_MAX_BYTES', 256 * 1024 * 1024))
+# Size of the body chunks a .npy response is streamed in
+SLICE_STREAM_CHUNK = 1024 * 1024
+
+
+def parse_selection(sel, ndim):
+    """Parse a numpy-style selection like '0:10,5' or '...,::2' into an index tuple
+
+    Only integers, slices and a single ellipsis are supported, which h5py can
+    turn into one hyperslab read. An empty selection means the whole dataset.
+
+    Raises:
+        ValueError: If the selection is malformed or has too many dimensions
+    """
+    if not sel or not sel.strip():
+        return ()
+    index = []
+    for part in sel.split(','):
+        part = part.strip()
+        if part == '...':
+            if Ellipsis in index:
+                raise ValueError("Selection can only contain one '...'")
+            index.append(Ellipsis)
+        elif ':' in part:
+            fields = part.split(':')
+            if len(fields) > 3:
+                raise ValueError(f"Invalid slice '{part}'")
+            try:
+                index.append(slice(*[int(field) if field.strip() else None for field in fields]))
+            except ValueError:
+                raise ValueError(f"Invalid slice '{part}'")
+        else:
+            try:
+                index.append(int(part))
+            except ValueError:
+                raise ValueError(f"Invalid index '{part}', use integers and start:stop:step slices")
+    if len([i for i in index if i is not Ellipsis]) > ndim:
+        raise ValueError(f"Selection has more than the dataset's {ndim} dimensions")
+    return tuple(index)
+
+
+def selection_nbytes(dataset, index):
+    """Bytes a selection would read, computed from the shape alone"""
+    shape = list(dataset.shape)
+    if Ellipsis in index:
+        at = index.index(Ellipsis)
+        index = index[:at] + (slice(None),) * (len(shape) - len(index) + 1) + index[at + 1:]
+    count = 1
+    for dim, length in enumerate(shape):
+        if dim >= len(index) or isinstance(index[dim], slice):
+            selected = index[dim] if dim < len(index) else slice(None)
+            count *= len(range(*selected.indices(length)))
+        elif not -length <= index[dim] < length:
+            raise ValueError(f"Index {index[dim]} is out of range for dimension {dim} of size {length}")
+    return count * dataset.dtype.itemsize
+
+
+def iter_npy(array, chunk_size=SLICE_STREAM_CHUNK):
+    """Yield an array as the bytes of a .npy file, header first, one chunk at a time"""
+    array = np.asarray(array, order='C')
+    header = io.BytesIO()
+    np.lib.format.write_array_header_1_0(header, np.lib.format.header_data_from_array_1_0(array))
+    yield header.getvalue()
+    data = memoryview(array.reshape(-1).view(np.uint8))
+    for offset in range(0, len(data), chunk_size):
+        yield data[offset:offset + chunk_size].tobytes()
+
+
+def arrow_bytes(array, dataset_path):
+    """Serialize an array as an Arrow IPC stream with one flat 'values' column
+
+    The original shape is kept in the schema metadata. Needs the optional
+    pyarrow package.
+
+    Raises:
+        ValueError: If pyarrow is not installed
+    """
+    try:
+        import pyarrow as pa
+    except ImportError:
+        raise ValueError("Arrow output needs the optional pyarrow package, use format=npy")
+    table = pa.table({'values': np.asarray(array, order='C').reshape(-1)})
+    table = table.replace_schema_metadata({
+        'dataset': dataset_path,
+        'shape': ','.join(str(n) for n in np.shape(array)),
+    })
+    sink = io.BytesIO()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue()
@@ -0,0 +1,135 @@
+import gzip
+import json
+import os
+import tempfile
+import time
+from datetime import datetime
+
+# Directory of the precompressed catalog snapshots, also servable by nginx
+SNAPSHOT_DIR = os.environ.get('SNAPSHOT_DIR', 'snapshots')
+# Seconds between scheduled snapshot rebuilds, uploads trigger one right away
+SNAPSHOT_INTERVAL = float(os.environ.get('SNAPSHOT_INTERVAL', 300))
+# Old versions kept next to the current one, for pages still holding their URL
+SNAPSHOT_KEEP = int(os.environ.get('SNAPSHOT_KEEP', 3))
+
+# Name of the pointer to the current version
+CURRENT_FILE = 'current.json'
+
+# Precompressed variants by Content-Encoding, in order of preference
+ENCODINGS = {'br': '.br', 'gzip': '.gz'}
+
+
+def snapshot_filename(version):
+    return f"catalog-{version}.json"
+
+
+def entry_to_json(entry):
+    """Catalog entry with the raw byte size, the page formats sizes itself"""
+    return {
+        'key': entry['key'],
+        'etag': entry['etag'],
+        'lastModified': entry['last_modified'].isoformat(),
+        'size': entry['size'],
+        'metadata': entry['metadata'],
+    }
+
+
+def entry_from_json(data):
+    return {
+        'key': data['key'],
+        'etag': data['etag'],
+        'last_modified': datetime.fromisoformat(data['lastModified']),
+        'size': data['size'],
+        'metadata': data['metadata'],
+    }
+
+
+def _write_atomic(path, data):
+    """Write a file under a temporary name and move it into place"""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def _compressors():
+    compressors = {'gzip': lambda data: gzip.compress(data, compresslevel=9, mtime=0)}
+    try:
+        import brotli
+    except ImportError:
+        return compressors
+    compressors['br'] = lambda data: brotli.compress(data, quality=11)
+    return compressors
+
+
+def current_snapshot(directory=SNAPSHOT_DIR):
+    """Return the current snapshot's pointer {version, generatedAt, files, encodings}, or None"""
+    try:
+        with open(os.path.join(directory, CURRENT_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_snapshot(entries, version, directory=SNAPSHOT_DIR, keep=SNAPSHOT_KEEP):
+    """Write catalog-<version>.json with gzip and, if installed, brotli variants
+
+    Versions are content hashes, so an unchanged catalog is not written
+    again. The variants are written before the pointer to them moves, so a
+    reader never sees a version with missing files.
+
+    Returns:
+        The snapshot pointer and whether a new version was written
+    """
+    current = current_snapshot(directory)
+    if current and current['version'] == version:
+        return current, False
+    os.makedirs(directory, exist_ok=True)
+
+    body = json.dumps({
+        'version': version,
+        'generatedAt': datetime.utcnow().isoformat() + 'Z',
+        'files': [entry_to_json(entry) for entry in entries],
+    }, separators=(',', ':')).encode()
+    path = os.path.join(directory, snapshot_filename(version))
+    encodings = []
+    for encoding, compress in _compressors().items():
+        _write_atomic(path + ENCODINGS[encoding], compress(body))
+        encodings.append(encoding)
+    _write_atomic(path, body)
+
+    pointer = {'version': version, 'generatedAt': time.time(), 'files': len(entries), 'encodings': encodings}
+    _write_atomic(os.path.join(directory, CURRENT_FILE), json.dumps(pointer).encode())
+    _prune(directory, keep)
+    return pointer, True
+
+
+def _prune(directory, keep):
+    """Remove all but the newest `keep` old versions besides the current one"""
+    snapshots = sorted((entry for entry in os.scandir(directory)
+                        if entry.name.startswith('catalog-') and entry.name.endswith('.json')),
+                       key=lambda entry: entry.stat().st_mtime, reverse=True)
+    for entry in snapshots[keep + 1:]:
+        for suffix in ('', *ENCODINGS.values()):
+            try:
+                os.remove(entry.path + suffix)
+            except FileNotFoundError:
+                pass
+
+
+def load_snapshot(directory=SNAPSHOT_DIR):
+    """Return (entries, version) of the current snapshot, or None if there is none"""
+    current = current_snapshot(directory)
+    if current is None:
+        return None
+    try:
+        with open(os.path.join(directory, snapshot_filename(current['version']))) as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return [entry_from_json(item) for item in data['files']], data['version']
@@ -0,0 +1,241 @@
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from botocore.exceptions import ClientError
+
+#local
+from utils.catalog import HDF5_EXTENSIONS
+from utils.ingest import STAGING_PREFIX
+from utils.lazy import lazy_import
+from utils.repack import STACKED_DATA, STACKED_INDEX
+from utils.s3 import get_s3_client
+from utils.s3file import S3RangeFile
+
+h5py = lazy_import('h5py')
+np = lazy_import('numpy')
+
+# Sidecar summaries live under this prefix as <crc32_hash>.json, next to the files
+SUMMARY_PREFIX = os.environ.get('SUMMARY_PREFIX', 'summaries/')
+# Worker processes of the backfill command
+SUMMARY_BACKFILL_WORKERS = int(os.environ.get('SUMMARY_BACKFILL_WORKERS', os.cpu_count() or 1))
+
+# Bumped when the summary format changes, the backfill rewrites older sidecars
+SUMMARY_VERSION = 1
+
+BETAS_GROUP = 'betas'
+NOISE_CEILING_GROUP = 'noiseceilings'
+NOISE_CEILING_PERCENTILES = (5, 25, 50, 75, 95)
+
+
+def summary_key(crc32_hash):
+    return f"{SUMMARY_PREFIX}{crc32_hash}.json"
+
+
+def _as_str(value):
+    return value.decode('utf-8', errors='replace') if isinstance(value, bytes) else str(value)
+
+
+def _float(value):
+    """JSON-friendly float, None for NaN"""
+    value = float(value)
+    return None if value != value else value
+
+
+def group_rows(group):
+    """Names, attribute columns and row shape of the 1-D datasets of a group
+
+    Works on the original layout, one dataset per row, and on groups stacked
+    by utils/repack.py, where the attributes come from the index table.
+
+    Returns:
+        (names, {attribute: [value per row]}, row length, read(row) -> values)
+    """
+    if STACKED_INDEX in group and STACKED_DATA in group:
+        table = group[STACKED_INDEX][()]
+        columns = {name: list(table[name]) for name in table.dtype.names if name != 'name'}
+        data = group[STACKED_DATA]
+        return [_as_str(name) for name in table['name']], columns, data.shape[1], lambda row: data[row]
+    datasets = [group[name] for name in group if isinstance(group.get(name), h5py.Dataset)
+                and len(group[name].shape or ()) == 1]
+    columns = {}
+    for row, dataset in enumerate(datasets):
+        for attr in dataset.attrs:
+            columns.setdefault(attr, [None] * len(datasets))[row] = dataset.attrs[attr]
+    length = datasets[0].shape[0] if datasets else 0
+    return ([os.path.basename(dataset.name) for dataset in datasets], columns, length,
+            lambda row: datasets[row][()])
+
+
+def value_counts(values):
+    """{value: count} of string-like attribute values, missing ones left out"""
+    labels, counts = np.unique([_as_str(value) for value in values if value is not None], return_counts=True)
+    return dict(zip(labels.tolist(), counts.tolist()))
+
+
+def nan_coverage(nan_indices, length):
+    """How many voxels are NaN per beta, and in any or all betas, from the nan_indices attributes
+
+    One bincount over the concatenated indices of every beta, the beta
+    values themselves are not read.
+    """
+    per_beta = [np.unique(np.asarray(indices, dtype=np.int64).ravel()) for indices in nan_indices]
+    per_beta = [indices[(indices >= 0) & (indices < length)] for indices in per_beta]
+    sizes = np.array([len(indices) for indices in per_beta])
+    counts = np.bincount(np.concatenate(per_beta) if per_beta else np.empty(0, np.int64), minlength=length)
+    nan_in_any = int(np.count_nonzero(counts))
+    return {
+        'perBeta': {'min': int(sizes.min()), 'mean': _float(sizes.mean()), 'max': int(sizes.max())} if len(sizes) else None,
+        'voxelsNanInAny': nan_in_any,
+        'voxelsNanInAll': int(np.count_nonzero(counts == len(per_beta))) if per_beta else 0,
+        'fractionNanInAny': _float(nan_in_any / length) if length else None,
+    }
+
+
+def betas_summary(group):
+    names, columns, length, _ = group_rows(group)
+    summary = {'count': len(names), 'length': length}
+    for attr, field in (('phase', 'byPhase'), ('repetition', 'byRepetition')):
+        if attr in columns:
+            summary[field] = value_counts(columns[attr])
+    if 'presented_stimulus_filename' in columns:
+        summary['uniqueStimuli'] = len(value_counts(columns['presented_stimulus_filename']))
+    if 'nan_indices' in columns:
+        summary['nanCoverage'] = nan_coverage([indices for indices in columns['nan_indices'] if indices is not None], length)
+    return summary
+
+
+def noise_ceiling_summary(values):
+    values = np.asarray(values, dtype=np.float64)
+    finite = values[np.isfinite(values)]
+    summary = {'length': int(values.size), 'nanCount': int(np.count_nonzero(np.isnan(values)))}
+    if finite.size:
+        percentiles = np.percentile(finite, NOISE_CEILING_PERCENTILES)
+        summary.update({
+            'min': _float(finite.min()),
+            'max': _float(finite.max()),
+            'mean': _float(finite.mean()),
+            'percentiles': {f"p{p}": _float(v) for p, v in zip(NOISE_CEILING_PERCENTILES, percentiles)},
+        })
+    return summary
+
+
+def summarize_hdf5(fileobj):
+    """Beta counts by phase and repetition, NaN coverage and noise-ceiling
+    statistics of a subject file
+
+    Only the attributes of the betas are read, the noise ceilings are read
+    whole, one dataset at a time.
+
+    Args:
+        fileobj: Path or seekable file object, e.g. an S3RangeFile
+
+    Returns:
+        JSON-able summary dict
+    """
+    summary = {'version': SUMMARY_VERSION}
+    with h5py.File(fileobj, 'r') as f:
+        if isinstance(f.get(BETAS_GROUP), h5py.Group):
+            summary['betas'] = betas_summary(f[BETAS_GROUP])
+        if isinstance(f.get(NOISE_CEILING_GROUP), h5py.Group):
+            names, columns, _, read = group_rows(f[NOISE_CEILING_GROUP])
+            ceilings = {}
+            for row, name in enumerate(names):
+                ceilings[name] = noise_ceiling_summary(read(row))
+                for attr in ('n', 'phase'):
+                    if columns.get(attr) and columns[attr][row] is not None:
+                        ceilings[name][attr] = _as_str(columns[attr][row])
+            summary['noiseCeilings'] = ceilings
+    return summary
+
+
+def put_summary(s3_client, bucket, crc32_hash, summary):
+    s3_client.put_object(Bucket=bucket, Key=summary_key(crc32_hash), Body=json.dumps(summary).encode(),
+                         ContentType='application/json')
+
+
+def get_summary(s3_client, bucket, crc32_hash):
+    """The sidecar summary of a file, or None if it has none yet"""
+    try:
+        response = s3_client.get_object(Bucket=bucket, Key=summary_key(crc32_hash))
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('404', 'NoSuchKey'):
+            return None
+        raise
+    return json.loads(response['Body'].read())
+
+
+def list_summaries(s3_client, bucket):
+    """{crc32_hash: sidecar key} of every stored summary"""
+    paginator = s3_client.get_paginator('list_objects_v2')
+    summaries = {}
+    for page in paginator.paginate(Bucket=bucket, Prefix=SUMMARY_PREFIX):
+        for obj in page.get('Contents', []):
+            summaries[obj['Key'][len(SUMMARY_PREFIX):].removesuffix('.json')] = obj['Key']
+    return summaries
+
+
+# crc32 hashes that already had a summary when the backfill started, set in each worker
+_existing = set()
+
+
+def _backfill_init(existing):
+    _existing.update(existing)
+
+
+def _backfill_one(bucket, key, force):
+    """Summarize one object in a backfill worker process, returning its outcome"""
+    s3_client = get_s3_client()
+    head = s3_client.head_object(Bucket=bucket, Key=key)
+    crc32_hash = head.get('Metadata', {}).get('crc32_hash')
+    if not crc32_hash:
+        return 'no crc32_hash'
+    if crc32_hash in _existing and not force:
+        summary = get_summary(s3_client, bucket, crc32_hash)
+        if summary and summary.get('version') == SUMMARY_VERSION:
+            return 'exists'
+    with S3RangeFile(s3_client, bucket, key, size=head['ContentLength'], etag=head['ETag']) as f:
+        put_summary(s3_client, bucket, crc32_hash, summarize_hdf5(f))
+    return 'written'
+
+
+def backfill(bucket, workers=SUMMARY_BACKFILL_WORKERS, force=False):
+    """Write missing or outdated summaries of every HDF5 object, on a pool of processes
+
+    Returns:
+        {outcome: count}
+    """
+    s3_client = get_s3_client()
+    paginator = s3_client.get_paginator('list_objects_v2')
+    keys = [obj['Key'] for page in paginator.paginate(Bucket=bucket) for obj in page.get('Contents', [])
+            if obj['Key'].endswith(HDF5_EXTENSIONS) and not obj['Key'].startswith(STAGING_PREFIX)]
+    existing = set(list_summaries(s3_client, bucket))
+    outcomes = {}
+    start = time.perf_counter()
+    # Reading attributes and decompressing noise ceilings is CPU-bound, so one process per core
+    with ProcessPoolExecutor(max_workers=workers, initializer=_backfill_init, initargs=(existing,)) as executor:
+        futures = {executor.submit(_backfill_one, bucket, key, force): key for key in keys}
+        for done, future in enumerate(as_completed(futures), 1):
+            try:
+                outcome = future.result()
+            except Exception as e:
+                # e.g. objects that are not valid HDF5
+                outcome = 'failed'
+                print(f"[{done}/{len(keys)}] {futures[future]} failed: {e}")
+            outcomes[outcome] = outcomes.get(outcome, 0) + 1
+            if outcome == 'written':
+                print(f"[{done}/{len(keys)}] {futures[future]}")
+    print(f"{len(keys)} objects in {time.perf_counter() - start:.1f} s: {outcomes}")
+    return outcomes
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Write the summary sidecars of objects uploaded before summaries existed.")
+    parser.add_argument("--bucket", type=str, default=os.environ.get('S3_BUCKET'), help="Bucket to backfill, S3_BUCKET by default.")
+    parser.add_argument("--workers", type=int, default=SUMMARY_BACKFILL_WORKERS, help="Number of worker processes.")
+    parser.add_argument("--force", action="store_true", help="Rewrite summaries that are already up to date.")
+    args = parser.parse_args()
+
+    backfill(args.bucket, workers=args.workers, force=args.force)